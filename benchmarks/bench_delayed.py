@@ -0,0 +1,137 @@
+"""
+Telegram Forward Bot - Delayed Forward Benchmark
+
+Compares memory and CPU per delayed message for three ways of holding a
+message until its forward delay has passed:
+
+    queue        DelayedForwardQueue (one heap, one timer task)
+    tasks        one sleeping asyncio task per message (the old inline sleep)
+    apscheduler  one APScheduler date job per message (schedule_delayed_forward)
+
+Each mode runs in its own process. Delays are spread over --spread seconds
+and results are also scaled to one million items.
+
+Usage:
+    python benchmarks/bench_delayed.py [--items 1000000] [--spread 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ['queue', 'tasks', 'apscheduler']
+# The per-item approaches get slow and large well before a million items
+MODE_LIMITS = {'queue': None, 'tasks': 200000, 'apscheduler': 50000}
+
+def current_rss() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+async def run_mode(mode: str, items: int, spread: float) -> dict:
+    loop = asyncio.get_running_loop()
+    released = 0
+    done = loop.create_future()
+
+    def count(n: int = 1):
+        nonlocal released
+        released += n
+        if released >= items and not done.done():
+            done.set_result(None)
+
+    random.seed(1)
+    delays = [random.uniform(0, spread) for _ in range(items)]
+    payload = ('bot', 'message', 'task', 'filter_result')
+
+    if mode == 'queue':
+        from delayqueue import DelayedForwardQueue
+
+        async def release(batch):
+            count(len(batch))
+
+        queue = DelayedForwardQueue(release)
+        push = lambda delay: queue.push(delay, payload)
+    elif mode == 'tasks':
+        tasks = set()
+
+        async def sleeper(delay, item):
+            await asyncio.sleep(delay)
+            count()
+
+        def push(delay):
+            task = loop.create_task(sleeper(delay, payload))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    else:
+        from datetime import datetime, timedelta, timezone
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+        scheduler = AsyncIOScheduler(timezone='UTC')
+        scheduler.start()
+        seq = iter(range(items))
+
+        async def job(item):
+            count()
+
+        def push(delay):
+            scheduler.add_job(job, 'date', run_date=datetime.now(timezone.utc) + timedelta(seconds=delay),
+                              id=f"delayed_{next(seq)}", args=[payload], misfire_grace_time=None)
+
+    rss_before = current_rss()
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    for delay in delays:
+        push(delay)
+    enqueue_cpu = time.process_time() - cpu_started
+    enqueue_wall = time.perf_counter() - wall_started
+    rss_held = current_rss() - rss_before
+
+    cpu_started = time.process_time()
+    await done
+    release_cpu = time.process_time() - cpu_started
+
+    return {
+        'mode': mode,
+        'items': items,
+        'enqueue_wall_s': round(enqueue_wall, 3),
+        'bytes_per_item': round(rss_held / items, 1),
+        'enqueue_us_per_item': round(enqueue_cpu / items * 1e6, 2),
+        'release_us_per_item': round(release_cpu / items * 1e6, 2),
+        'mb_per_million': round(rss_held / items * 1e6 / 2**20, 1),
+        'cpu_s_per_million': round((enqueue_cpu + release_cpu) / items * 1e6, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000000, help='delayed messages per mode')
+    parser.add_argument('--spread', type=float, default=5.0, help='delays are uniform in [0, spread) seconds')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(run_mode(args.mode, args.items, args.spread))))
+        return
+
+    results = []
+    for mode in MODES:
+        items = min(args.items, MODE_LIMITS[mode] or args.items)
+        completed = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--items', str(items), '--spread', str(args.spread)],
+            capture_output=True, text=True, check=True, cwd=ROOT
+        )
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':<14}{'items':>10}{'bytes/item':>12}{'enqueue us':>12}{'release us':>12}"
+          f"{'MB/1M':>10}{'CPU s/1M':>10}")
+    for r in results:
+        print(f"{r['mode']:<14}{r['items']:>10}{r['bytes_per_item']:>12}{r['enqueue_us_per_item']:>12}"
+              f"{r['release_us_per_item']:>12}{r['mb_per_million']:>10}{r['cpu_s_per_million']:>10}")
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
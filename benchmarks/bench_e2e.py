@@ -0,0 +1,417 @@
+"""
+Telegram Forward Bot - End-to-End Throughput Benchmark
+
+Runs the real forwarding pipeline against a synthetic stream of channel
+posts. benchmarks/fake_bot_api.py runs as a separate process in place of
+Telegram. The bot polls it with PTB and handles every update with
+handle_incoming_message. The database is a fresh SQLite file in a
+temporary directory.
+
+The stream is generated from a seed:
+
+    --sources            source channels
+    --tasks-per-source   forward tasks on each source, each to its own destination
+    --filter-mix         share of tasks with each filter:
+                         keyword, regex, crypto, near_duplicate
+    --mix                share of posts that are text, photo or album (2-5 photos)
+    --duplicate-rate     share of posts repeating an earlier post from the same source
+
+Reported:
+    messages_per_s       updates per second, from the first push until the last
+                         update is handled and the send queues are empty
+    latency_p50/p99_ms   from pushing an update to the fake server until
+                         handle_incoming_message returns for it, which is
+                         once its forwards are filtered and queued
+    peak_rss_mb          peak RSS of the bot process
+    write_amplification  bytes the bot process passed to write() (wchar in
+                         /proc/self/io, which leaves out sockets) per byte
+                         the database grew
+
+With --rate 0 (the default) every update is queued at once. That measures
+peak throughput, and latency is then mostly time spent waiting in the
+queue. Give --rate to offer a steady load instead. The outbound send
+limits are lifted unless --paced is given, so they don't cap the result.
+Tracing is off, and the bot's output is held in memory while it runs and
+printed afterwards. That leaves the database and its journal as the only
+files written, so wchar counts database writes alone.
+
+Results are written as JSON with the commit they were measured on.
+--compare reports the change against an earlier result and exits
+non-zero when a metric is worse by more than --max-regression.
+
+Usage:
+    python benchmarks/bench_e2e.py [--messages 5000] [--sources 20] [--tasks-per-source 3]
+                                   [--mix text=0.7,photo=0.2,album=0.1] [--duplicate-rate 0.1]
+                                   [--rate 0] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FILTERS = {
+    'keyword': ('keyword', 'casino,giveaway'),
+    'regex': ('regex', r'\b\d{6,}\b'),
+    'crypto': ('crypto', 'no_crypto'),
+}
+# Words that trip the filters above, each put in a few percent of posts
+TRIGGERS = ['casino', 'giveaway', '4815162342', 'bitcoin']
+TRIGGER_RATE = 0.05
+# Headline metrics and whether higher is better
+HEADLINE = {
+    'messages_per_s': True,
+    'latency_p50_ms': False,
+    'latency_p99_ms': False,
+    'peak_rss_mb': False,
+    'write_amplification': False,
+}
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(','):
+        name, _, share = part.partition('=')
+        mix[name.strip()] = float(share)
+    return mix
+
+def current_rss() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def bytes_written() -> int:
+    """Bytes this process passed to write(); socket sends aren't counted"""
+    with open('/proc/self/io') as f:
+        return int(dict(line.split(': ') for line in f.read().splitlines())['wchar'])
+
+@contextlib.contextmanager
+def held_output():
+    """Keep stdout, stderr and log output in memory, then print it to stderr"""
+    buffer = io.StringIO()
+    handlers = [handler for handler in logging.getLogger().handlers if isinstance(handler, logging.StreamHandler)]
+    streams = [handler.setStream(buffer) for handler in handlers]
+    try:
+        with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(buffer):
+            yield
+    finally:
+        for handler, stream in zip(handlers, streams):
+            handler.setStream(stream)
+        sys.stderr.write(buffer.getvalue())
+
+def percentile(ordered: list, quantile: float) -> float:
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))] if ordered else 0.0
+
+def git_commit() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except OSError:
+        return {'commit': None, 'dirty': None}
+    return {'commit': commit or None, 'dirty': dirty}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# ========== WORKLOAD ==========
+def make_text(rng: random.Random, vocabulary: list) -> str:
+    words = rng.choices(vocabulary, k=rng.randint(5, 60))
+    if rng.random() < TRIGGER_RATE * len(TRIGGERS):
+        words.insert(rng.randrange(len(words) + 1), rng.choice(TRIGGERS))
+    return ' '.join(words).capitalize() + '.'
+
+def generate_stream(args) -> list:
+    """Channel post updates for every source, interleaved as they would arrive"""
+    from fake_bot_api import channel_post
+    rng = random.Random(args.seed)
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ra', 'su', 'ti', 'vo', 'ze', 'pa', 'do', 'ri', 'an', 'el', 'or']
+    vocabulary = [''.join(rng.choices(syllables, k=rng.randint(1, 4))) for _ in range(2000)]
+    kinds, weights = zip(*parse_mix(args.mix).items())
+
+    history = {source: [] for source in range(args.sources)}  # Posts each source can repeat
+    next_id = {source: 0 for source in range(args.sources)}
+    stream = []
+    photos = 0
+    update_id = 1
+    while len(stream) < args.messages:
+        source = rng.randrange(args.sources)
+        chat_id = -1001000000000 - source
+        if history[source] and rng.random() < args.duplicate_rate:
+            # Same content as an earlier post, as a new message
+            posts = rng.choice(history[source])
+        else:
+            kind = rng.choices(kinds, weights)[0]
+            if kind == 'text':
+                posts = [{'text': make_text(rng, vocabulary)}]
+            elif kind == 'photo':
+                photos += 1
+                posts = [{'photo': f"photo{photos}", 'caption': make_text(rng, vocabulary) if rng.random() < 0.5 else None}]
+            else:
+                posts = []
+                for i in range(rng.randint(2, 5)):
+                    photos += 1
+                    posts.append({'photo': f"photo{photos}", 'caption': make_text(rng, vocabulary) if i == 0 else None})
+            history[source].append(posts)
+
+        album = f"album{update_id}" if len(posts) > 1 else None
+        for post in posts:
+            next_id[source] += 1
+            stream.append(channel_post(update_id, chat_id, next_id[source], media_group_id=album, **post))
+            update_id += 1
+    return stream[:args.messages]
+
+async def create_tasks(args, db) -> list:
+    """One user owning tasks-per-source tasks on every source, with filters by --filter-mix"""
+    rng = random.Random(args.seed + 1)
+    mix = parse_mix(args.filter_mix) if args.filter_mix else {}
+    await db.add_user(1, 'bench', 'Bench', 'User')
+    task_ids = []
+    for source in range(args.sources):
+        for n in range(args.tasks_per_source):
+            dest = -1002000000000 - source * args.tasks_per_source - n
+            task_id = await db.create_task(1, -1001000000000 - source, f"Source {source}", dest, f"Destination {dest}")
+            for name, share in mix.items():
+                if rng.random() >= share:
+                    continue
+                if name == 'near_duplicate':
+                    await db.update_task(task_id, near_duplicate_distance=3)
+                else:
+                    await db.add_filter(task_id, *FILTERS[name])
+            task_ids.append(task_id)
+    return task_ids
+
+# ========== RUN ==========
+async def control(session, method: str, path: str, payload=None):
+    async with session.request(method, path, json=payload) as response:
+        return await response.json()
+
+async def feed(args, base_url: str, stream: list, pushed_at: dict, started: float):
+    """Push the stream to the fake server, all at once or at --rate updates per second"""
+    import aiohttp
+    async with aiohttp.ClientSession(base_url) as session:
+        batch = 500 if not args.rate else max(1, int(args.rate * 0.01))
+        for i in range(0, len(stream), batch):
+            if args.rate:
+                await asyncio.sleep(max(0.0, started + i / args.rate - time.time()))
+            chunk = stream[i:i + batch]
+            now = time.time()
+            for update in chunk:
+                post = update['channel_post']
+                pushed_at[(post['chat']['id'], post['message_id'])] = now
+            await control(session, 'POST', '/_control/updates', chunk)
+
+async def run(args, base_url: str, workdir: str) -> dict:
+    import aiohttp
+    from telegram.ext import Application, MessageHandler, filters as tg_filters
+    from database import db
+    from routing import routing
+    from neardup import near_duplicates
+    from forwarder import outbound, send_queue, delayed_queue
+    from downloads import download_manager
+    from metrics import InstrumentedRequest
+    from main import handle_incoming_message
+
+    logging.getLogger().setLevel(logging.WARNING)
+    db.db_file = os.path.join(workdir, 'bench.db')
+    await db.init()
+    task_ids = await create_tasks(args, db)
+    await routing.reload()
+    await near_duplicates.load()
+    if not args.paced:
+        outbound.rate = outbound.chat_rate = outbound.chat_burst = 1e9
+
+    stream = generate_stream(args)
+    pushed_at = {}
+    handled_at = {}
+    finished = asyncio.Event()
+    errors = 0
+
+    async def settle():
+        await finished.wait()
+        # Handlers return once a forward is queued; the sends finish in the send queue
+        await send_queue.join()
+
+    async def handle(update, context):
+        nonlocal errors
+        try:
+            await handle_incoming_message(update, context)
+        except Exception as e:
+            errors += 1
+            print(f"Handler error: {e}", file=sys.stderr)
+        finally:
+            message = update.effective_message
+            handled_at[(message.chat_id, message.message_id)] = time.time()
+            if len(handled_at) >= len(stream):
+                finished.set()
+
+    application = (
+        Application.builder().token('1:fake')
+        .base_url(f"{base_url}/bot")
+        .base_file_url(f"{base_url}/file/bot")
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .build()
+    )
+    application.add_handler(MessageHandler(tg_filters.ALL & ~tg_filters.COMMAND, handle))
+    await application.initialize()
+    await application.start()
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+
+    db_size = os.path.getsize(db.db_file)
+    rss_before = current_rss()
+    started = time.time()
+    # Output is written to files too; hold it back so wchar only counts the database
+    with held_output():
+        written = bytes_written()
+        await feed(args, base_url, stream, pushed_at, started)
+        try:
+            await asyncio.wait_for(settle(), args.timeout)
+        except asyncio.TimeoutError:
+            print(f"Timed out with {len(handled_at)} of {len(stream)} updates handled", file=sys.stderr)
+        ended = time.time()
+        written = bytes_written() - written
+    async with aiohttp.ClientSession(base_url) as session:
+        calls = await control(session, 'GET', '/_control/calls')
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await send_queue.close()
+    await delayed_queue.close()
+    await download_manager.close()
+
+    with sqlite3.connect(db.db_file) as conn:
+        forwarded_rows = conn.execute('SELECT COUNT(*) FROM forwarded_messages').fetchone()[0]
+    growth = os.path.getsize(db.db_file) - db_size
+    sends = sum(count for method, count in calls['counts'].items() if method.startswith(('send', 'copy', 'forward')))
+    latencies = sorted(handled_at[key] - pushed_at[key] for key in handled_at)
+    elapsed = ended - started
+    return {
+        'tasks': len(task_ids),
+        'messages': len(stream),
+        'handled': len(handled_at),
+        'handler_errors': errors,
+        'forwarded': sends,
+        'elapsed_s': round(elapsed, 3),
+        'messages_per_s': round(len(handled_at) / elapsed, 1) if elapsed > 0 else 0.0,
+        'forwards_per_s': round(sends / elapsed, 1) if elapsed > 0 else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'latency_max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'rss_growth_mb': round((current_rss() - rss_before) / 2**20, 1),
+        'db_rows_forwarded': forwarded_rows,
+        'db_bytes_written': written,
+        'db_growth_bytes': growth,
+        'db_bytes_per_forward': round(written / sends, 1) if sends else 0.0,
+        'write_amplification': round(written / growth, 2) if growth > 0 else None,
+        'api_calls': calls['counts'],
+        'api_errors': calls['errors'],
+    }
+
+def compare(result: dict, baseline: dict, max_regression: float) -> bool:
+    """Print each headline metric against the baseline; False if one regressed too far"""
+    ok = True
+    changed = [key for key, value in result['params'].items()
+               if key != 'timeout' and baseline['params'].get(key) != value]
+    if changed:
+        print(f"Note: parameters differ from the baseline: {', '.join(changed)}", file=sys.stderr)
+    for name, higher_is_better in HEADLINE.items():
+        new, old = result['results'].get(name), baseline['results'].get(name)
+        if not new or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > max_regression:
+            flag = '  REGRESSION'
+            ok = False
+        print(f"{name:22} {old:>12} -> {new:>12} ({change:+.1%}){flag}", file=sys.stderr)
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=5000, help='updates in the stream')
+    parser.add_argument('--sources', type=int, default=20, help='source channels')
+    parser.add_argument('--tasks-per-source', type=int, default=3)
+    parser.add_argument('--filter-mix', default='keyword=0.5,regex=0.3,crypto=0.2,near_duplicate=0.2',
+                        help='share of tasks with each filter (keyword, regex, crypto, near_duplicate)')
+    parser.add_argument('--mix', default='text=0.7,photo=0.2,album=0.1', help='share of text, photo and album posts')
+    parser.add_argument('--duplicate-rate', type=float, default=0.1, help='share of posts repeating an earlier one')
+    parser.add_argument('--rate', type=float, default=0.0, help='updates offered per second (0 = all at once)')
+    parser.add_argument('--paced', action='store_true', help='keep the outbound send limits from config')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds the fake Bot API adds to every call')
+    parser.add_argument('--api-jitter', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0, help='share of sends the fake Bot API answers with 429')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=600.0, help='give up waiting after this many seconds')
+    parser.add_argument('--output', help='write the result JSON here')
+    parser.add_argument('--compare', help='an earlier result JSON to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.10,
+                        help='with --compare, fail when a metric is this much worse')
+    args = parser.parse_args()
+    # The run happens in a scratch directory
+    args.output = args.output and os.path.abspath(args.output)
+    args.compare = args.compare and os.path.abspath(args.compare)
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_bot_api.py'), '--port', str(port),
+         '--latency', str(args.api_latency), '--jitter', str(args.api_jitter), '--rate-429', str(args.rate_429)],
+        stdout=subprocess.DEVNULL
+    )
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+    # Slow traces would be written to disk and counted as database writes
+    os.environ['TRACING_ENABLED'] = '0'
+    workdir = tempfile.mkdtemp(prefix='bench_e2e_')
+    cwd = os.getcwd()
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        # Slow traces and other relative paths land in the scratch directory
+        os.chdir(workdir)
+        results = asyncio.run(run(args, f"http://127.0.0.1:{port}", workdir))
+    finally:
+        server.terminate()
+        server.wait()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        **git_commit(),
+        'measured_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'max_regression')},
+        'results': results,
+    }
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(result, json.load(f), args.max_regression):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
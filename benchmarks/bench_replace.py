@@ -0,0 +1,107 @@
+"""
+Telegram Forward Bot - Replacement Benchmark
+
+Compares applying replacement rules one at a time (the original
+replace_text) with the compiled single-pass Replacer, for growing numbers
+of brand-name rules on long posts. Half of the rules ignore case.
+
+Usage:
+    python benchmarks/bench_replace.py [--rules 10,100,1000,5000] [--posts 50] [--length 4096]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import string
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = ['update', 'market', 'price', 'signal', 'today', 'news', 'channel', 'join', 'free', 'alert']
+
+def make_rules(r: random.Random, count: int) -> list:
+    brands = set()
+    while len(brands) < count:
+        brands.add(r.choice(string.ascii_uppercase) + ''.join(r.choices(string.ascii_lowercase, k=r.randint(3, 9))))
+    return [
+        {'old': brand, 'new': f"[{brand.lower()}]", 'case_sensitive': i % 2 == 0}
+        for i, brand in enumerate(sorted(brands))
+    ]
+
+def make_post(r: random.Random, rules: list, length: int) -> str:
+    """A long post where roughly one word in ten is a brand with a rule"""
+    parts = []
+    size = 0
+    while size < length:
+        word = r.choice(rules)['old'] if r.random() < 0.1 else r.choice(WORDS)
+        parts.append(word)
+        size += len(word) + 1
+    return ' '.join(parts)[:length]
+
+def legacy_replace(text: str, replacements: list) -> str:
+    """The original rule-by-rule replace_text, kept here as the reference"""
+    result = text
+    for rep in replacements:
+        if rep.get('case_sensitive', True):
+            result = result.replace(rep['old'], rep.get('new', ''))
+        else:
+            result = re.compile(re.escape(rep['old']), re.IGNORECASE).sub(rep.get('new', ''), result)
+    return result
+
+# Text whose lowercase differs in length from it, or that only matches under Unicode case folding
+EDGE_CASES = [
+    ([{'old': 'istanbul', 'new': 'X', 'case_sensitive': False}], 'İstanbul news', 'X news'),
+    ([{'old': 'İstanbul', 'new': 'X', 'case_sensitive': False}], 'news from İSTANBUL', 'news from X'),
+    ([{'old': 'news', 'new': 'X', 'case_sensitive': False}], 'İstanbul NEWS', 'İstanbul X'),
+    ([{'old': 's', 'new': 'X', 'case_sensitive': False}], 'İ ſ s', 'İ ſ X'),
+]
+
+def check_edge_cases(Replacer):
+    for rules, text, expected in EDGE_CASES:
+        result = Replacer(rules).sub(text)
+        assert result == expected, f"{rules} on {text!r}: {result!r}, expected {expected!r}"
+
+def time_per_post(replace, posts) -> float:
+    started = time.perf_counter()
+    for post in posts:
+        replace(post)
+    return (time.perf_counter() - started) / len(posts) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', default='10,100,1000,5000', help='comma-separated rule counts')
+    parser.add_argument('--posts', type=int, default=50, help='posts per rule count')
+    parser.add_argument('--length', type=int, default=4096, help='characters per post')
+    args = parser.parse_args()
+
+    from textrules import Replacer
+    check_edge_cases(Replacer)
+    results = []
+    for count in (int(value) for value in args.rules.split(',')):
+        r = random.Random(count)
+        rules = make_rules(r, count)
+        posts = [make_post(r, rules, args.length) for _ in range(args.posts)]
+
+        started = time.perf_counter()
+        replacer = Replacer(rules)
+        compile_ms = (time.perf_counter() - started) * 1e3
+
+        results.append({
+            'rules': count,
+            'compile_ms': round(compile_ms, 1),
+            'legacy_us_per_post': round(time_per_post(lambda post: legacy_replace(post, rules), posts), 1),
+            'compiled_us_per_post': round(time_per_post(replacer.sub, posts), 1),
+        })
+
+    print(f"{'rules':>8}{'compile ms':>12}{'legacy us':>12}{'compiled us':>13}{'speedup':>10}")
+    for result in results:
+        speedup = result['legacy_us_per_post'] / result['compiled_us_per_post']
+        print(f"{result['rules']:>8}{result['compile_ms']:>12}{result['legacy_us_per_post']:>12}"
+              f"{result['compiled_us_per_post']:>13}{speedup:>9.1f}x")
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Telegram Forward Bot - Watermark Benchmark
+
+Compares peak RSS and per-photo latency of the watermark pipelines on a
+large synthetic JPEG. Every mode runs in its own process so the peak RSS
+figures do not leak into each other.
+
+Usage:
+    python benchmarks/bench_watermark.py [--size 2560] [--runs 20] [--max-dimension 1280]
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ['legacy', 'standard', 'low_memory', 'standard_capped', 'low_memory_capped']
+
+def make_photo(size: int) -> bytes:
+    """Build a noisy photo-like JPEG similar to what Telegram delivers"""
+    from PIL import Image
+    width, height = size, size * 3 // 4
+    noise = Image.effect_noise((width, height), 48)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    img = Image.merge('RGB', (noise, gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=87, subsampling=2)
+    return output.getvalue()
+
+def legacy_watermark(image_data: bytes, text: str, position: str = 'bottom-right') -> bytes:
+    """The original full-size overlay pipeline, kept here as the reference"""
+    from PIL import Image, ImageDraw, ImageFont
+    img = Image.open(io.BytesIO(image_data))
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(overlay)
+    try:
+        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 24)
+    except Exception:
+        font = ImageFont.load_default()
+    bbox = draw.textbbox((0, 0), text, font=font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    x = img.size[0] - text_width - 20
+    y = img.size[1] - text_height - 20
+    draw.rectangle([x - 5, y - 5, x + text_width + 5, y + text_height + 5], fill=(0, 0, 0, 128))
+    draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
+    result = Image.alpha_composite(img, overlay)
+    background = Image.new('RGB', result.size, (255, 255, 255))
+    background.paste(result, mask=result.split()[3])
+    output = io.BytesIO()
+    background.save(output, format='JPEG', quality=95)
+    return output.getvalue()
+
+def run_mode(mode: str, photo_path: str, runs: int, max_dimension: int) -> dict:
+    """Watermark the photo `runs` times in this process and report the costs"""
+    import config
+    config.WATERMARK_LOW_MEMORY = mode.startswith('low_memory')
+    config.WATERMARK_MAX_DIMENSION = max_dimension if mode.endswith('_capped') else 0
+    from watermark import WatermarkProcessor
+    processor = WatermarkProcessor()
+    
+    with open(photo_path, 'rb') as f:
+        image_data = f.read()
+    
+    if mode == 'legacy':
+        render = lambda: legacy_watermark(image_data, '@ForwardedByBot')
+    else:
+        render = lambda: processor.add_text_watermark(image_data, '@ForwardedByBot')
+    
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    output = b''
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = render()
+        timings.append(time.perf_counter() - started)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    return {
+        'mode': mode,
+        'runs': runs,
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'p95_ms': round(sorted(timings)[int(len(timings) * 0.95) - 1] * 1000, 2) if runs >= 20 else None,
+        'peak_rss_mb': round(rss_after / 1024, 1),
+        'peak_rss_growth_mb': round((rss_after - rss_before) / 1024, 1),
+        'input_kb': round(len(image_data) / 1024, 1),
+        'output_kb': round(len(output) / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2560, help='photo width in pixels')
+    parser.add_argument('--runs', type=int, default=20, help='photos per mode')
+    parser.add_argument('--max-dimension', type=int, default=1280, help='output cap for the *_capped modes')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--photo', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.photo, args.runs, args.max_dimension)))
+        return
+    
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+        f.write(make_photo(args.size))
+        photo_path = f.name
+    
+    try:
+        results = []
+        for mode in MODES:
+            completed = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--photo', photo_path,
+                 '--runs', str(args.runs), '--max-dimension', str(args.max_dimension)],
+                capture_output=True, text=True, check=True, cwd=ROOT
+            )
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    finally:
+        os.unlink(photo_path)
+    
+    print(f"{'mode':<20}{'median ms':>12}{'p95 ms':>10}{'peak RSS MB':>14}{'RSS growth MB':>16}{'output KB':>12}")
+    for r in results:
+        p95 = r['p95_ms'] if r['p95_ms'] is not None else '-'
+        print(f"{r['mode']:<20}{r['median_ms']:>12}{p95:>10}{r['peak_rss_mb']:>14}"
+              f"{r['peak_rss_growth_mb']:>16}{r['output_kb']:>12}")
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
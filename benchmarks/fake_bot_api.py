@@ -0,0 +1,293 @@
+"""
+Telegram Forward Bot - Fake Bot API Server
+
+A local stand-in for the Telegram Bot API, for load testing without
+touching Telegram. It serves getMe, getUpdates (long polling), sendMessage,
+sendPhoto and the other send* methods, copyMessage, sendMediaGroup, getFile
+and file downloads, with configurable latency and injected 429/403 errors.
+Every call is recorded.
+
+Point the bot at it with BOT_API_BASE_URL:
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency 0.05 --rate-429 0.01
+    BOT_API_BASE_URL=http://127.0.0.1:8081 BOT_TOKEN=1:fake python main.py
+
+Updates are fed in over HTTP (POST /_control/updates with a JSON list of
+updates) or, in-process, with FakeBotAPI.push_update(). GET /_control/calls
+returns the recorded calls and POST /_control/config changes latency and
+error rates on the fly.
+
+Usage:
+    python benchmarks/fake_bot_api.py [--port 8081] [--latency 0] [--jitter 0]
+                                      [--rate-429 0] [--retry-after 1] [--rate-403 0]
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {'id': 1000000, 'is_bot': True, 'first_name': 'Fake Bot', 'username': 'fake_forward_bot'}
+
+def parse_params(form) -> Dict[str, Any]:
+    """Bot API parameters arrive as form fields, JSON-encoded unless they are plain strings"""
+    params = {}
+    for key, value in form.items():
+        if isinstance(value, web.FileField):
+            params[key] = {'upload': value.filename, 'size': len(value.file.read())}
+            continue
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+def make_photo_bytes(seed: int, size: int = 320) -> bytes:
+    """A small JPEG that looks different for every seed"""
+    from PIL import Image, ImageDraw
+    r = random.Random(seed)
+    img = Image.new('RGB', (size, size * 3 // 4), tuple(r.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(8):
+        x, y = r.randrange(size), r.randrange(size * 3 // 4)
+        draw.ellipse((x, y, x + r.randrange(20, size // 2), y + r.randrange(20, size // 2)),
+                     fill=tuple(r.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=80)
+    return out.getvalue()
+
+def photo_sizes(file_id: str) -> List[Dict]:
+    """The thumbnail and full sizes Telegram lists for a photo, smallest first"""
+    return [
+        {'file_id': f"{file_id}_s", 'file_unique_id': f"{file_id}_s", 'width': 90, 'height': 68, 'file_size': 2000},
+        {'file_id': file_id, 'file_unique_id': file_id, 'width': 320, 'height': 240, 'file_size': 20000},
+    ]
+
+def channel_post(update_id: int, chat_id: int, message_id: int, text: str = None, photo: str = None,
+                 caption: str = None, media_group_id: str = None) -> Dict:
+    """An update carrying a channel post, as getUpdates returns it"""
+    message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'channel', 'title': f"Source {chat_id}"},
+        'sender_chat': {'id': chat_id, 'type': 'channel', 'title': f"Source {chat_id}"},
+    }
+    if text is not None:
+        message['text'] = text
+    if photo is not None:
+        message['photo'] = photo_sizes(photo)
+        if caption is not None:
+            message['caption'] = caption
+    if media_group_id is not None:
+        message['media_group_id'] = media_group_id
+    return {'update_id': update_id, 'channel_post': message}
+
+class FakeBotAPI:
+    """The fake server's state: pending updates, stored files, recorded calls and fault settings"""
+
+    # Methods that errors are injected into; polling and setup calls always succeed
+    FAULTY_PREFIXES = ('send', 'copy', 'forward')
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_429: float = 0.0,
+                 retry_after: int = 1, rate_403: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rate_403 = rate_403
+        self.random = random.Random(seed)
+        self.calls: List[Dict] = []
+        self.counts: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.files: Dict[str, bytes] = {}
+        self._updates: List[Dict] = []
+        self._update_event = asyncio.Event()
+        self._next_update_id = 1
+        self._message_ids: Counter = Counter()
+        self._runner: Optional[web.AppRunner] = None
+
+    # ========== UPDATES ==========
+    def push_update(self, update: Dict):
+        """Queue an update for getUpdates; update_id is assigned if missing"""
+        if 'update_id' not in update:
+            update['update_id'] = self._next_update_id
+        self._next_update_id = max(self._next_update_id, update['update_id'] + 1)
+        self._updates.append(update)
+        self._update_event.set()
+
+    def next_update_id(self) -> int:
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        return update_id
+
+    async def _get_updates(self, params: Dict) -> List[Dict]:
+        offset = params.get('offset') or 0
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and params.get('timeout'):
+            self._update_event.clear()
+            try:
+                # Long polling, capped so shutdown is quick
+                await asyncio.wait_for(self._update_event.wait(), min(params['timeout'], 5))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:params.get('limit') or 100]
+
+    # ========== RESPONSES ==========
+    def _message(self, chat_id, **fields) -> Dict:
+        self._message_ids[chat_id] += 1
+        chat_type = 'channel' if isinstance(chat_id, int) and chat_id < 0 else 'private'
+        return {
+            'message_id': self._message_ids[chat_id],
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': chat_type},
+            **fields,
+        }
+
+    def _sent_message(self, method: str, params: Dict) -> Dict:
+        chat_id = params.get('chat_id')
+        fields = {}
+        # A text that happens to be valid JSON ("123") was decoded; messages carry strings
+        if params.get('text') is not None:
+            fields['text'] = str(params['text'])
+        if params.get('caption') is not None:
+            fields['caption'] = str(params['caption'])
+        if method == 'sendPhoto':
+            photo = params.get('photo')
+            file_id = photo if isinstance(photo, str) else f"uploaded_{len(self.calls)}"
+            fields['photo'] = photo_sizes(file_id)
+        return self._message(chat_id, **fields)
+
+    def _result(self, method: str, params: Dict) -> Any:
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getFile':
+            file_id = params['file_id']
+            return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(self._file(file_id)),
+                    'file_path': f"photos/{file_id}.jpg"}
+        if method == 'copyMessage':
+            return {'message_id': self._message(params.get('chat_id'))['message_id']}
+        if method == 'sendMediaGroup':
+            media = params.get('media') or []
+            return [self._message(params.get('chat_id'), photo=photo_sizes(item.get('media', 'album')))
+                    for item in media]
+        if method.startswith('send') or method.startswith('forward'):
+            return self._sent_message(method, params)
+        # deleteWebhook, setMyCommands, close and friends
+        return True
+
+    def _file(self, file_id: str) -> bytes:
+        data = self.files.get(file_id)
+        if data is None:
+            # Thumbnails (the _s size) are small; full sizes larger
+            size = 90 if file_id.endswith('_s') else 320
+            data = self.files[file_id] = make_photo_bytes(zlib.crc32(file_id.removesuffix('_s').encode()), size)
+        return data
+
+    def _fault(self, method: str) -> Optional[web.Response]:
+        if not method.startswith(self.FAULTY_PREFIXES):
+            return None
+        roll = self.random.random()
+        if roll < self.rate_429:
+            self.errors['429'] += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+        if roll < self.rate_429 + self.rate_403:
+            self.errors['403'] += 1
+            return web.json_response({
+                'ok': False, 'error_code': 403, 'description': "Forbidden: bot was blocked by the user",
+            }, status=403)
+        return None
+
+    # ========== HTTP ==========
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                params.update(parse_params(await request.post()))
+
+        self.counts[method] += 1
+        self.calls.append({'method': method, 'params': params, 'at': time.time()})
+
+        if method != 'getUpdates':
+            delay = self.latency + self.random.uniform(0, self.jitter) if self.jitter else self.latency
+            if delay:
+                await asyncio.sleep(delay)
+            fault = self._fault(method)
+            if fault is not None:
+                return fault
+            if method == 'deleteWebhook' and params.get('drop_pending_updates'):
+                self._updates.clear()
+            return web.json_response({'ok': True, 'result': self._result(method, params)})
+        return web.json_response({'ok': True, 'result': await self._get_updates(params)})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        file_id = request.match_info['path'].rsplit('/', 1)[-1].rsplit('.', 1)[0]
+        self.counts['download'] += 1
+        return web.Response(body=self._file(file_id), content_type='image/jpeg')
+
+    async def handle_push_updates(self, request: web.Request) -> web.Response:
+        updates = await request.json()
+        for update in updates if isinstance(updates, list) else [updates]:
+            self.push_update(update)
+        return web.json_response({'ok': True, 'queued': len(self._updates)})
+
+    async def handle_calls(self, request: web.Request) -> web.Response:
+        return web.json_response({'counts': self.counts, 'errors': self.errors, 'calls': self.calls[-1000:]})
+
+    async def handle_config(self, request: web.Request) -> web.Response:
+        settings = await request.json()
+        for key in ('latency', 'jitter', 'rate_429', 'retry_after', 'rate_403'):
+            if key in settings:
+                setattr(self, key, type(getattr(self, key))(settings[key]))
+        return web.json_response({'ok': True})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_method)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.handle_file)
+        app.router.add_post('/_control/updates', self.handle_push_updates)
+        app.router.add_get('/_control/calls', self.handle_calls)
+        app.router.add_post('/_control/config', self.handle_config)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8081) -> str:
+        """Serve in the running loop; returns the base URL to give the bot"""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many extra random seconds')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='share of sends answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after sent with a 429')
+    parser.add_argument('--rate-403', type=float, default=0.0, help='share of sends answered with 403')
+    args = parser.parse_args()
+
+    server = FakeBotAPI(args.latency, args.jitter, args.rate_429, args.retry_after, args.rate_403)
+    print(f"Fake Bot API on http://{args.host}:{args.port}")
+    web.run_app(server.app(), host=args.host, port=args.port, access_log=None, print=None)
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ load_dotenv()
 # Bot Configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 ADMIN_IDS = list(map(int, os.getenv('ADMIN_IDS', '123456789').split(',')))
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', 'https://api.telegram.org').rstrip('/')  # Point at a local Bot API server or benchmarks/fake_bot_api.py
 
 # Database
 DATABASE_FILE = 'forward_bot.db'
@@ -18,6 +19,12 @@ DATABASE_FILE = 'forward_bot.db'
 MAX_FORWARD_TASKS = 10000  # Unlimited for premium
 FORWARD_DELAY_MIN = 1  # Minimum delay in seconds
 FORWARD_DELAY_MAX = 3600  # Maximum delay in seconds
+OUTBOUND_RATE = 25  # Messages per second across all chats (Bot API allows ~30)
+OUTBOUND_CHAT_RATE = 1.0  # Messages per second to a single chat
+OUTBOUND_CHAT_BURST = 3  # Messages a single chat may receive back to back
+DELAYED_RELEASE_BATCH = 200  # Delayed messages handed to the sender at once
+FILTER_REORDER_EVERY = 100  # Messages per task between re-sorting its filter checks
+FILTER_STATS_WINDOW = 10000  # Check counts are halved past this, so the order follows current traffic
 
 # File Settings
 MAX_FILE_SIZE_MB = 2000  # 2GB (Telegram limit)
@@ -56,18 +63,87 @@ CRYPTO_KEYWORDS = [
 
 # Scheduler Settings
 SCHEDULER_TIMEZONE = 'UTC'
+SCHEDULER_RESTORE_BATCH_SIZE = 500  # Rows fetched per chunk when streaming schedules at startup
+SCHEDULER_IMPORT_BATCH_SIZE = 100  # Missing power jobs written per step of the background import after startup
+AUTO_POST_BATCH_SIZE = 500  # Due posts fetched and advanced per transaction
+AUTO_POST_PATTERNS = ['once', 'daily', 'weekly', 'monthly']
+
+# Catch-up after downtime, per job kind: 'skip', 'run_once' or 'run_all'
+CATCHUP_POLICY = {
+    'power': 'run_once',  # Apply the latest missed on/off boundary (run_all behaves the same)
+    'auto_post': 'run_once',  # Recurring posts: one send for all missed runs
+    'auto_post_once': 'run_once',  # One-time posts: send late rather than never
+}
+CATCHUP_GRACE_SECONDS = 60  # Runs later than this count as missed
+CATCHUP_MAX_RUNS = 24  # Cap on missed runs replayed per post under run_all
+CATCHUP_RATE_SHARE = 0.3  # Share of OUTBOUND_RATE catch-up sends may use
 
 # Watermark Settings
 DEFAULT_WATERMARK_TEXT = "@ForwardedByBot"
 WATERMARK_POSITIONS = ['bottom-right', 'bottom-left', 'top-right', 'top-left', 'center']
-
-# Cleaner Filter Patterns
-CLEANER_PATTERNS = [
-    r'@\w+',  # Remove usernames
-    r'https?://\S+',  # Remove URLs
-    r't\.me/\S+',  # Remove Telegram links
-    r'#[\w]+',  # Remove hashtags
-]
+WATERMARK_STAMP_CACHE_SIZE = 256  # Pre-rendered text patches kept in memory
+WATERMARK_FILE_ID_MEMORY_SIZE = 1024  # Uploaded watermarked photos kept in memory
+WATERMARK_FILE_ID_CACHE_SIZE = 50000  # Uploaded watermarked photos kept in the database
+WATERMARK_LOW_MEMORY = os.getenv('WATERMARK_LOW_MEMORY', '1') == '1'  # Draft decoding, keep source JPEG quality
+WATERMARK_MAX_DIMENSION = int(os.getenv('WATERMARK_MAX_DIMENSION', '0'))  # Cap output size in pixels (0 = no cap)
+WATERMARK_JPEG_QUALITY = 95  # Used when the source quality cannot be kept
+WATERMARK_ASSETS_DIR = 'watermark_assets'  # Per-task logo files
+WATERMARK_LOGO_BUCKETS = [48, 64, 96, 128, 192, 256, 384, 512, 768]  # Pre-scaled logo widths
+WATERMARK_LOGO_DEFAULT_SCALE = 0.2  # Logo width relative to the photo width
+
+# Media Download Settings
+DOWNLOAD_CONCURRENCY = int(os.getenv('DOWNLOAD_CONCURRENCY', '4'))  # Files held in memory at once
+DOWNLOAD_SPOOL_THRESHOLD = 8 * 1024 * 1024  # Larger files go to a memory-mapped temp file
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 60  # Seconds
+
+# Near-Duplicate Detection
+NEAR_DUPLICATE_MAX_DISTANCE = 3  # Largest Hamming distance a task may use; the index has one more band than this
+NEAR_DUPLICATE_DAYS = 7  # How long fingerprints of forwarded messages are remembered
+NEAR_DUPLICATE_MIN_WORDS = 8  # Shorter texts only get the exact duplicate check
+NEAR_DUPLICATE_PRUNE_EVERY = 1000  # Fingerprints stored between clearing expired rows
+NEAR_DUPLICATE_MAX_FINGERPRINTS = 50000  # Per task and kind; the oldest go first
+NEAR_DUPLICATE_THUMBNAIL_CACHE = 4096  # Thumbnail hashes kept by file_unique_id
+
+# Metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'  # Off: instruments are no-ops
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Serve /metrics on this port (0 = don't serve)
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', os.getenv('METRICS_ENABLED', '0')) == '1'  # Follows METRICS_ENABLED unless set
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.05'))  # Share of normal traces kept in memory
+TRACE_SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', '5'))  # Slower traces are always kept and written to disk
+TRACE_SLOW_FILE = 'slow_traces.jsonl'
+TRACE_SLOW_FILE_MAX_BYTES = 10 * 1024 * 1024  # Rotated to slow_traces.jsonl.1 past this
+TRACE_FLUSH_SECONDS = 5  # Slow traces are written in batches, off the event loop
+TRACE_BUFFER_SIZE = 1000  # Recent traces kept for /traces
+TRACE_MAX_SPANS = 200  # Spans recorded per trace
+LOOP_WATCH_INTERVAL = 0.1  # Seconds between event loop lag probes
+LOOP_STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD', '0.25'))  # Lag reported as a stall, with what was running
+LOOP_LAG_WINDOW = 3000  # Probes the lag percentiles cover (5 minutes)
+LOOP_STALL_HISTORY = 50  # Recent stalls kept for /loopstats
+PROFILE_INTERVAL = 0.005  # Seconds between profiler samples
+PROFILE_TASK_EVERY = 10  # Samples between counting every live task for wall time
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP = 10  # Rows per table in the profile summary
+PROFILE_DIR = 'profiles'
+METRICS_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
+
+# Cleaner Filter Patterns, one per /clean option
+CLEANER_PATTERNS = {
+    'mentions': r'\[[^\]\n]*\]\([^)\n]*\)',  # Remove Markdown links
+    'links': r'https?://\S+|t\.me/\S+',  # Remove URLs and Telegram links
+    'usernames': r'@\w+',  # Remove usernames
+    'hashtags': r'#\w+',  # Remove hashtags
+}
+DEFAULT_CLEANER_OPTIONS = tuple(CLEANER_PATTERNS)  # Used while a task has no cleaner_options set
+# The same options by Telegram entity type, for messages that carry entities
+CLEANER_ENTITY_TYPES = {
+    'mentions': ('text_link', 'text_mention'),
+    'links': ('url',),
+    'usernames': ('mention',),
+    'hashtags': ('hashtag',),
+}
+MAX_REPLACE_RULES = 10000  # Replacement rules per task; all of them run in one pass
 
 # Messages
 WELCOME_MESSAGE = """
@@ -103,23 +179,32 @@ HELP_MESSAGE = """
 /addfilter - Add filter to task
 /removefilter - Remove filter
 /filters - View active filters
+/filterstats - See which filter checks reject messages
+/neardup - Skip near-duplicate reposts
 
 <b>⚙️ Settings:</b>
 /setdelay - Set forwarding delay
 /setschedule - Schedule power on/off
+/autopost - Schedule posts to a destination
+/delautopost - Remove a scheduled post
 /setheader - Add header to messages
 /setfooter - Add footer to messages
 /setwatermark - Add watermark to media
+/setlogo - Use a logo image as watermark
 /settranslate - Enable translation
 
 <b>🧹 Content Processing:</b>
 /clean - Clean message (remove links, usernames)
 /replace - Replace text in messages
 /removebykeyword - Remove lines by keyword
-/removebyline - Remove lines by line number
+/removebyline - Remove lines by line number (-1 = last)
+/removebyregex - Remove lines matching a regex
 
 <b>📊 Admin:</b>
 /stats - View bot statistics
 /broadcast - Broadcast message to all users
 /users - List all users
+/traces - Slowest recent message traces
+/profile - Profile the running bot for a few seconds
+/loopstats - Event loop lag and recent stalls
 """
@@ -4,7 +4,7 @@ Telegram Forward Bot - Database Module
 import aiosqlite
 import json
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator
 import config
 
 class Database:
@@ -14,6 +14,9 @@ class Database:
     async def init(self):
         """Initialize database tables"""
         async with aiosqlite.connect(self.db_file) as db:
+            # WAL lets the scheduler's job store write while other connections read
+            await db.execute('PRAGMA journal_mode=WAL')
+            
             # Users table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -49,10 +52,32 @@ class Database:
                     remove_duplicates INTEGER DEFAULT 1,
                     convert_buttons INTEGER DEFAULT 0,
                     clone_source INTEGER DEFAULT 0,
+                    watermark_logo TEXT,
+                    watermark_logo_scale REAL DEFAULT 0.2,
+                    power_timezone TEXT,
+                    cleaner_options TEXT,
+                    replace_rules TEXT,
+                    line_rules TEXT,
+                    near_duplicate_distance INTEGER,
                     FOREIGN KEY (user_id) REFERENCES users(user_id)
                 )
             ''')
             
+            # Columns added after the first release
+            await self._add_missing_columns(db, 'forward_tasks', {
+                'watermark_logo': 'TEXT',
+                'watermark_logo_scale': 'REAL DEFAULT 0.2',
+                'power_timezone': 'TEXT',
+                'cleaner_options': 'TEXT',
+                'replace_rules': 'TEXT',
+                'line_rules': 'TEXT',
+                'near_duplicate_distance': 'INTEGER',
+            })
+            
+            # Power boundaries look tasks up by time
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_forward_tasks_power_on ON forward_tasks (power_on_time)')
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_forward_tasks_power_off ON forward_tasks (power_off_time)')
+            
             # Filters table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS filters (
@@ -77,6 +102,21 @@ class Database:
                     FOREIGN KEY (task_id) REFERENCES forward_tasks(task_id) ON DELETE CASCADE
                 )
             ''')
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_forwarded_messages_hash
+                ON forwarded_messages (message_hash, task_id)
+            ''')
+            
+            # 64-bit fingerprints of forwarded messages, for near-duplicate checks
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    task_id INTEGER,
+                    kind TEXT,
+                    fingerprint INTEGER,
+                    seen_at REAL
+                )
+            ''')
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_fingerprints_seen_at ON fingerprints (seen_at)')
             
             # Scheduled posts table
             await db.execute('''
@@ -89,9 +129,33 @@ class Database:
                     is_recurring INTEGER DEFAULT 0,
                     recurrence_pattern TEXT,
                     is_active INTEGER DEFAULT 1,
+                    next_run_time TEXT,
+                    message_entities TEXT,
                     FOREIGN KEY (task_id) REFERENCES forward_tasks(task_id) ON DELETE CASCADE
                 )
             ''')
+            await self._add_missing_columns(db, 'scheduled_posts', {
+                'next_run_time': 'TEXT',
+                'message_entities': 'TEXT',
+            })
+            # The auto post dispatcher looks up due posts every minute
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_scheduled_posts_due
+                ON scheduled_posts (is_active, next_run_time)
+            ''')
+            
+            # Uploaded watermarked photos, reused across destinations
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS watermark_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    file_id TEXT,
+                    last_used TEXT
+                )
+            ''')
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_watermark_cache_last_used
+                ON watermark_cache (last_used)
+            ''')
             
             # Statistics table
             await db.execute('''
@@ -108,6 +172,14 @@ class Database:
             
             await db.commit()
     
+    async def _add_missing_columns(self, db, table: str, columns: Dict[str, str]):
+        """Add columns that databases created by older versions don't have yet"""
+        async with db.execute(f'PRAGMA table_info({table})') as cursor:
+            existing = {row[1] for row in await cursor.fetchall()}
+        for name, definition in columns.items():
+            if name not in existing:
+                await db.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+    
     # User operations
     async def add_user(self, user_id: int, username: str, first_name: str, last_name: str):
         async with aiosqlite.connect(self.db_file) as db:
@@ -165,6 +237,13 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     
+    async def get_all_tasks(self) -> List[Dict]:
+        async with aiosqlite.connect(self.db_file) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute('SELECT * FROM forward_tasks') as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    
     async def get_all_active_tasks(self) -> List[Dict]:
         async with aiosqlite.connect(self.db_file) as db:
             db.row_factory = aiosqlite.Row
@@ -195,6 +274,32 @@ class Database:
     async def delete_task(self, task_id: int):
         async with aiosqlite.connect(self.db_file) as db:
             await db.execute('DELETE FROM forward_tasks WHERE task_id = ?', (task_id,))
+            # Foreign keys aren't enforced, so stop the task's posts explicitly
+            await db.execute('UPDATE scheduled_posts SET is_active = 0 WHERE task_id = ?', (task_id,))
+            await db.execute('DELETE FROM fingerprints WHERE task_id = ?', (task_id,))
+            await db.commit()
+    
+    async def apply_power_boundary(self, enable: bool, time_str: str, timezone: str) -> List[int]:
+        """Switch every task on one power boundary with a single UPDATE"""
+        column = 'power_on_time' if enable else 'power_off_time'
+        async with aiosqlite.connect(self.db_file) as db:
+            async with db.execute(f'''
+                UPDATE forward_tasks SET is_enabled = ?
+                WHERE {column} = ? AND COALESCE(power_timezone, ?) = ?
+                RETURNING task_id
+            ''', (int(enable), time_str, config.SCHEDULER_TIMEZONE, timezone)) as cursor:
+                task_ids = [row[0] for row in await cursor.fetchall()]
+            await db.commit()
+            return task_ids
+    
+    async def set_tasks_enabled(self, task_ids: List[int], enabled: bool):
+        async with aiosqlite.connect(self.db_file) as db:
+            for i in range(0, len(task_ids), 500):
+                chunk = task_ids[i:i + 500]
+                await db.execute(
+                    f'UPDATE forward_tasks SET is_enabled = ? WHERE task_id IN ({",".join("?" * len(chunk))})',
+                    (int(enabled), *chunk)
+                )
             await db.commit()
     
     async def enable_task(self, task_id: int):
@@ -219,6 +324,13 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     
+    async def get_all_filters(self) -> List[Dict]:
+        async with aiosqlite.connect(self.db_file) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute('SELECT * FROM filters ORDER BY filter_id') as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    
     async def delete_filter(self, filter_id: int):
         async with aiosqlite.connect(self.db_file) as db:
             await db.execute('DELETE FROM filters WHERE filter_id = ?', (filter_id,))
@@ -233,6 +345,35 @@ class Database:
             ''', (task_id, message_hash)) as cursor:
                 return await cursor.fetchone() is not None
     
+    async def get_duplicate_tasks(self, message_hash: str, task_ids: List[int]) -> set:
+        """Which of these tasks already forwarded a message with this hash"""
+        async with aiosqlite.connect(self.db_file) as db:
+            async with db.execute(f'''
+                SELECT DISTINCT task_id FROM forwarded_messages
+                WHERE message_hash = ? AND task_id IN ({",".join("?" * len(task_ids))})
+            ''', (message_hash, *task_ids)) as cursor:
+                return {row[0] async for row in cursor}
+    
+    async def add_fingerprint(self, task_id: int, kind: str, fingerprint: int, seen_at: float):
+        # SQLite integers are signed 64-bit
+        signed = fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+        async with aiosqlite.connect(self.db_file) as db:
+            await db.execute(
+                'INSERT INTO fingerprints (task_id, kind, fingerprint, seen_at) VALUES (?, ?, ?, ?)',
+                (task_id, kind, signed, seen_at)
+            )
+            await db.commit()
+    
+    async def delete_fingerprints_before(self, seen_at: float):
+        async with aiosqlite.connect(self.db_file) as db:
+            await db.execute('DELETE FROM fingerprints WHERE seen_at < ?', (seen_at,))
+            await db.commit()
+    
+    async def iter_fingerprints(self) -> AsyncIterator[tuple]:
+        """(task_id, kind, fingerprint, seen_at), oldest first"""
+        async for row in self._iter_rows('SELECT task_id, kind, fingerprint, seen_at FROM fingerprints ORDER BY seen_at'):
+            yield row['task_id'], row['kind'], row['fingerprint'] & ((1 << 64) - 1), row['seen_at']
+    
     async def add_forwarded_message(self, task_id: int, original_message_id: int, 
                                     source_chat_id: int, message_hash: str):
         async with aiosqlite.connect(self.db_file) as db:
@@ -277,13 +418,16 @@ class Database:
     # Scheduled posts
     async def add_scheduled_post(self, task_id: int, chat_id: int, message_content: str,
                                  schedule_time: str, is_recurring: bool = False, 
-                                 recurrence_pattern: str = None) -> int:
+                                 recurrence_pattern: str = None, next_run_time: str = None,
+                                 message_entities: str = None) -> int:
         async with aiosqlite.connect(self.db_file) as db:
             cursor = await db.execute('''
                 INSERT INTO scheduled_posts (task_id, chat_id, message_content, schedule_time, 
-                                            is_recurring, recurrence_pattern, is_active)
-                VALUES (?, ?, ?, ?, ?, ?, 1)
-            ''', (task_id, chat_id, message_content, schedule_time, int(is_recurring), recurrence_pattern))
+                                            is_recurring, recurrence_pattern, is_active, next_run_time,
+                                            message_entities)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+            ''', (task_id, chat_id, message_content, schedule_time, int(is_recurring), recurrence_pattern,
+                  next_run_time, message_entities))
             await db.commit()
             return cursor.lastrowid
     
@@ -303,10 +447,101 @@ class Database:
                     rows = await cursor.fetchall()
                     return [dict(row) for row in rows]
     
+    async def get_scheduled_post(self, schedule_id: int) -> Optional[Dict]:
+        async with aiosqlite.connect(self.db_file) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute('SELECT * FROM scheduled_posts WHERE schedule_id = ?', (schedule_id,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+    
+    async def _iter_rows(self, query: str, params: tuple = ()) -> AsyncIterator[Dict]:
+        """Stream rows without loading the whole result set"""
+        # Large chunks keep the thread hops per row low
+        async with aiosqlite.connect(self.db_file, iter_chunk_size=config.SCHEDULER_RESTORE_BATCH_SIZE) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(query, params) as cursor:
+                async for row in cursor:
+                    yield row
+    
+    async def iter_power_schedules(self) -> AsyncIterator[Dict]:
+        async for row in self._iter_rows('''
+            SELECT task_id, power_on_time, power_off_time, power_timezone FROM forward_tasks
+            WHERE power_on_time IS NOT NULL OR power_off_time IS NOT NULL
+        '''):
+            yield row
+    
+    async def iter_unscheduled_posts(self) -> AsyncIterator[Dict]:
+        """Active posts created before next_run_time existed"""
+        async for row in self._iter_rows('''
+            SELECT schedule_id, schedule_time FROM scheduled_posts
+            WHERE is_active = 1 AND next_run_time IS NULL
+        '''):
+            yield row
+    
+    async def set_post_run_times(self, run_times: List[tuple]):
+        """Set next_run_time for many posts; run_times holds (next_run_time, schedule_id)"""
+        async with aiosqlite.connect(self.db_file) as db:
+            await db.executemany('UPDATE scheduled_posts SET next_run_time = ? WHERE schedule_id = ?', run_times)
+            await db.commit()
+    
+    async def get_due_posts(self, now: str, limit: int) -> List[Dict]:
+        async with aiosqlite.connect(self.db_file) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute('''
+                SELECT * FROM scheduled_posts
+                WHERE is_active = 1 AND next_run_time <= ?
+                ORDER BY next_run_time LIMIT ?
+            ''', (now, limit)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    
+    async def advance_scheduled_posts(self, advanced: List[tuple], finished: List[int]):
+        """Move recurring posts to their next run and retire finished ones in one transaction"""
+        async with aiosqlite.connect(self.db_file) as db:
+            await db.executemany('UPDATE scheduled_posts SET next_run_time = ? WHERE schedule_id = ?', advanced)
+            await db.executemany('UPDATE scheduled_posts SET is_active = 0 WHERE schedule_id = ?',
+                                 [(schedule_id,) for schedule_id in finished])
+            await db.commit()
+    
     async def delete_scheduled_post(self, schedule_id: int):
         async with aiosqlite.connect(self.db_file) as db:
             await db.execute('UPDATE scheduled_posts SET is_active = 0 WHERE schedule_id = ?', (schedule_id,))
             await db.commit()
+    
+    # Watermark file_id cache
+    async def get_watermark_file_id(self, cache_key: str) -> Optional[str]:
+        async with aiosqlite.connect(self.db_file) as db:
+            async with db.execute('''
+                SELECT file_id FROM watermark_cache WHERE cache_key = ?
+            ''', (cache_key,)) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                return None
+            await db.execute('''
+                UPDATE watermark_cache SET last_used = ? WHERE cache_key = ?
+            ''', (datetime.now().isoformat(), cache_key))
+            await db.commit()
+            return row[0]
+    
+    async def save_watermark_file_id(self, cache_key: str, file_id: str, max_entries: int):
+        """Store an uploaded file_id and evict the least recently used entries"""
+        async with aiosqlite.connect(self.db_file) as db:
+            await db.execute('''
+                INSERT OR REPLACE INTO watermark_cache (cache_key, file_id, last_used)
+                VALUES (?, ?, ?)
+            ''', (cache_key, file_id, datetime.now().isoformat()))
+            await db.execute('''
+                DELETE FROM watermark_cache WHERE cache_key IN (
+                    SELECT cache_key FROM watermark_cache
+                    ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (max_entries,))
+            await db.commit()
+    
+    async def delete_watermark_file_id(self, cache_key: str):
+        async with aiosqlite.connect(self.db_file) as db:
+            await db.execute('DELETE FROM watermark_cache WHERE cache_key = ?', (cache_key,))
+            await db.commit()
 
 # Global database instance
 db = Database()
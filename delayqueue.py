@@ -0,0 +1,81 @@
+"""
+Telegram Forward Bot - Delayed Forward Queue
+"""
+import asyncio
+import heapq
+import itertools
+from typing import Any, Awaitable, Callable, List, Optional, Set
+import config
+
+class DelayedForwardQueue:
+    """Messages waiting out their task's forward delay.
+
+    Items sit in one min-heap keyed by due time, and a single timer task
+    sleeps until the earliest one is due. Everything due at that point is
+    handed to the release callback as one batch, so a million delayed
+    messages cost a million heap entries rather than a million sleeping
+    coroutines or scheduler jobs.
+    """
+    
+    def __init__(self, release: Callable[[List[Any]], Awaitable[Any]],
+                 batch_size: int = config.DELAYED_RELEASE_BATCH):
+        self._release = release
+        self.batch_size = batch_size
+        self._heap: list = []  # (due, seq, item); seq keeps equal due times in FIFO order
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._timer: Optional[asyncio.Task] = None
+        self._releasing: Set[asyncio.Task] = set()
+    
+    def __len__(self) -> int:
+        return len(self._heap)
+    
+    def push(self, delay: float, item: Any):
+        """Release item after delay seconds"""
+        loop = asyncio.get_running_loop()
+        entry = (loop.time() + delay, next(self._seq), item)
+        heapq.heappush(self._heap, entry)
+        
+        if self._timer is None or self._timer.done():
+            self._wakeup = asyncio.Event()
+            self._timer = loop.create_task(self._run())
+        elif self._heap[0] is entry:
+            # New earliest item: cut the current sleep short
+            self._wakeup.set()
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._heap:
+            timeout = self._heap[0][0] - loop.time()
+            if timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            now = loop.time()
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self._heap)[2])
+            
+            # Release in the background so a slow send doesn't hold up the timer
+            task = loop.create_task(self._release_batch(batch))
+            self._releasing.add(task)
+            task.add_done_callback(self._releasing.discard)
+            await asyncio.sleep(0)
+    
+    async def _release_batch(self, batch: List[Any]):
+        try:
+            await self._release(batch)
+        except Exception as e:
+            print(f"Delayed release error: {e}")
+    
+    async def close(self):
+        """Stop the timer; items still waiting are dropped"""
+        if self._timer is not None:
+            self._timer.cancel()
+        for task in list(self._releasing):
+            task.cancel()
+        self._heap.clear()
@@ -0,0 +1,156 @@
+"""
+Telegram Forward Bot - Media Download Module
+"""
+import asyncio
+import io
+import mmap
+import tempfile
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import aiohttp
+import config
+
+class PooledBuffer:
+    """Growable byte buffer that keeps its capacity between downloads"""
+    
+    def __init__(self):
+        self.data = bytearray()
+        self.length = 0
+    
+    def reset(self, expected_size: int = 0):
+        self.length = 0
+        if expected_size > len(self.data):
+            self.data.extend(bytes(expected_size - len(self.data)))
+    
+    def write(self, chunk) -> int:
+        end = self.length + len(chunk)
+        if end > len(self.data):
+            # Grow geometrically so streaming stays amortised O(n)
+            self.data.extend(bytes(max(end - len(self.data), len(self.data))))
+        self.data[self.length:end] = chunk
+        self.length = end
+        return len(chunk)
+
+class MemoryReader(io.RawIOBase):
+    """Read-only file object over a memoryview, so decoders never copy the whole payload"""
+    
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+    
+    def tell(self) -> int:
+        return self._pos
+
+class DownloadManager:
+    """Bounded-concurrency media downloads into reusable buffers.
+
+    At most DOWNLOAD_CONCURRENCY files are held in memory at once, each in
+    a pooled buffer that is reused by the next download. Files larger than
+    DOWNLOAD_SPOOL_THRESHOLD go to a temporary file that is memory-mapped
+    instead.
+    """
+    
+    def __init__(self):
+        self._semaphore = None
+        self._pool: List[PooledBuffer] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(config.DOWNLOAD_CONCURRENCY)
+        return self._semaphore
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=config.DOWNLOAD_TIMEOUT)
+            )
+        return self._session
+    
+    def _acquire_buffer(self) -> PooledBuffer:
+        return self._pool.pop() if self._pool else PooledBuffer()
+    
+    def _release_buffer(self, buffer: PooledBuffer):
+        # Don't let one oversized file pin its memory for good
+        if len(buffer.data) <= config.DOWNLOAD_SPOOL_THRESHOLD and len(self._pool) < config.DOWNLOAD_CONCURRENCY:
+            self._pool.append(buffer)
+    
+    async def _stream_into(self, file, out):
+        """Stream a Telegram file into a writable object chunk by chunk"""
+        if file.file_path and file.file_path.startswith(('http://', 'https://')):
+            async with self._get_session().get(file.file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(config.DOWNLOAD_CHUNK_SIZE):
+                    out.write(chunk)
+        else:
+            # Local Bot API server: the file is already on disk
+            await file.download_to_memory(out)
+    
+    @asynccontextmanager
+    async def open(self, bot, file_id: str):
+        """Download a file and yield a seekable, read-only file object for it.
+
+        The object is only valid inside the ``async with`` block; the
+        underlying buffer goes back to the pool afterwards.
+        """
+        async with self._get_semaphore():
+            file = await bot.get_file(file_id)
+            size = file.file_size or 0
+            
+            if size > config.DOWNLOAD_SPOOL_THRESHOLD:
+                with tempfile.TemporaryFile() as spool:
+                    await self._stream_into(file, spool)
+                    spool.flush()
+                    with mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        yield mapped
+                return
+            
+            buffer = self._acquire_buffer()
+            buffer.reset(size)
+            view = None
+            reusable = False
+            try:
+                await self._stream_into(file, buffer)
+                view = memoryview(buffer.data)[:buffer.length]
+                reader = MemoryReader(view)
+                try:
+                    yield reader
+                finally:
+                    reader.close()
+                    try:
+                        view.release()
+                        reusable = True
+                    except BufferError:
+                        # A decoder still holds a slice; let this buffer go
+                        pass
+            finally:
+                if reusable or view is None:
+                    self._release_buffer(buffer)
+    
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+# Global download manager
+download_manager = DownloadManager()
@@ -1,183 +1,344 @@
 """
 Telegram Forward Bot - Advanced Filters Module
 """
+import asyncio
 import re
 import hashlib
-from typing import List, Dict, Optional
+import time
+from functools import cached_property, lru_cache
+from typing import Any, Callable, Iterable, List, Dict, Optional, Pattern, Tuple
 from googletrans import Translator
 import config
+from metrics import metrics
+from richtext import RichText, html_to_rich
+from neardup import near_duplicates, text_fingerprint, thumbnail_hasher
+from textrules import LineRules, Replacer, compile_line_rules, compile_replace_rules, trie_pattern
 
-class MessageFilters:
+BLANK_LINES = re.compile(r'\n\s*\n')
+CRYPTO_PATTERN = re.compile(trie_pattern(config.CRYPTO_KEYWORDS))
+
+# Media checked for the duplicate key when a message has no text, with their key prefixes
+MEDIA_TYPES = (
+    ('photo', 'photo'), ('video', 'video'), ('document', 'doc'), ('audio', 'audio'),
+    ('voice', 'voice'), ('video_note', 'video_note'), ('animation', 'animation'),
+)
+
+filter_rejections = metrics.counter('forward_filter_rejections_total', 'Messages rejected, by filter check', ('check',))
+
+def parse_cleaner_options(value: Optional[str]) -> Tuple[str, ...]:
+    """Cleaner options stored on a task; unset means all of them"""
+    if value is None:
+        return config.DEFAULT_CLEANER_OPTIONS
+    return tuple(option for option in config.CLEANER_PATTERNS if option in value.split(','))
+
+@lru_cache(maxsize=None)
+def compile_cleaner(options: Tuple[str, ...]) -> Optional[Pattern]:
+    """All enabled cleaner patterns as one alternation, so text is scanned once"""
+    patterns = [config.CLEANER_PATTERNS[option] for option in config.CLEANER_PATTERNS if option in options]
+    if not patterns:
+        return None
+    # Joined without wrapping groups: every branch then starts with a literal,
+    # which lets the regex engine skip ahead to candidate characters
+    return re.compile('|'.join(patterns))
+
+@lru_cache(maxsize=None)
+def cleaner_entity_types(options: Tuple[str, ...]) -> frozenset:
+    return frozenset(
+        entity_type for option in options for entity_type in config.CLEANER_ENTITY_TYPES.get(option, ())
+    )
+
+# Independent pass/reject checks, in the order they run until stats say otherwise
+FILTER_CHECKS = ('user', 'keyword', 'regex', 'crypto', 'near_duplicate', 'duplicate')
+
+class CheckStats:
+    __slots__ = ('evaluated', 'rejected', 'seconds')
+    
     def __init__(self):
-        self.translator = Translator()
+        self.evaluated = 0
+        self.rejected = 0
+        self.seconds = 0.0
     
-    # ========== USER FILTER ==========
-    def check_user_filter(self, message, filters: List[Dict]) -> bool:
-        """Check if message passes user filter"""
-        user_filters = [f for f in filters if f['filter_type'] == 'user']
-        if not user_filters:
-            return True
-        
-        sender_id = message.from_user.id if message.from_user else None
-        
-        for f in user_filters:
-            # Assuming filter_value for user filter is a comma-separated list of user IDs
-            try:
-                allowed_users = [int(uid.strip()) for uid in f['filter_value'].split(',') if uid.strip()]
-            except ValueError:
-                print(f"Warning: Could not parse user IDs from filter value: {f['filter_value']}")
-                continue # Skip this filter if IDs are invalid
-                
-            is_whitelist = f['is_whitelist']
-            
-            if is_whitelist:
-                # Whitelist: only allow these users
-                if sender_id not in allowed_users:
-                    return False
-            else:
-                # Blacklist: block these users
-                if sender_id in allowed_users:
-                    return False
-        
-        return True
+    @property
+    def reject_rate(self) -> float:
+        # Smoothed, so an unseen check is neither trusted nor written off
+        return (self.rejected + 1) / (self.evaluated + 2)
     
-    # ========== KEYWORD FILTER ==========
-    def check_keyword_filter(self, text: str, filters: List[Dict]) -> bool:
-        """Check if message passes keyword filter"""
-        keyword_filters = [f for f in filters if f['filter_type'] == 'keyword']
-        if not keyword_filters or not text:
-            return True
-        
-        text_lower = text.lower()
-        
-        for f in keyword_filters:
-            keywords = [kw.strip().lower() for kw in f['filter_value'].split(',') if kw.strip()]
-            is_whitelist = f['is_whitelist']
-            
-            if not keywords: # Skip if filter value is empty after split/strip
-                continue
+    @property
+    def average_cost(self) -> float:
+        return self.seconds / self.evaluated if self.evaluated else 0.0
+    
+    def rank(self) -> float:
+        """Expected cost per rejected message; lower runs earlier"""
+        return self.average_cost / self.reject_rate
+    
+    def decay(self):
+        self.evaluated //= 2
+        self.rejected //= 2
+        self.seconds /= 2
 
-            if is_whitelist:
-                # Whitelist: message must contain at least one keyword
-                if not any(kw in text_lower for kw in keywords):
-                    return False
-            else:
-                # Blacklist: message must NOT contain any keyword
-                if any(kw in text_lower for kw in keywords):
-                    return False
-        
-        return True
+class FilterStats:
+    """Per-task pass/reject counts and cost of each filter check.
+
+    The checks of a task are all required to pass, so they can run in any
+    order. Every FILTER_REORDER_EVERY messages a task's checks are sorted
+    by cost per rejection, putting cheap checks that reject most messages
+    ahead of regexes and the duplicate lookup in the database.
+    """
     
-    # ========== REGEX FILTER ==========
-    def check_regex_filter(self, text: str, filters: List[Dict]) -> bool:
-        """Check if message passes regex filter"""
-        regex_filters = [f for f in filters if f['filter_type'] == 'regex']
-        if not regex_filters or not text:
-            return True
-        
-        for f in regex_filters:
-            try:
-                # Use re.search for general pattern matching. 
-                # Consider adding flags for case-insensitivity if needed, or handle via regex itself.
-                pattern = re.compile(f['filter_value']) 
-                matches = pattern.search(text)
-                is_whitelist = f['is_whitelist']
-                
-                if is_whitelist:
-                    # Whitelist: message must match the regex pattern
-                    if not matches:
-                        return False
-                else:
-                    # Blacklist: message must NOT match the regex pattern
-                    if matches:
-                        return False
-            except re.error as e:
-                print(f"Invalid regex pattern: {f['filter_value']} - Error: {e}")
-                # For now, we'll skip this filter if invalid to avoid breaking the bot.
-                # A more robust solution might notify the user or log this error.
-                pass 
-        
-        return True
+    def __init__(self, reorder_every: int = config.FILTER_REORDER_EVERY,
+                 window: int = config.FILTER_STATS_WINDOW):
+        self.reorder_every = reorder_every
+        self.window = window
+        self._stats: Dict[int, Dict[str, CheckStats]] = {}
+        self._orders: Dict[int, Tuple[str, ...]] = {}
+        self._runs: Dict[int, int] = {}
+    
+    def order(self, task_id: int, checks: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Order to run a task's applicable checks in"""
+        runs = self._runs.get(task_id, 0)
+        self._runs[task_id] = runs + 1
+        order = self._orders.get(task_id)
+        if order is None or runs % self.reorder_every == 0 or set(order) != set(checks):
+            stats = self._stats.setdefault(task_id, {})
+            order = tuple(sorted(checks, key=lambda check: stats[check].rank() if check in stats else 0.0))
+            self._orders[task_id] = order
+        return order
+    
+    def record(self, task_id: int, check: str, seconds: float, passed: bool):
+        stats = self._stats.setdefault(task_id, {}).get(check)
+        if stats is None:
+            stats = self._stats[task_id][check] = CheckStats()
+        stats.evaluated += 1
+        stats.seconds += seconds
+        if not passed:
+            stats.rejected += 1
+        if stats.evaluated >= self.window:
+            stats.decay()
+    
+    def snapshot(self, task_id: int) -> List[Dict]:
+        """Stats of a task's checks, in their current order"""
+        stats = self._stats.get(task_id, {})
+        order = self._orders.get(task_id, ())
+        return [
+            {
+                'check': check,
+                'evaluated': stats[check].evaluated,
+                'rejected': stats[check].rejected,
+                'reject_rate': stats[check].rejected / stats[check].evaluated if stats[check].evaluated else 0.0,
+                'average_us': stats[check].average_cost * 1e6,
+            }
+            for check in order if check in stats
+        ]
+    
+    def forget(self, task_id: int):
+        self._stats.pop(task_id, None)
+        self._orders.pop(task_id, None)
+        self._runs.pop(task_id, None)
+
+# ========== MESSAGE ANALYSIS ==========
+class MessageAnalysis:
+    """What the filters need to know about one incoming message, computed once.
+
+    All tasks watching a source share the analysis of each message, so the
+    text is lowercased and hashed once, each keyword or regex is searched
+    once, tasks with the same text rules share the processed text, and the
+    duplicate lookup for all of them is a single query.
+    """
+    
+    def __init__(self, message, route: Iterable[Tuple[Dict, List[Dict]]] = ()):
+        self.message = message
+        self.rich = RichText.from_message(message)
+        self.text = self.rich.text
+        self.sender_id = message.from_user.id if message.from_user else None
+        self._dedup_task_ids = [task['task_id'] for task, _ in route if task.get('remove_duplicates', 1)]
+        self._duplicates: Optional[asyncio.Future] = None
+        self._fingerprint: Optional[asyncio.Future] = None
+        self._contains: Dict[str, bool] = {}
+        self._searches: Dict[Pattern, bool] = {}
+        self._memo: Dict[Any, Any] = {}
+    
+    @cached_property
+    def text_lower(self) -> str:
+        return self.text.lower()
+    
+    @cached_property
+    def media_type(self) -> Optional[str]:
+        for attr, _ in MEDIA_TYPES:
+            if getattr(self.message, attr, None):
+                return attr
+        return None
+    
+    @cached_property
+    def content_hash(self) -> Optional[str]:
+        """Duplicate key: the text, or the media's file_unique_id when there is none"""
+        content = self.text
+        if not content and self.media_type:
+            media = getattr(self.message, self.media_type)
+            if self.media_type == 'photo':
+                media = media[-1]  # Highest resolution
+            content = f"{dict(MEDIA_TYPES)[self.media_type]}_{media.file_unique_id}"
+        return hashlib.md5(content.encode()).hexdigest() if content else None
+    
+    @cached_property
+    def text_fingerprint(self) -> Optional[int]:
+        """SimHash of the text for near-duplicate checks, None if it is too short"""
+        return text_fingerprint(self.text)
+    
+    async def fingerprint(self) -> Optional[Tuple[str, int]]:
+        """(kind, fingerprint) for near-duplicate checks.
+
+        The text's SimHash when it is long enough, otherwise the dHash of
+        a photo or video thumbnail, downloaded once for all tasks.
+        """
+        if self.text_fingerprint is not None:
+            return 'text', self.text_fingerprint
+        if self._fingerprint is None:
+            self._fingerprint = asyncio.ensure_future(thumbnail_hasher.fingerprint(self.message.get_bot(), self.message))
+        fingerprint = await self._fingerprint
+        return ('image', fingerprint) if fingerprint is not None else None
+    
+    @cached_property
+    def has_crypto(self) -> bool:
+        return CRYPTO_PATTERN.search(self.text_lower) is not None
+    
+    def contains(self, keyword: str) -> bool:
+        """Lowercased keyword appears in the text"""
+        hit = self._contains.get(keyword)
+        if hit is None:
+            hit = self._contains[keyword] = keyword in self.text_lower
+        return hit
+    
+    def search(self, pattern: Pattern) -> bool:
+        hit = self._searches.get(pattern)
+        if hit is None:
+            hit = self._searches[pattern] = pattern.search(self.text) is not None
+        return hit
+    
+    def memo(self, key, compute: Callable[[], Any]):
+        """Compute a value once per message for everything that asks with the same key"""
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+    
+    async def is_duplicate(self, task_id: int, db) -> bool:
+        if not self.content_hash:
+            return False
+        if task_id not in self._dedup_task_ids:
+            return task_id in await db.get_duplicate_tasks(self.content_hash, [task_id])
+        if self._duplicates is None:
+            self._duplicates = asyncio.ensure_future(
+                db.get_duplicate_tasks(self.content_hash, self._dedup_task_ids)
+            )
+        return task_id in await self._duplicates
 
-    # ========== CRYPTO FILTER ==========
-    def check_crypto_filter(self, text: str, filters: List[Dict], allow_crypto: bool = True) -> bool:
-        """Filter messages based on crypto content"""
-        crypto_filters = [f for f in filters if f['filter_type'] == 'crypto']
-        if not crypto_filters or not text:
+class FilterProgram:
+    """A task's filters parsed once: user ID sets, lowercased keywords, compiled regexes"""
+    
+    def __init__(self, specs: Tuple[Tuple[str, str, bool], ...]):
+        self.users: List[Tuple[frozenset, bool]] = []
+        self.keywords: List[Tuple[Tuple[str, ...], bool]] = []
+        self.regexes: List[Tuple[Pattern, bool]] = []
+        self.crypto: Optional[str] = None
+        
+        for filter_type, value, is_whitelist in specs:
+            if filter_type == 'user':
+                # Filter value for user filter is a comma-separated list of user IDs
+                try:
+                    user_ids = frozenset(int(uid.strip()) for uid in value.split(',') if uid.strip())
+                except ValueError:
+                    print(f"Warning: Could not parse user IDs from filter value: {value}")
+                    continue
+                self.users.append((user_ids, is_whitelist))
+            elif filter_type == 'keyword':
+                keywords = tuple(kw.strip().lower() for kw in value.split(',') if kw.strip())
+                if keywords:
+                    self.keywords.append((keywords, is_whitelist))
+            elif filter_type == 'regex':
+                try:
+                    self.regexes.append((re.compile(value), is_whitelist))
+                except re.error as e:
+                    # Skip invalid patterns rather than breaking the bot
+                    print(f"Invalid regex pattern: {value} - Error: {e}")
+            elif filter_type == 'crypto' and self.crypto is None:
+                if value.lower() in ('only_crypto', 'no_crypto'):
+                    self.crypto = value.lower()
+    
+    def checks(self, task: Dict) -> Tuple[str, ...]:
+        """The checks that can reject a message for this task"""
+        present = {
+            'user': bool(self.users),
+            'keyword': bool(self.keywords),
+            'regex': bool(self.regexes),
+            'crypto': self.crypto is not None,
+            'near_duplicate': task.get('near_duplicate_distance') is not None,
+            # Duplicate check defaults to true if not specified
+            'duplicate': bool(task.get('remove_duplicates', 1)),
+        }
+        return tuple(check for check in FILTER_CHECKS if present[check])
+    
+    def check(self, check: str, analysis: MessageAnalysis) -> bool:
+        """Run one of the synchronous checks; whitelists must match, blacklists must not"""
+        if check == 'user':
+            return all((analysis.sender_id in user_ids) == is_whitelist for user_ids, is_whitelist in self.users)
+        if not analysis.text:
             return True
-        
-        text_lower = text.lower()
-        has_crypto = any(kw in text_lower for kw in config.CRYPTO_KEYWORDS)
-        
-        for f in crypto_filters:
-            filter_action = f['filter_value'].lower()
-            
-            if filter_action == 'only_crypto':
-                return has_crypto
-            elif filter_action == 'no_crypto':
-                return not has_crypto
-        
-        return True
+        if check == 'keyword':
+            return all(
+                any(analysis.contains(kw) for kw in keywords) == is_whitelist
+                for keywords, is_whitelist in self.keywords
+            )
+        if check == 'regex':
+            return all(analysis.search(pattern) == is_whitelist for pattern, is_whitelist in self.regexes)
+        return analysis.has_crypto == (self.crypto == 'only_crypto')
+
+@lru_cache(maxsize=1024)
+def compile_filter_program(specs: Tuple[Tuple[str, str, bool], ...]) -> FilterProgram:
+    return FilterProgram(specs)
+
+def filter_program(filters: List[Dict]) -> FilterProgram:
+    return compile_filter_program(tuple(
+        (f['filter_type'], f['filter_value'] or '', bool(f['is_whitelist'])) for f in filters
+    ))
+
+class MessageFilters:
+    def __init__(self):
+        self.translator = Translator()
     
     # ========== DUPLICATE FILTER ==========
     async def check_duplicate(self, task_id: int, message, db) -> bool:
         """Check if message is a duplicate"""
-        # Create hash from message content
-        content = ""
-        if message.text:
-            content = message.text
-        elif message.caption:
-            content = message.caption
-        elif message.photo:
-            # Use file_unique_id for photos, videos, documents for better uniqueness
-            content = f"photo_{message.photo[-1].file_unique_id}"
-        elif message.video:
-            content = f"video_{message.video.file_unique_id}"
-        elif message.document:
-            content = f"doc_{message.document.file_unique_id}"
-        elif message.audio:
-            content = f"audio_{message.audio.file_unique_id}"
-        elif message.voice:
-            content = f"voice_{message.voice.file_unique_id}"
-        elif message.video_note:
-            content = f"video_note_{message.video_note.file_unique_id}"
-        elif message.animation:
-            content = f"animation_{message.animation.file_unique_id}"
-        
-        if not content:
-            return False
-        
-        message_hash = hashlib.md5(content.encode()).hexdigest()
-        return await db.is_duplicate(task_id, message_hash)
+        return await MessageAnalysis(message).is_duplicate(task_id, db)
     
     # ========== CLEANER FILTER ==========
-    def apply_cleaner(self, text: str, cleaner_options: Dict) -> str:
-        """Clean message by removing specified patterns"""
-        if not text:
+    def apply_cleaner(self, text: str, cleaner_options: Iterable[str]) -> str:
+        """Clean message by removing the patterns of the enabled options"""
+        pattern = compile_cleaner(tuple(cleaner_options))
+        if not text or pattern is None:
             return text
         
-        cleaned = text
-        
-        # Make these options configurable if needed via task settings
-        if cleaner_options.get('remove_usernames', True):
-            cleaned = re.sub(r'@\w+', '', cleaned)
-        
-        if cleaner_options.get('remove_urls', True):
-            cleaned = re.sub(r'https?://\S+', '', cleaned)
-            cleaned = re.sub(r't\.me/\S+', '', cleaned)
-        
-        if cleaner_options.get('remove_hashtags', True):
-            cleaned = re.sub(r'#[\w]+', '', cleaned)
-        
-        if cleaner_options.get('remove_mentions', True):
-            # Basic removal of Markdown links like [text](url)
-            cleaned = re.sub(r'\[.*?\]\(.*?\)', '', cleaned)
+        cleaned = pattern.sub('', text)
         
         # Clean up extra whitespace
-        cleaned = re.sub(r'\n\s*\n', '\n\n', cleaned) # Replace multiple blank lines with double blank lines
-        cleaned = cleaned.strip() # Remove leading/trailing whitespace
-        
-        return cleaned
+        cleaned = BLANK_LINES.sub('\n\n', cleaned) # Replace multiple blank lines with double blank lines
+        return cleaned.strip()
+    
+    def clean_entities(self, rich: RichText, cleaner_options: Iterable[str]) -> RichText:
+        """Cleaner for received messages: cut the entities Telegram already found.
+
+        Unlike apply_cleaner this needs no regex scan and keeps the
+        formatting of whatever text is left. Text without entities has no
+        formatting to keep, so it goes through apply_cleaner, which also
+        catches Markdown links Telegram doesn't mark.
+        """
+        options = tuple(cleaner_options)
+        if not rich.text:
+            return rich
+        if not rich.spans:
+            return RichText(self.apply_cleaner(rich.text, options))
+        types = cleaner_entity_types(options)
+        if not types:
+            return rich
+        return rich.remove_entities(types).normalize_whitespace()
     
     # ========== TEXT REPLACEMENT ==========
     def replace_text(self, text: str, replacements: List[Dict]) -> str:
@@ -189,24 +350,8 @@ class MessageFilters:
         if not text or not replacements:
             return text
         
-        result = text
-        for rep in replacements:
-            old_text = rep.get('old')
-            new_text = rep.get('new', '') # Default to empty string if not provided
-            case_sensitive = rep.get('case_sensitive', True)
-            
-            if not old_text: # Skip if 'old' text is missing
-                continue
-                
-            if case_sensitive:
-                result = result.replace(old_text, new_text)
-            else:
-                # Case insensitive replacement using regex
-                # re.escape ensures special characters in old_text are treated literally
-                pattern = re.compile(re.escape(old_text), re.IGNORECASE)
-                result = pattern.sub(new_text, result)
-        
-        return result
+        # All rules in one scan; tasks use the cached compile_replace_rules instead
+        return Replacer(replacements).sub(text)
     
     # ========== REMOVE LINE BY KEYWORD ==========
     def remove_line_by_keyword(self, text: str, keywords: List[str]) -> str:
@@ -214,40 +359,17 @@ class MessageFilters:
         if not text or not keywords:
             return text
         
-        lines = text.split('\n')
-        filtered_lines = []
-        
-        # Normalize keywords to lower case for case-insensitive matching
-        keywords_lower = [kw.lower() for kw in keywords if kw.strip()]
-        
-        if not keywords_lower: # Skip if keywords list is empty after stripping
-            return text
-
-        for line in lines:
-            line_lower = line.lower()
-            # Check if any of the keywords are present in the line
-            if not any(kw in line_lower for kw in keywords_lower):
-                filtered_lines.append(line)
-        
-        return '\n'.join(filtered_lines)
+        # Tasks use the cached compile_line_rules; this builds the same matcher once
+        return LineRules({'keywords': keywords}).apply(RichText(text)).text
     
     # ========== REMOVE LINE BY ORDER ==========
     def remove_line_by_order(self, text: str, line_numbers: List[int]) -> str:
-        """Remove lines by their order (1-indexed)"""
+        """Remove lines by their order (1-indexed, negative counts from the end)"""
         if not text or not line_numbers:
             return text
         
-        lines = text.split('\n')
-        filtered_lines = []
-        
-        # Ensure line_numbers are sorted and unique for efficiency if needed, but not strictly required for correctness
-        valid_line_numbers = set(ln for ln in line_numbers if isinstance(ln, int) and ln > 0)
-
-        for i, line in enumerate(lines, 1):
-            if i not in valid_line_numbers:
-                filtered_lines.append(line)
-        
-        return '\n'.join(filtered_lines)
+        valid_line_numbers = [ln for ln in line_numbers if isinstance(ln, int) and ln != 0]
+        return LineRules({'lines': valid_line_numbers}).apply(RichText(text)).text
     
     # ========== TRANSLATION ==========
     async def translate_text(self, text: str, target_lang: str) -> str:
@@ -292,80 +414,104 @@ class MessageFilters:
         return result
     
     # ========== APPLY ALL FILTERS ==========
-    async def apply_filters(self, message, task: Dict, filters: List[Dict], db) -> Optional[Dict]:
-        """Apply all filters and return processed message data"""
-        # Default text and caption from message.text or message.caption
-        initial_text = message.text if message.text else message.caption
+    def apply_text_rules(self, rich: RichText, line_rules_json: Optional[str], cleaner_options: Tuple[str, ...],
+                         replace_rules_json: Optional[str]) -> RichText:
+        # Drop lines first, so line numbers refer to the lines of the original message
+        line_rules = compile_line_rules(line_rules_json)
+        if line_rules:
+            rich = line_rules.apply(rich)
+        
+        # Apply cleaner filter with the task's options
+        rich = self.clean_entities(rich, cleaner_options)
+        
+        # Apply the task's replacement rules
+        replacer = compile_replace_rules(replace_rules_json)
+        if replacer:
+            rich = replacer.apply(rich)
+        return rich
+    
+    async def apply_filters(self, message, task: Dict, filters: List[Dict], db,
+                            analysis: MessageAnalysis = None) -> Optional[Dict]:
+        """Apply all filters and return processed message data.
+
+        Pass the message's shared analysis when several tasks filter the
+        same message, so they don't each redo the work.
+        """
+        if analysis is None:
+            analysis = MessageAnalysis(message)
         processed_caption = message.caption # Keep original caption if text is empty
         
         result = {
             'should_forward': True,
-            'text': initial_text or "", # Ensure text is at least an empty string
+            'text': analysis.text,
+            'entities': (),
+            'content_hash': analysis.content_hash,
+            'fingerprint': None,
             'caption': processed_caption,
             'media': None, # Placeholder for media handling if needed
             'reply_markup': message.reply_markup # Preserve reply markup if any
         }
         
-        # Check user filter
-        if not self.check_user_filter(message, filters):
-            result['should_forward'] = False
-            return result
-        
-        # Check keyword filter
-        if not self.check_keyword_filter(result['text'], filters):
-            result['should_forward'] = False
-            return result
-        
-        # Check regex filter
-        if not self.check_regex_filter(result['text'], filters):
-            result['should_forward'] = False
-            return result
-        
-        # Check crypto filter
-        if not self.check_crypto_filter(result['text'], filters):
-            result['should_forward'] = False
-            return result
-        
-        # Check duplicate filter
-        if task.get('remove_duplicates', 1): # Default to true if not specified
-            if await self.check_duplicate(task['task_id'], message, db):
+        # Run the pass/reject checks, cheapest and most selective first
+        task_id = task['task_id']
+        program = filter_program(filters)
+        for check in filter_stats.order(task_id, program.checks(task)):
+            started = time.perf_counter()
+            if check == 'duplicate':
+                passed = not await analysis.is_duplicate(task_id, db)
+            elif check == 'near_duplicate':
+                fingerprint = await analysis.fingerprint()
+                passed = fingerprint is None or not near_duplicates.seen(
+                    task_id, *fingerprint, task['near_duplicate_distance']
+                )
+                result['fingerprint'] = fingerprint
+            else:
+                passed = program.check(check, analysis)
+            elapsed = time.perf_counter() - started
+            filter_stats.record(task_id, check, elapsed, passed)
+            metrics.observe(f"filter_{check}", elapsed, started)
+            
+            if not passed:
+                filter_rejections.inc(check)
                 result['should_forward'] = False
                 return result
         
-        # Apply cleaner filter - options should ideally come from task settings
-        cleaner_options = {
-            'remove_usernames': True,
-            'remove_urls': True,
-            'remove_hashtags': True,
-            'remove_mentions': True
-        }
-        result['text'] = self.apply_cleaner(result['text'], cleaner_options)
+        # Line rules, cleaner and replacements; tasks with the same rules share the result
+        text_rules = (task.get('line_rules'), parse_cleaner_options(task.get('cleaner_options')), task.get('replace_rules'))
+        with metrics.stage('text_rules'):
+            rich = analysis.memo(('text_rules', text_rules), lambda: self.apply_text_rules(analysis.rich, *text_rules))
         
         # Convert buttons to text if enabled
         if task.get('convert_buttons', 0): # Default to false if not specified
             button_text = self.convert_buttons_to_text(message)
             if button_text:
                 # Append button text to the main message text
-                result['text'] += f"\n\n{button_text}"
+                rich = rich.append(RichText(f"\n\n{button_text}"))
         
-        # Add header/footer
+        # Add header/footer; users write these in HTML, which becomes entities here
         # Ensure header_text and footer_text are retrieved safely from task dict
         header_text = task.get('header_text')
         footer_text = task.get('footer_text')
 
         if header_text:
-            result['text'] = self.add_header_footer(result['text'], header=header_text)
+            rich = rich.prepend(html_to_rich(header_text).append(RichText("\n\n")))
         
         if footer_text:
-            result['text'] = self.add_header_footer(result['text'], footer=footer_text)
+            rich = rich.append(RichText("\n\n").append(html_to_rich(footer_text)))
         
-        # Translate if enabled
+        # Translate if enabled; the translation can't keep entity offsets
         # Ensure translate_to is retrieved safely and is not None/empty
         target_lang = task.get('translate_to')
         if target_lang:
-            result['text'] = await self.translate_text(result['text'], target_lang)
+            with metrics.stage('translate'):
+                translated = await self.translate_text(rich.text, target_lang)
+            if translated != rich.text:
+                rich = RichText(translated)
         
+        result['text'] = rich.text
+        result['entities'] = rich.entities
         return result
 
 # Global filters instance
-filters = MessageFilters()
\ No newline at end of file
+filters = MessageFilters()
+filter_stats = FilterStats()
\ No newline at end of file
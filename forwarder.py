@@ -2,24 +2,123 @@
 Telegram Forward Bot - Core Forwarder Module
 """
 import asyncio
-import hashlib
+import time
 from typing import Optional, Dict
 from telegram import Update, Bot
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
 import config
 from database import db
+from delayqueue import DelayedForwardQueue
 from filters import filters
+from metrics import metrics
+from neardup import near_duplicates
+from richtext import RichText, html_to_rich
+from sendqueue import SendQueue
+from tracing import current_trace, tracer
 from watermark import watermark_processor
 
+message_outcomes = metrics.counter(
+    'forward_messages_total', 'Messages handled per task: forwarded, filtered, delayed or failed', ('outcome',)
+)
+scheduled_post_outcomes = metrics.counter('forward_scheduled_posts_total', 'Scheduled posts sent or failed', ('outcome',))
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of blocking"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+    
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+    
+    def reserve(self, now: float) -> float:
+        """Take a token and return how long to wait before using it"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+class OutboundLimiter:
+    """Paces outgoing messages to stay under the Bot API flood limits.
+
+    A global bucket caps the total send rate and a bucket per chat caps each
+    destination. Catch-up traffic after downtime also passes a bucket
+    limited to CATCHUP_RATE_SHARE of the global rate, so it never crowds out
+    live forwards. Buckets are reserved in stages (catch-up, chat, global)
+    so a sender waiting on one bucket doesn't hold slots in the next.
+    """
+    
+    def __init__(self, rate: float = config.OUTBOUND_RATE, chat_rate: float = config.OUTBOUND_CHAT_RATE,
+                 chat_burst: float = config.OUTBOUND_CHAT_BURST, catchup_share: float = config.CATCHUP_RATE_SHARE):
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.catchup_share = catchup_share
+        self._global = None
+        self._catchup = None
+        self._chats: Dict[int, TokenBucket] = {}
+        self.waiting = 0
+    
+    async def _wait(self, bucket: TokenBucket):
+        wait = bucket.reserve(asyncio.get_running_loop().time())
+        if wait > 0:
+            self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.waiting -= 1
+    
+    async def acquire(self, chat_id: int, catchup: bool = False):
+        """Wait for a send slot to this chat"""
+        now = asyncio.get_running_loop().time()
+        if self._global is None:
+            self._global = TokenBucket(self.rate, self.rate, now)
+            self._catchup = TokenBucket(self.rate * self.catchup_share, 1, now)
+        
+        if catchup:
+            await self._wait(self._catchup)
+        
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                self._prune(now)
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        
+        await self._wait(bucket)
+        await self._wait(self._global)
+    
+    async def send(self, chat_id: int, send, catchup: bool = False):
+        """Run send() in a paced slot, retrying once if Telegram asks us to back off"""
+        with metrics.stage('rate_limit'):
+            await self.acquire(chat_id, catchup)
+        try:
+            with metrics.stage('send'):
+                return await send()
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            with metrics.stage('rate_limit'):
+                await self.acquire(chat_id, catchup)
+            with metrics.stage('send'):
+                return await send()
+    
+    def _prune(self, now: float):
+        # Idle chats have full buckets and can be recreated on demand
+        self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.is_full(now)}
+
 class ForwardEngine:
     def __init__(self):
         self.processing_messages = set()  # Track messages being processed
+        self.queued: Dict[int, Dict[int, Dict]] = {}  # task_id -> {message_id: filter result} not sent yet
     
     async def forward_message(self, bot: Bot, message, task: Dict, 
-                             filters_list: list) -> bool:
+                             filters_list: list, analysis=None) -> bool:
         """Forward a single message with all processing"""
         task_id = task['task_id']
-        dest_chat_id = task['destination_chat_id']
         
         # Check if already processing (prevent duplicates)
         msg_key = f"{task_id}_{message.message_id}"
@@ -27,154 +126,255 @@ class ForwardEngine:
             return False
         
         self.processing_messages.add(msg_key)
+        queued = False
         
         try:
             # Apply filters
-            filter_result = await filters.apply_filters(message, task, filters_list, db)
+            with metrics.stage('filters'):
+                filter_result = await filters.apply_filters(message, task, filters_list, db, analysis)
             
-            if not filter_result['should_forward']:
+            if not filter_result['should_forward'] or self._queued_duplicate(task, filter_result):
+                message_outcomes.inc('filtered')
                 return False
             
-            # Apply delay if set
+            # Queue the send so pacing never holds up the handler; the key stays taken until it goes out
+            trace = current_trace.get()
+            filter_result['trace_id'] = trace.trace_id if trace else None
+            filter_result['queued_at'] = time.time()
+            item = (bot, message, task, filter_result)
+            self.queued.setdefault(task_id, {})[message.message_id] = filter_result
             delay = task.get('forward_delay', 0)
             if delay > 0:
-                await asyncio.sleep(delay)
+                delayed_queue.push(delay, item)
+                message_outcomes.inc('delayed')
+            else:
+                send_queue.push(task['destination_chat_id'], item)
+            queued = True
+            return True
             
-            # Process and forward message
+        except Exception as e:
+            print(f"Forward error: {e}")
+        finally:
+            if not queued:
+                self.processing_messages.discard(msg_key)
+        
+        return False
+    
+    def _queued_duplicate(self, task: Dict, filter_result: Dict) -> bool:
+        """Whether a message of this task still waiting to be sent has the same content.
+
+        Duplicates are recorded once a send completes, so the filters can't
+        see messages that are queued or delayed.
+        """
+        queued = self.queued.get(task['task_id'])
+        if not queued:
+            return False
+        content_hash = filter_result['content_hash'] if task.get('remove_duplicates', 1) else None
+        fingerprint = filter_result['fingerprint']
+        distance = task.get('near_duplicate_distance')
+        for other in queued.values():
+            if content_hash and other['content_hash'] == content_hash:
+                return True
+            if (fingerprint and other['fingerprint'] and other['fingerprint'][0] == fingerprint[0]
+                    and (other['fingerprint'][1] ^ fingerprint[1]).bit_count() <= distance):
+                return True
+        return False
+    
+    async def _deliver(self, bot: Bot, message, task: Dict, filter_result: Dict) -> bool:
+        """Send a filtered message and record it"""
+        task_id = task['task_id']
+        
+        # Process and forward message; deliver covers pacing, watermarking and the send itself
+        with metrics.stage('deliver'):
             forwarded = await self._send_processed_message(
-                bot, message, dest_chat_id, filter_result, task
+                bot, message, task['destination_chat_id'], filter_result, task
             )
-            
-            if forwarded:
-                # Record for duplicate detection
-                content = filter_result['text'] or ""
-                message_hash = hashlib.md5(content.encode()).hexdigest()
+        message_outcomes.inc('forwarded' if forwarded else 'failed')
+        
+        if forwarded:
+            with metrics.stage('db_write'):
+                # Record for duplicate detection, under the same key the duplicate check looks up
                 await db.add_forwarded_message(
                     task_id, message.message_id, 
-                    message.chat.id, message_hash
+                    message.chat.id, filter_result['content_hash']
                 )
+                if filter_result.get('fingerprint') is not None:
+                    await near_duplicates.add(task_id, *filter_result['fingerprint'])
                 
                 # Update statistics
                 await db.increment_stat(task['user_id'], task_id)
-                
-                return True
-            
+        
+        return forwarded
+    
+    async def release_delayed(self, batch: list):
+        """Deliver a batch of messages whose forward delay has passed"""
+        await asyncio.gather(*(self._deliver_queued('delayed', *item) for item in batch))
+    
+    async def release_queued(self, item: tuple):
+        """Deliver a message from its destination's send queue"""
+        await self._deliver_queued('send', *item)
+    
+    async def _deliver_queued(self, kind: str, bot: Bot, message, task: Dict, filter_result: Dict) -> bool:
+        try:
+            # A trace of its own, linked to the one that queued the message
+            with tracer.trace(kind, task_id=task['task_id'], message_id=message.message_id,
+                              queued_by=filter_result.get('trace_id'),
+                              waited=round(time.time() - filter_result.get('queued_at', time.time()), 3)):
+                return await self._deliver(bot, message, task, filter_result)
         except Exception as e:
             print(f"Forward error: {e}")
+            return False
         finally:
-            self.processing_messages.discard(msg_key)
-        
-        return False
+            self.processing_messages.discard(f"{task['task_id']}_{message.message_id}")
+            queued = self.queued.get(task['task_id'])
+            if queued is not None:
+                queued.pop(message.message_id, None)
+                if not queued:
+                    del self.queued[task['task_id']]
     
     async def _send_processed_message(self, bot: Bot, message, dest_chat_id: int,
                                      filter_result: Dict, task: Dict) -> bool:
         """Send the processed message to destination"""
         try:
             processed_text = filter_result['text']
+            entities = filter_result['entities'] or None
             
             # Handle different message types
             if message.text:
                 # Text message
-                await bot.send_message(
+                await outbound.send(dest_chat_id, lambda: bot.send_message(
                     chat_id=dest_chat_id,
                     text=processed_text,
-                    parse_mode=ParseMode.HTML if self._has_html(processed_text) else None,
+                    entities=entities,
                     disable_web_page_preview=True
-                )
+                ))
                 return True
             
             elif message.photo:
                 # Photo with optional watermark
                 photo = message.photo[-1]  # Get highest resolution
                 
-                if task.get('watermark_text'):
-                    # Download and add watermark
-                    watermarked = await watermark_processor.process_photo_with_watermark(
-                        bot, photo.file_id, 
-                        task['watermark_text'],
-                        task.get('watermark_position', 'bottom-right')
+                logo = watermark_processor.task_logo(task)
+                watermark_key = watermark_processor.watermark_key(task, logo)
+                if watermark_key:
+                    position = task.get('watermark_position') or 'bottom-right'
+                    
+                    # Reuse a copy already uploaded for another destination
+                    cached_file_id = await watermark_processor.get_cached_file_id(
+                        db, photo.file_unique_id, watermark_key, position
                     )
+                    if cached_file_id:
+                        try:
+                            await outbound.send(dest_chat_id, lambda: bot.send_photo(
+                                chat_id=dest_chat_id,
+                                photo=cached_file_id,
+                                caption=processed_text,
+                                caption_entities=entities
+                            ))
+                            return True
+                        except BadRequest as e:
+                            print(f"Cached watermark file rejected: {e}")
+                            await watermark_processor.forget_file_id(
+                                db, photo.file_unique_id, watermark_key, position
+                            )
+                    
+                    # Download and add watermark
+                    with metrics.stage('watermark'):
+                        watermarked = await watermark_processor.process_photo_with_watermark(
+                            bot, photo.file_id, 
+                            task.get('watermark_text'),
+                            position,
+                            logo_path=logo[0] if logo else None,
+                            logo_scale=task.get('watermark_logo_scale')
+                        )
                     
                     if watermarked:
-                        await bot.send_photo(
+                        sent = await outbound.send(dest_chat_id, lambda: bot.send_photo(
                             chat_id=dest_chat_id,
                             photo=watermarked,
                             caption=processed_text,
-                            parse_mode=ParseMode.HTML if self._has_html(processed_text) else None
-                        )
+                            caption_entities=entities
+                        ))
+                        if sent and sent.photo:
+                            await watermark_processor.remember_file_id(
+                                db, photo.file_unique_id, watermark_key, position,
+                                sent.photo[-1].file_id
+                            )
                         return True
                 
                 # Forward without watermark or if watermark failed
-                await bot.send_photo(
+                await outbound.send(dest_chat_id, lambda: bot.send_photo(
                     chat_id=dest_chat_id,
                     photo=photo.file_id,
                     caption=processed_text,
-                    parse_mode=ParseMode.HTML if self._has_html(processed_text) else None
-                )
+                    caption_entities=entities
+                ))
                 return True
             
             elif message.video:
                 # Video
-                await bot.send_video(
+                await outbound.send(dest_chat_id, lambda: bot.send_video(
                     chat_id=dest_chat_id,
                     video=message.video.file_id,
                     caption=processed_text,
-                    parse_mode=ParseMode.HTML if self._has_html(processed_text) else None
-                )
+                    caption_entities=entities
+                ))
                 return True
             
             elif message.audio:
                 # Audio
-                await bot.send_audio(
+                await outbound.send(dest_chat_id, lambda: bot.send_audio(
                     chat_id=dest_chat_id,
                     audio=message.audio.file_id,
                     caption=processed_text,
-                    parse_mode=ParseMode.HTML if self._has_html(processed_text) else None
-                )
+                    caption_entities=entities
+                ))
                 return True
             
             elif message.voice:
                 # Voice message
-                await bot.send_voice(
+                await outbound.send(dest_chat_id, lambda: bot.send_voice(
                     chat_id=dest_chat_id,
                     voice=message.voice.file_id,
-                    caption=processed_text
-                )
+                    caption=processed_text,
+                    caption_entities=entities
+                ))
                 return True
             
             elif message.video_note:
                 # Video note (round video)
-                await bot.send_video_note(
+                await outbound.send(dest_chat_id, lambda: bot.send_video_note(
                     chat_id=dest_chat_id,
                     video_note=message.video_note.file_id
-                )
+                ))
                 return True
             
             elif message.document:
                 # Document
-                await bot.send_document(
+                await outbound.send(dest_chat_id, lambda: bot.send_document(
                     chat_id=dest_chat_id,
                     document=message.document.file_id,
                     caption=processed_text,
-                    parse_mode=ParseMode.HTML if self._has_html(processed_text) else None
-                )
+                    caption_entities=entities
+                ))
                 return True
             
             elif message.sticker:
                 # Sticker
-                await bot.send_sticker(
+                await outbound.send(dest_chat_id, lambda: bot.send_sticker(
                     chat_id=dest_chat_id,
                     sticker=message.sticker.file_id
-                )
+                ))
                 return True
             
             elif message.animation:
                 # Animation (GIF)
-                await bot.send_animation(
+                await outbound.send(dest_chat_id, lambda: bot.send_animation(
                     chat_id=dest_chat_id,
                     animation=message.animation.file_id,
-                    caption=processed_text
-                )
+                    caption=processed_text,
+                    caption_entities=entities
+                ))
                 return True
             
             elif message.poll:
@@ -184,31 +384,31 @@ class ForwardEngine:
                 for i, option in enumerate(poll.options, 1):
                     poll_text += f"{i}. {option.text}\n"
                 
-                await bot.send_message(
+                await outbound.send(dest_chat_id, lambda: bot.send_message(
                     chat_id=dest_chat_id,
                     text=poll_text,
                     parse_mode=ParseMode.HTML
-                )
+                ))
                 return True
             
             elif message.location:
                 # Location
-                await bot.send_location(
+                await outbound.send(dest_chat_id, lambda: bot.send_location(
                     chat_id=dest_chat_id,
                     latitude=message.location.latitude,
                     longitude=message.location.longitude
-                )
+                ))
                 return True
             
             elif message.contact:
                 # Contact
                 contact = message.contact
-                await bot.send_contact(
+                await outbound.send(dest_chat_id, lambda: bot.send_contact(
                     chat_id=dest_chat_id,
                     phone_number=contact.phone_number,
                     first_name=contact.first_name,
                     last_name=contact.last_name
-                )
+                ))
                 return True
             
             return False
@@ -217,14 +417,26 @@ class ForwardEngine:
             print(f"Send processed message error: {e}")
             return False
     
-    def _has_html(self, text: str) -> bool:
-        """Check if text contains HTML tags"""
-        if not text:
+    async def send_scheduled_post(self, bot: Bot, post: Dict, catchup: bool = False) -> bool:
+        """Send a scheduled post through the paced outbound path"""
+        if post.get('message_entities') is not None:
+            rich = RichText.from_json(post['message_content'], post['message_entities'])
+        else:
+            # Posts saved before entities were stored were written as HTML
+            rich = html_to_rich(post['message_content'])
+        try:
+            await outbound.send(post['chat_id'], lambda: bot.send_message(
+                chat_id=post['chat_id'],
+                text=rich.text,
+                entities=rich.entities or None,
+                disable_web_page_preview=True
+            ), catchup=catchup)
+            scheduled_post_outcomes.inc('sent')
+            return True
+        except Exception as e:
+            print(f"Auto post {post['schedule_id']} error: {e}")
+            scheduled_post_outcomes.inc('failed')
             return False
-        html_tags = ['<b>', '</b>', '<i>', '</i>', '<code>', '</code>', 
-                     '<pre>', '</pre>', '<a ', '</a>', '<u>', '</u>',
-                     '<s>', '</s>', '<tg-spoiler>', '</tg-spoiler>']
-        return any(tag in text for tag in html_tags)
     
     async def clone_source_chat(self, bot: Bot, task: Dict, limit: int = 100):
         """Clone messages from source chat to destination"""
@@ -272,5 +484,15 @@ class ForwardEngine:
         
         return sent_count, failed_count
 
-# Global forward engine
+# Global outbound limiter, forward engine, send queue and delayed forward queue
+outbound = OutboundLimiter()
 forward_engine = ForwardEngine()
+send_queue = SendQueue(forward_engine.release_queued)
+delayed_queue = DelayedForwardQueue(forward_engine.release_delayed)
+
+# Queue depths, read when metrics are scraped
+metrics.gauge('forward_send_queue_depth', 'Messages waiting in a destination send queue', read=lambda: len(send_queue))
+metrics.gauge('forward_delayed_queue_depth', 'Messages waiting out a forward delay', read=lambda: len(delayed_queue))
+metrics.gauge('forward_in_flight_messages', 'Messages being filtered, delayed or sent',
+              read=lambda: len(forward_engine.processing_messages))
+metrics.gauge('forward_outbound_waiting', 'Sends waiting for a rate limit slot', read=lambda: outbound.waiting)
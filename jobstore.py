@@ -0,0 +1,169 @@
+"""
+Telegram Forward Bot - Persistent Job Store
+
+APScheduler job store that keeps jobs in the bot's own SQLite database, so
+scheduled jobs survive restarts without an extra dependency.
+"""
+import pickle
+import sqlite3
+from contextlib import contextmanager
+from typing import List, Set
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+import config
+
+class SQLiteJobStore(BaseJobStore):
+    def __init__(self, db_file: str = config.DATABASE_FILE, tablename: str = 'apscheduler_jobs',
+                 pickle_protocol: int = pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.db_file = db_file
+        self.tablename = tablename
+        self.pickle_protocol = pickle_protocol
+        self._conn = None
+        self._batch_depth = 0
+    
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.tablename} (
+                id TEXT PRIMARY KEY,
+                next_run_time REAL,
+                job_state BLOB NOT NULL
+            )
+        ''')
+        self._conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{self.tablename}_next_run_time
+            ON {self.tablename} (next_run_time)
+        ''')
+        self._conn.commit()
+    
+    @contextmanager
+    def batch(self):
+        """Group many job writes into a single transaction"""
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._conn.commit()
+    
+    def _commit(self):
+        if self._batch_depth == 0:
+            self._conn.commit()
+    
+    def get_job_ids(self) -> Set[str]:
+        """IDs of all stored jobs, without unpickling them"""
+        return {row[0] for row in self._conn.execute(f'SELECT id FROM {self.tablename}')}
+    
+    def get_overdue_jobs(self, before) -> List[tuple]:
+        """(id, next_run_time) of jobs due before a time, without unpickling them"""
+        rows = self._conn.execute(
+            f'SELECT id, next_run_time FROM {self.tablename} WHERE next_run_time < ?',
+            (datetime_to_utc_timestamp(before),)
+        ).fetchall()
+        return [(job_id, utc_timestamp_to_datetime(next_run_time)) for job_id, next_run_time in rows]
+    
+    def lookup_job(self, job_id):
+        row = self._conn.execute(
+            f'SELECT job_state FROM {self.tablename} WHERE id = ?', (job_id,)
+        ).fetchone()
+        return self._reconstitute_job(row[0]) if row else None
+    
+    def get_due_jobs(self, now):
+        timestamp = datetime_to_utc_timestamp(now)
+        return self._get_jobs('WHERE next_run_time <= ?', (timestamp,))
+    
+    def get_next_run_time(self):
+        row = self._conn.execute(f'''
+            SELECT next_run_time FROM {self.tablename}
+            WHERE next_run_time IS NOT NULL ORDER BY next_run_time LIMIT 1
+        ''').fetchone()
+        return utc_timestamp_to_datetime(row[0]) if row else None
+    
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+    
+    def add_job(self, job):
+        try:
+            self._conn.execute(
+                f'INSERT INTO {self.tablename} (id, next_run_time, job_state) VALUES (?, ?, ?)',
+                (job.id, datetime_to_utc_timestamp(job.next_run_time),
+                 pickle.dumps(job.__getstate__(), self.pickle_protocol))
+            )
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+        self._commit()
+    
+    def add_jobs(self, jobs: List[Job]):
+        """Insert many jobs in one transaction; existing jobs with the same IDs are replaced"""
+        self._conn.executemany(
+            f'INSERT OR REPLACE INTO {self.tablename} (id, next_run_time, job_state) VALUES (?, ?, ?)',
+            [(job.id, datetime_to_utc_timestamp(job.next_run_time),
+              pickle.dumps(job.__getstate__(), self.pickle_protocol)) for job in jobs]
+        )
+        self._commit()
+    
+    def update_job(self, job):
+        cursor = self._conn.execute(
+            f'UPDATE {self.tablename} SET next_run_time = ?, job_state = ? WHERE id = ?',
+            (datetime_to_utc_timestamp(job.next_run_time),
+             pickle.dumps(job.__getstate__(), self.pickle_protocol), job.id)
+        )
+        if cursor.rowcount == 0:
+            raise JobLookupError(job.id)
+        self._commit()
+    
+    def remove_job(self, job_id):
+        cursor = self._conn.execute(f'DELETE FROM {self.tablename} WHERE id = ?', (job_id,))
+        if cursor.rowcount == 0:
+            raise JobLookupError(job_id)
+        self._commit()
+    
+    def remove_all_jobs(self):
+        self._conn.execute(f'DELETE FROM {self.tablename}')
+        self._commit()
+    
+    def shutdown(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+    
+    def _reconstitute_job(self, job_state) -> Job:
+        job_state = pickle.loads(job_state)
+        job_state['jobstore'] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+    
+    def _get_jobs(self, where: str = '', params: tuple = ()) -> List[Job]:
+        jobs = []
+        failed_job_ids = []
+        for job_id, job_state in self._conn.execute(
+            f'SELECT id, job_state FROM {self.tablename} {where} ORDER BY next_run_time', params
+        ):
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except BaseException:
+                self._logger.exception('Unable to restore job "%s" -- removing it', job_id)
+                failed_job_ids.append(job_id)
+        
+        # Remove all the jobs we failed to restore
+        if failed_job_ids:
+            self._conn.executemany(
+                f'DELETE FROM {self.tablename} WHERE id = ?', [(job_id,) for job_id in failed_job_ids]
+            )
+            self._commit()
+        
+        return jobs
+    
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (db_file={self.db_file})>"
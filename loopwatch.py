@@ -0,0 +1,124 @@
+"""
+Telegram Forward Bot - Event Loop Watchdog
+
+Measures event loop lag all the time and catches whatever blocks the loop.
+A probe coroutine sleeps LOOP_WATCH_INTERVAL at a time and records how
+late it wakes up. A watchdog thread watches the probe's heartbeat; when the
+loop stops beating for longer than LOOP_STALL_THRESHOLD it grabs the loop
+thread's stack and current task, so the stall is reported with what was
+running. Code that blocks inside C without releasing the GIL (a huge regex,
+say) is caught as soon as it returns to Python, usually still in its caller.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+import config
+from metrics import metrics
+from profiler import ROOT, coroutine_name
+
+def stack_summary(frame, limit: int = 4) -> str:
+    """Innermost frame plus the nearest frames of our own code, innermost first"""
+    if frame is None:
+        return 'unknown'
+    parts = []
+    leaf = frame
+    while frame is not None and len(parts) < limit:
+        code = frame.f_code
+        if code.co_filename.startswith(ROOT) or frame is leaf:
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ' < '.join(parts)
+
+class LoopWatch:
+    """Event loop lag probe, lag percentiles and a log of recent stalls"""
+    
+    def __init__(self, interval: float = config.LOOP_WATCH_INTERVAL,
+                 threshold: float = config.LOOP_STALL_THRESHOLD, window: int = config.LOOP_LAG_WINDOW):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: Deque[float] = deque(maxlen=window)
+        self.stalls: Deque[Dict] = deque(maxlen=config.LOOP_STALL_HISTORY)
+        self._beat = 0.0
+        self._pending: Optional[Dict] = None  # Stall seen by the watchdog, waiting for its length
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        
+        self.lag_seconds = metrics.histogram('forward_event_loop_lag_seconds', 'How late the event loop lag probe woke up')
+        self.stall_count = metrics.counter('forward_event_loop_stalls_total', 'Times the event loop was blocked past the threshold')
+        for quantile in (50, 95, 99):
+            metrics.gauge(
+                f'forward_event_loop_lag_p{quantile}_seconds', f'p{quantile} event loop lag over the recent window',
+                read=lambda quantile=quantile: self.percentile(quantile / 100)
+            )
+    
+    def percentile(self, quantile: float) -> float:
+        if not self.lags:
+            return 0.0
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+    
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._stop.clear()
+        self._beat = time.perf_counter()
+        self._task = loop.create_task(self._probe())
+        self._thread = threading.Thread(
+            target=self._watch, args=(loop, threading.get_ident()), name='loopwatch', daemon=True
+        )
+        self._thread.start()
+    
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _probe(self):
+        while True:
+            self._beat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - self._beat - self.interval)
+            self.lags.append(lag)
+            self.lag_seconds.observe(lag)
+            
+            stall, self._pending = self._pending, None
+            if lag >= self.threshold:
+                # The watchdog may not have got the GIL in time to see what ran
+                stall = stall or {'at': time.time(), 'coroutine': 'unknown', 'stack': 'unknown'}
+                stall['lag'] = lag
+                self.stalls.append(stall)
+                self.stall_count.inc()
+                print(f"⚠️ Event loop blocked {lag * 1000:.0f} ms in {stall['coroutine']}: {stall['stack']}")
+    
+    def _watch(self, loop: asyncio.AbstractEventLoop, thread_id: int):
+        seen = None
+        while not self._stop.wait(min(self.interval, self.threshold / 2)):
+            beat = self._beat
+            if beat == seen or time.perf_counter() - beat - self.interval < self.threshold:
+                continue
+            # Once per stall: the probe hasn't woken up well past its deadline
+            seen = beat
+            frame = sys._current_frames().get(thread_id)
+            try:
+                self._pending = {
+                    'at': time.time(),
+                    'coroutine': coroutine_name(asyncio.current_task(loop)),
+                    'stack': stack_summary(frame),
+                }
+            finally:
+                del frame
+    
+    def recent_stalls(self, count: int = 5) -> List[Dict]:
+        return list(self.stalls)[-count:]
+
+# Global event loop watchdog
+loop_watch = LoopWatch()
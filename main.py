@@ -4,8 +4,13 @@ Telegram Forward Bot - PLATINUM Edition
 Main Bot File with All Commands
 """
 import asyncio
+import html
+import json
 import logging
 import re # Import re module for regex operations
+import time
+import pytz
+from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, 
@@ -15,8 +20,19 @@ from telegram.constants import ParseMode
 
 import config
 from database import db
-from forwarder import forward_engine
-from scheduler import scheduler
+from filters import MessageAnalysis, filter_stats
+from forwarder import forward_engine, send_queue, delayed_queue
+from loopwatch import loop_watch
+from metrics import InstrumentedRequest, metrics
+from neardup import near_duplicates
+from profiler import profiler
+from richtext import RichText
+from routing import routing
+from scheduler import scheduler, post_run_time, to_db_time
+from textrules import LineRules
+from tracing import tracer
+from downloads import download_manager
+from watermark import watermark_processor
 
 # Enable logging
 logging.basicConfig(
@@ -31,6 +47,20 @@ STATE_AWAITING_SOURCE, STATE_AWAITING_DEST, STATE_MANAGE_FILTERS, \
 STATE_ADD_FILTER_TYPE, STATE_ADD_FILTER_VALUE, STATE_ADD_FILTER_MODE, \
 STATE_ADD_REGEX_VALUE = range(7) # Added STATE_ADD_REGEX_VALUE, though not strictly needed for this change yet
 
+MESSAGE_LIMIT = 4096  # Longest text Telegram accepts in one message
+
+def fit_lines(head: str, lines: list, more: str, tail: str = '') -> str:
+    """Join whole lines under MESSAGE_LIMIT, ending with `more` (formatted with
+    the number left out) when they don't all fit. Lines are never cut, so
+    HTML tags and entities in them stay intact."""
+    text = head
+    room = MESSAGE_LIMIT - len(tail) - len(more.format(len(lines)))
+    for index, line in enumerate(lines):
+        if len(text) + len(line) > room:
+            return text + more.format(len(lines) - index) + tail
+        text += line
+    return text + tail
+
 # ========== START & HELP ==========
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler"""
@@ -136,6 +166,7 @@ async def handle_dest_selection(update: Update, context: ContextTypes.DEFAULT_TY
         destination_chat_id=dest_chat_id,
         destination_chat_title=dest_chat_title
     )
+    await routing.reload_task(task_id)
     
     # Clear temporary data
     context.user_data.pop('source_chat_id', None)
@@ -271,6 +302,11 @@ async def deletetask(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     await db.delete_task(task_id)
+    await routing.reload_task(task_id)
+    scheduler.remove_task_jobs(task_id)
+    filter_stats.forget(task_id)
+    near_duplicates.forget(task_id)
+    watermark_processor.delete_logo(task_id)
     
     await update.message.reply_text(
         f"✅ Task <code>{task_id}</code> has been deleted.",
@@ -300,6 +336,7 @@ async def enabletask(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     await db.enable_task(task_id)
+    await routing.reload_task(task_id)
     await update.message.reply_text(f"✅ Task <code>{task_id}</code> is now ENABLED.", parse_mode=ParseMode.HTML)
 
 async def disabletask(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -325,6 +362,7 @@ async def disabletask(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     await db.disable_task(task_id)
+    await routing.reload_task(task_id)
     await update.message.reply_text(f"✅ Task <code>{task_id}</code> is now DISABLED.", parse_mode=ParseMode.HTML)
 
 # ========== FILTER COMMANDS ==========
@@ -446,6 +484,7 @@ async def addfilter_mode_callback(update: Update, context: ContextTypes.DEFAULT_
 
     try:
         await db.add_filter(task_id, filter_type, filter_value, is_whitelist)
+        await routing.reload_task(task_id)
         
         mode_display = "🟢 Whitelist" if is_whitelist else "🔴 Blacklist"
         await query.message.reply_text(
@@ -497,6 +536,7 @@ async def removefilter_callback(update: Update, context: ContextTypes.DEFAULT_TY
 
     try:
         await db.delete_filter(filter_id)
+        await routing.reload()
         message = f"✅ Filter <code>{filter_id}</code> removed."
         if query:
             await query.message.reply_text(message, parse_mode=ParseMode.HTML)
@@ -566,6 +606,82 @@ async def filters_command_handler(update: Update, context: ContextTypes.DEFAULT_
     except Exception as e:
         await update.message.reply_text(f"❌ Error listing filters: {str(e)}")
 
+async def neardup(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Turn near-duplicate detection on or off for a task"""
+    if len(context.args) < 2:
+        await update.message.reply_text(
+            "🧬 <b>Near-Duplicate Filter</b>\n\n"
+            "Usage: <code>/neardup [task_id] [distance|off]</code>\n\n"
+            f"Skips messages that differ from one forwarded in the last {config.NEAR_DUPLICATE_DAYS} days "
+            f"by at most <i>distance</i> bits of a 64-bit fingerprint (0-{config.NEAR_DUPLICATE_MAX_DISTANCE}). "
+            "Catches reposts with a changed emoji or a few edited words, and photos or videos "
+            "re-uploaded without a caption (compared by their thumbnails).\n"
+            "Example: <code>/neardup 123 3</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    try:
+        task_id = int(context.args[0])
+        if not await get_task_or_deny(update, context, task_id):
+            return
+        
+        if context.args[1].lower() == 'off':
+            distance = None
+        else:
+            distance = int(context.args[1])
+            if not 0 <= distance <= config.NEAR_DUPLICATE_MAX_DISTANCE:
+                await update.message.reply_text(f"❌ Distance must be between 0 and {config.NEAR_DUPLICATE_MAX_DISTANCE}.")
+                return
+        
+        await db.update_task(task_id, near_duplicate_distance=distance)
+        await routing.reload_task(task_id)
+        
+        if distance is None:
+            await update.message.reply_text(f"✅ Near-duplicate filter off for task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
+        else:
+            await update.message.reply_text(
+                f"✅ Task <code>{task_id}</code> now skips messages within {distance} bits of a recent one.",
+                parse_mode=ParseMode.HTML
+            )
+    except ValueError:
+        await update.message.reply_text("❌ Invalid task ID or distance. Please provide numbers.")
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error setting near-duplicate filter: {str(e)}")
+
+async def filterstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show how often each filter check rejects messages and what it costs"""
+    if not context.args:
+        await update.message.reply_text(
+            "📈 <b>Filter Stats</b>\n\n"
+            "Usage: <code>/filterstats [task_id]</code>\n\n"
+            "Checks are listed in the order they currently run.",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    try:
+        task_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("❌ Invalid task ID.")
+        return
+    
+    if not await get_task_or_deny(update, context, task_id):
+        return
+    
+    stats = filter_stats.snapshot(task_id)
+    if not stats:
+        await update.message.reply_text(f"📭 No filtered messages yet for task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
+        return
+    
+    text = f"📈 <b>Filter checks for task {task_id}</b> (in run order):\n\n"
+    for i, check in enumerate(stats, 1):
+        text += (
+            f"{i}. <b>{check['check']}</b>: {check['evaluated']} checked, "
+            f"{check['reject_rate']:.0%} rejected, {check['average_us']:.0f} µs avg\n"
+        )
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+
 async def manage_filters_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Shows the manage filters menu for a task (callback version)."""
     query = update.callback_query
@@ -650,6 +766,7 @@ async def setdelay(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         await db.update_task(task_id, forward_delay=delay)
+        await routing.reload_task(task_id)
         await update.message.reply_text(f"✅ Delay set to <b>{delay} seconds</b> for task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
     except ValueError:
         await update.message.reply_text("❌ Invalid task ID or delay value. Please provide numbers.")
@@ -677,6 +794,7 @@ async def setheader(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         await db.update_task(task_id, header_text=header_text)
+        await routing.reload_task(task_id)
         await update.message.reply_text(f"✅ Header updated for task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
     except ValueError:
         await update.message.reply_text("❌ Invalid task ID. Please provide a number.")
@@ -704,6 +822,7 @@ async def setfooter(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         await db.update_task(task_id, footer_text=footer_text)
+        await routing.reload_task(task_id)
         await update.message.reply_text(f"✅ Footer updated for task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
     except ValueError:
         await update.message.reply_text("❌ Invalid task ID. Please provide a number.")
@@ -738,6 +857,7 @@ async def setwatermark(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         await db.update_task(task_id, watermark_text=watermark_text, watermark_position=position)
+        await routing.reload_task(task_id)
         
         if watermark_text is None:
             await update.message.reply_text(f"✅ Watermark removed from task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
@@ -753,6 +873,68 @@ async def setwatermark(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await update.message.reply_text(f"❌ Error setting watermark: {str(e)}")
 
+async def setlogo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Set a logo image as watermark"""
+    if not context.args:
+        await update.message.reply_text(
+            "🖼️ <b>Set Logo Watermark</b>\n\n"
+            "Reply to an image with <code>/setlogo [task_id] [position] [size%]</code>\n\n"
+            "Send PNG logos as a <b>file</b> to keep their transparency.\n"
+            "Positions: bottom-right, bottom-left, top-right, top-left, center\n"
+            f"Size is the logo width relative to the photo (default {int(config.WATERMARK_LOGO_DEFAULT_SCALE * 100)}%).\n"
+            "Use <code>/setlogo [task_id] none</code> to remove the logo.",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    try:
+        task_id = int(context.args[0])
+        
+        task = await get_task_or_deny(update, context, task_id)
+        if not task:
+            return
+        
+        if len(context.args) > 1 and context.args[1].lower() == 'none':
+            watermark_processor.delete_logo(task_id)
+            await db.update_task(task_id, watermark_logo=None)
+            await routing.reload_task(task_id)
+            await update.message.reply_text(f"✅ Logo removed from task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
+            return
+        
+        reply = update.message.reply_to_message
+        if reply and reply.document and (reply.document.mime_type or '').startswith('image/'):
+            logo_file_id = reply.document.file_id
+        elif reply and reply.photo:
+            logo_file_id = reply.photo[-1].file_id
+        else:
+            await update.message.reply_text("❌ Reply to the logo image (preferably a PNG sent as a file).")
+            return
+        
+        position = context.args[1] if len(context.args) > 1 else (task.get('watermark_position') or 'bottom-right')
+        if position not in config.WATERMARK_POSITIONS:
+            position = 'bottom-right'
+        
+        size_percent = int(context.args[2].rstrip('%')) if len(context.args) > 2 else int(config.WATERMARK_LOGO_DEFAULT_SCALE * 100)
+        size_percent = max(1, min(size_percent, 100))
+        
+        logo_file = await context.bot.get_file(logo_file_id)
+        logo_data = await logo_file.download_as_bytearray()
+        logo_path = watermark_processor.save_logo(task_id, bytes(logo_data))
+        
+        await db.update_task(task_id, watermark_logo=logo_path, watermark_position=position,
+                             watermark_logo_scale=size_percent / 100)
+        await routing.reload_task(task_id)
+        await update.message.reply_text(
+            f"✅ Logo watermark set for task <code>{task_id}</code>:\n"
+            f"Position: <b>{position}</b>\n"
+            f"Size: <b>{size_percent}%</b> of the photo width",
+            parse_mode=ParseMode.HTML
+        )
+    except ValueError:
+        await update.message.reply_text("❌ Invalid task ID or size. Please provide numbers.")
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error setting logo: {str(e)}")
+
 async def settranslate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Set translation language"""
     if len(context.args) < 2:
@@ -781,6 +963,7 @@ async def settranslate(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
             
         await db.update_task(task_id, translate_to=target_lang)
+        await routing.reload_task(task_id)
         
         if target_lang is None:
             await update.message.reply_text(f"✅ Translation disabled for task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
@@ -799,10 +982,13 @@ async def setschedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) < 3:
         await update.message.reply_text(
             "⏰ <b>Set Schedule</b>\n\n"
-            "Usage: <code>/setschedule [task_id] on/off [HH:MM]</code>\n\n"
+            "Usage: <code>/setschedule [task_id] on/off [HH:MM|none] [timezone]</code>\n\n"
             "Examples:\n"
             "<code>/setschedule 123 on 08:00</code> - Enable at 8 AM\n"
-            "<code>/setschedule 123 off 22:00</code> - Disable at 10 PM"
+            "<code>/setschedule 123 off 22:00 Europe/Berlin</code> - Disable at 10 PM Berlin time\n"
+            "<code>/setschedule 123 off none</code> - Remove the disable time\n\n"
+            f"The timezone applies to both times of the task (default: {config.SCHEDULER_TIMEZONE}).",
+            parse_mode=ParseMode.HTML
         )
         return
     
@@ -810,29 +996,158 @@ async def setschedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
         task_id = int(context.args[0])
         action = context.args[1].lower()
         time_str = context.args[2]
+        timezone = context.args[3] if len(context.args) > 3 else None
         
-        # Validate time format
-        hour, minute = map(int, time_str.split(':'))
-        if not (0 <= hour < 24 and 0 <= minute < 60):
-            await update.message.reply_text("❌ Invalid time format. Use HH:MM (24-hour).")
+        if action not in ('on', 'off'):
+            await update.message.reply_text("❌ Action must be 'on' or 'off'.")
             return
         
-        if not await get_task_or_deny(update, context, task_id):
+        if time_str.lower() == 'none':
+            time_str = None
+        else:
+            # Validate time format
+            hour, minute = map(int, time_str.split(':'))
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                await update.message.reply_text("❌ Invalid time format. Use HH:MM (24-hour).")
+                return
+            time_str = f"{hour:02d}:{minute:02d}"
+        
+        if timezone:
+            try:
+                timezone = pytz.timezone(timezone).zone
+            except pytz.UnknownTimeZoneError:
+                await update.message.reply_text(f"❌ Unknown timezone: {timezone}")
+                return
+        
+        task = await get_task_or_deny(update, context, task_id)
+        if not task:
             return
-            
-        if action == 'on':
-            await db.update_task(task_id, power_on_time=time_str)
-            await update.message.reply_text(f"✅ Task <code>{task_id}</code> will ENABLE at <b>{time_str}</b>", parse_mode=ParseMode.HTML)
-        elif action == 'off':
-            await db.update_task(task_id, power_off_time=time_str)
-            await update.message.reply_text(f"✅ Task <code>{task_id}</code> will DISABLE at <b>{time_str}</b>", parse_mode=ParseMode.HTML)
+        
+        updates = {'power_on_time' if action == 'on' else 'power_off_time': time_str}
+        if timezone:
+            updates['power_timezone'] = timezone
+        await db.update_task(task_id, **updates)
+        task.update(updates)
+        
+        if not scheduler.sync_power_schedule(task):
+            await update.message.reply_text("❌ Could not schedule the task. Check the time and timezone.")
+            return
+        await routing.reload_task(task_id)
+        
+        verb = "ENABLE" if action == 'on' else "DISABLE"
+        if time_str is None:
+            await update.message.reply_text(f"✅ Task <code>{task_id}</code> will no longer {verb} on a schedule.", parse_mode=ParseMode.HTML)
         else:
-            await update.message.reply_text("❌ Action must be 'on' or 'off'.")
+            tz_name = task.get('power_timezone') or config.SCHEDULER_TIMEZONE
+            await update.message.reply_text(f"✅ Task <code>{task_id}</code> will {verb} at <b>{time_str}</b> ({tz_name})", parse_mode=ParseMode.HTML)
     except ValueError:
         await update.message.reply_text("❌ Invalid task ID or time format. Please provide numbers for task ID and HH:MM for time.")
     except Exception as e:
         await update.message.reply_text(f"❌ Error setting schedule: {str(e)}")
 
+async def autopost(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Schedule a post to a task's destination, or list a task's posts"""
+    if not context.args:
+        await update.message.reply_text(
+            "📬 <b>Auto Post</b>\n\n"
+            "Usage: <code>/autopost [task_id] [HH:MM|YYYY-MM-DDTHH:MM] [once|daily|weekly|monthly] [text]</code>\n"
+            "List: <code>/autopost [task_id]</code>\n\n"
+            "Examples:\n"
+            "<code>/autopost 123 09:00 daily Good morning!</code>\n"
+            "<code>/autopost 123 2026-12-24T18:00 once Merry Christmas!</code>\n\n"
+            f"Times are in {config.SCHEDULER_TIMEZONE}.",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    try:
+        task_id = int(context.args[0])
+        task = await get_task_or_deny(update, context, task_id)
+        if not task:
+            return
+        
+        if len(context.args) == 1:
+            posts = await db.get_scheduled_posts(task_id)
+            if not posts:
+                await update.message.reply_text(f"📭 No scheduled posts for task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
+                return
+            text = f"📬 <b>Scheduled posts for task {task_id}:</b>\n\n"
+            for post in posts:
+                pattern = post['recurrence_pattern'] if post['is_recurring'] else 'once'
+                preview = post['message_content'][:40].replace('<', '&lt;')
+                text += f"🆔 <code>{post['schedule_id']}</code> - {post['schedule_time']} ({pattern})\n{preview}\n\n"
+            await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+            return
+        
+        parts = update.message.text.split(maxsplit=4)
+        if len(parts) < 5:
+            await update.message.reply_text("❌ Please provide the time, recurrence and text.")
+            return
+        when, pattern = parts[2], parts[3].lower()
+        # Keep the formatting of the post text by slicing the command's entities along with it
+        content_start = len(update.message.text) - len(parts[4])
+        rich = RichText.from_message(update.message)
+        post = rich.splice([(0, content_start, '')])
+        
+        if pattern not in config.AUTO_POST_PATTERNS:
+            await update.message.reply_text(f"❌ Recurrence must be one of: {', '.join(config.AUTO_POST_PATTERNS)}")
+            return
+        
+        if 'T' in when:
+            schedule_time = datetime.fromisoformat(when)
+        else:
+            # Next occurrence of HH:MM
+            hour, minute = map(int, when.split(':'))
+            now = datetime.now(pytz.timezone(config.SCHEDULER_TIMEZONE)).replace(tzinfo=None)
+            schedule_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if schedule_time <= now:
+                schedule_time += timedelta(days=1)
+        schedule_time = schedule_time.replace(tzinfo=None).isoformat(timespec='minutes')
+        
+        is_recurring = pattern != 'once'
+        schedule_id = await db.add_scheduled_post(
+            task_id, task['destination_chat_id'], post.text, schedule_time,
+            is_recurring, pattern if is_recurring else None,
+            next_run_time=to_db_time(post_run_time(schedule_time)),
+            message_entities=post.entities_json()
+        )
+        scheduler.ensure_auto_post_dispatcher()
+        
+        await update.message.reply_text(
+            f"✅ Post <code>{schedule_id}</code> scheduled for <b>{schedule_time}</b> ({pattern}) "
+            f"to {task['destination_chat_title']}.",
+            parse_mode=ParseMode.HTML
+        )
+    except ValueError:
+        await update.message.reply_text("❌ Invalid task ID or time. Use HH:MM or YYYY-MM-DDTHH:MM.")
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error scheduling post: {str(e)}")
+
+async def delautopost(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop a scheduled post"""
+    if not context.args:
+        await update.message.reply_text(
+            "Usage: <code>/delautopost [post_id]</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    try:
+        schedule_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("❌ Invalid post ID.")
+        return
+    
+    post = await db.get_scheduled_post(schedule_id)
+    if not post or not post['is_active']:
+        await update.message.reply_text("❌ Scheduled post not found.")
+        return
+    if not await get_task_or_deny(update, context, post['task_id']):
+        return
+    
+    await db.delete_scheduled_post(schedule_id)
+    await update.message.reply_text(f"✅ Scheduled post <code>{schedule_id}</code> removed.", parse_mode=ParseMode.HTML)
+
 # ========== CONTENT PROCESSING COMMANDS ==========
 async def clean(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Clean message (remove links, usernames, etc.)"""
@@ -840,25 +1155,40 @@ async def clean(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "🧹 <b>Cleaner Filter</b>\n\n"
             "Usage: <code>/clean [task_id] [options]</code>\n\n"
-            "Options: links, usernames, hashtags, mentions\n"
+            f"Options: {', '.join(config.CLEANER_PATTERNS)}\n"
             "Example: <code>/clean 123 links usernames hashtags</code>\n"
-            "Use <code>none</code> to disable all cleaner options."
+            "Use <code>none</code> to disable all cleaner options.",
+            parse_mode=ParseMode.HTML
         )
         return
     
     try:
         task_id = int(context.args[0])
-        options = context.args[1:]
+        options = [option.lower() for option in context.args[1:]]
         
         if not await get_task_or_deny(update, context, task_id):
             return
-
-        # Parse options into a dictionary for cleaner_options
-        # This part is currently a placeholder as cleaner_options are hardcoded in filters.py
-        # To make this configurable, we'd need to store cleaner options per task in the DB.
-        # For now, this command primarily serves as an acknowledgement.
         
-        await update.message.reply_text(f"✅ Cleaner filter settings would be updated for task <code>{task_id}</code>. Current implementation uses fixed options.")
+        if options == ['none']:
+            options = []
+        unknown = [option for option in options if option not in config.CLEANER_PATTERNS]
+        if unknown:
+            await update.message.reply_text(
+                f"❌ Unknown cleaner option: {', '.join(unknown)}\n"
+                f"Options: {', '.join(config.CLEANER_PATTERNS)}"
+            )
+            return
+        
+        await db.update_task(task_id, cleaner_options=','.join(options))
+        await routing.reload_task(task_id)
+        
+        if options:
+            await update.message.reply_text(
+                f"✅ Cleaner for task <code>{task_id}</code> now removes: {', '.join(options)}",
+                parse_mode=ParseMode.HTML
+            )
+        else:
+            await update.message.reply_text(f"✅ Cleaner disabled for task <code>{task_id}</code>", parse_mode=ParseMode.HTML)
         
     except ValueError:
         await update.message.reply_text("❌ Invalid task ID. Please provide a number.")
@@ -868,51 +1198,118 @@ async def clean(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def replace(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Replace text in messages"""
-    if len(context.args) < 3:
+    if not context.args or len(context.args) == 2 and context.args[1].lower() not in ('clear', 'list'):
         await update.message.reply_text(
             "🔄 <b>Replace Text</b>\n\n"
-            "Usage: <code>/replace [task_id] [old_text] [new_text]</code>\n\n"
+            "Usage: <code>/replace [task_id] [old_text] [new_text]</code>\n"
+            "List: <code>/replace [task_id]</code>\n"
+            "Remove all: <code>/replace [task_id] clear</code>\n\n"
             "Example: <code>/replace 123 hello hi</code>\n"
-            "To remove text, use an empty string for new_text."
+            "Start old_text with <code>i:</code> to ignore case. "
+            "To remove text, use <code>\"\"</code> for new_text.",
+            parse_mode=ParseMode.HTML
         )
         return
     
     try:
         task_id = int(context.args[0])
+        task = await get_task_or_deny(update, context, task_id)
+        if not task:
+            return
+        
+        rules = json.loads(task['replace_rules']) if task.get('replace_rules') else []
+        
+        if len(context.args) == 1 or context.args[1].lower() == 'list':
+            if not rules:
+                await update.message.reply_text(f"📭 No replacement rules for task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
+                return
+            lines = [
+                f"{'' if rule.get('case_sensitive', True) else 'i:'}{html.escape(rule['old'])} → {html.escape(rule['new']) or '∅'}"
+                for rule in rules[:50]
+            ]
+            more = f"\n… and {len(rules) - 50} more" if len(rules) > 50 else ""
+            await update.message.reply_text(
+                f"🔄 <b>Replacement rules for task {task_id} ({len(rules)}):</b>\n\n" + '\n'.join(lines) + more,
+                parse_mode=ParseMode.HTML
+            )
+            return
+        
+        if context.args[1].lower() == 'clear' and len(context.args) == 2:
+            await db.update_task(task_id, replace_rules=None)
+            await routing.reload_task(task_id)
+            await update.message.reply_text(f"✅ Replacement rules cleared for task <code>{task_id}</code>.", parse_mode=ParseMode.HTML)
+            return
+        
         old_text = context.args[1]
+        case_sensitive = not old_text.startswith('i:')
+        if not case_sensitive:
+            old_text = old_text[2:]
         new_text = ' '.join(context.args[2:])
-        
-        if not await get_task_or_deny(update, context, task_id):
+        if new_text in ('""', "''"):
+            new_text = ''
+        if not old_text:
+            await update.message.reply_text("❌ Text to replace can't be empty.")
             return
-            
-        # Storing replacement rules is complex. For now, this is a placeholder.
-        # A proper implementation would store a list of replacements per task in DB.
-        await update.message.reply_text(f"✅ Text replacement rule would be added for task <code>{task_id}</code>.")
+        if len(rules) >= config.MAX_REPLACE_RULES:
+            await update.message.reply_text(f"❌ A task can have at most {config.MAX_REPLACE_RULES} replacement rules.")
+            return
+        
+        # A new rule for the same text replaces the old one
+        rules = [rule for rule in rules if (rule['old'], rule.get('case_sensitive', True)) != (old_text, case_sensitive)]
+        rules.append({'old': old_text, 'new': new_text, 'case_sensitive': case_sensitive})
+        await db.update_task(task_id, replace_rules=json.dumps(rules, ensure_ascii=False))
+        await routing.reload_task(task_id)
+        
+        await update.message.reply_text(
+            f"✅ Task <code>{task_id}</code> now replaces <b>{html.escape(old_text)}</b> "
+            f"with <b>{html.escape(new_text) or '(nothing)'}</b> ({len(rules)} rules).",
+            parse_mode=ParseMode.HTML
+        )
     except ValueError:
         await update.message.reply_text("❌ Invalid task ID. Please provide a number.")
     except Exception as e:
         await update.message.reply_text(f"❌ Error setting text replacement: {str(e)}")
 
 
+def load_line_rules(task: dict) -> dict:
+    return json.loads(task['line_rules']) if task.get('line_rules') else {}
+
+async def save_line_rules(task_id: int, rules: dict):
+    rules = {key: values for key, values in rules.items() if values}
+    await db.update_task(task_id, line_rules=json.dumps(rules, ensure_ascii=False) if rules else None)
+    await routing.reload_task(task_id)
+
 async def removebykeyword(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Remove lines by keyword"""
     if len(context.args) < 2:
         await update.message.reply_text(
             "🗑️ <b>Remove Line by Keyword</b>\n\n"
             "Usage: <code>/removebykeyword [task_id] [keyword1,keyword2,...]</code>\n\n"
-            "Example: <code>/removebykeyword 123 spam,ad,free</code>"
+            "Example: <code>/removebykeyword 123 spam,ad,free</code>\n"
+            "Use <code>clear</code> to remove all keywords.",
+            parse_mode=ParseMode.HTML
         )
         return
     
     try:
         task_id = int(context.args[0])
-        keywords = context.args[1].split(',')
-        
-        if not await get_task_or_deny(update, context, task_id):
+        task = await get_task_or_deny(update, context, task_id)
+        if not task:
             return
-            
-        # Storing keyword removal rules is complex. Placeholder for now.
-        await update.message.reply_text(f"✅ Keyword removal rule would be added for task <code>{task_id}</code>.")
+        
+        rules = load_line_rules(task)
+        if context.args[1].lower() == 'clear':
+            rules.pop('keywords', None)
+        else:
+            keywords = [kw.strip() for kw in ' '.join(context.args[1:]).split(',') if kw.strip()]
+            rules['keywords'] = list(dict.fromkeys(rules.get('keywords', []) + keywords))
+        await save_line_rules(task_id, rules)
+        
+        current = ', '.join(html.escape(kw) for kw in rules.get('keywords', [])) or 'none'
+        await update.message.reply_text(
+            f"✅ Lines containing these keywords are removed for task <code>{task_id}</code>: {current}",
+            parse_mode=ParseMode.HTML
+        )
     except ValueError:
         await update.message.reply_text("❌ Invalid task ID. Please provide a number.")
     except Exception as e:
@@ -923,27 +1320,85 @@ async def removebyline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) < 2:
         await update.message.reply_text(
             "🗑️ <b>Remove Line by Order</b>\n\n"
-            "Usage: <code>/removebyline [task_id] [1,3,5]</code>\n\n"
-            "Example: <code>/removebyline 123 1,3,5</code>\n"
-            "Removes lines 1, 3, and 5 from messages."
+            "Usage: <code>/removebyline [task_id] [1,3,-1]</code>\n\n"
+            "Example: <code>/removebyline 123 1,-2,-1</code>\n"
+            "Removes the first line and the last two lines from messages.\n"
+            "Use <code>clear</code> to keep all lines.",
+            parse_mode=ParseMode.HTML
         )
         return
     
     try:
         task_id = int(context.args[0])
-        # Parse line numbers, ensuring they are integers and positive
-        line_numbers = [int(ln.strip()) for ln in context.args[1].split(',') if ln.strip().isdigit() and int(ln.strip()) > 0]
-        
-        if not await get_task_or_deny(update, context, task_id):
+        task = await get_task_or_deny(update, context, task_id)
+        if not task:
             return
-            
-        # Storing line removal rules is complex. Placeholder for now.
-        await update.message.reply_text(f"✅ Line removal rule would be added for task <code>{task_id}</code>.")
+        
+        rules = load_line_rules(task)
+        if context.args[1].lower() == 'clear':
+            rules.pop('lines', None)
+        else:
+            # Positive numbers count from the top, negative ones from the bottom
+            line_numbers = [int(ln.strip()) for ln in context.args[1].split(',') if ln.strip()]
+            if 0 in line_numbers:
+                await update.message.reply_text("❌ Line numbers start at 1; use -1 for the last line.")
+                return
+            rules['lines'] = sorted(set(rules.get('lines', []) + line_numbers))
+        await save_line_rules(task_id, rules)
+        
+        current = ', '.join(str(ln) for ln in rules.get('lines', [])) or 'none'
+        await update.message.reply_text(
+            f"✅ Lines removed for task <code>{task_id}</code>: {current}",
+            parse_mode=ParseMode.HTML
+        )
     except ValueError:
         await update.message.reply_text("❌ Invalid task ID or line numbers. Please provide numbers.")
     except Exception as e:
         await update.message.reply_text(f"❌ Error setting line removal: {str(e)}")
 
+async def removebyregex(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove lines matching a regex"""
+    if len(context.args) < 2:
+        await update.message.reply_text(
+            "🗑️ <b>Remove Line by Regex</b>\n\n"
+            "Usage: <code>/removebyregex [task_id] [pattern]</code>\n\n"
+            "Example: <code>/removebyregex 123 ^Sponsored</code>\n"
+            "<code>^</code> and <code>$</code> match at the start and end of each line.\n"
+            "Use <code>clear</code> to remove all patterns.",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    try:
+        task_id = int(context.args[0])
+        task = await get_task_or_deny(update, context, task_id)
+        if not task:
+            return
+        
+        rules = load_line_rules(task)
+        if context.args[1].lower() == 'clear' and len(context.args) == 2:
+            rules.pop('regex', None)
+        else:
+            pattern = update.message.text.split(maxsplit=2)[2]
+            patterns = list(dict.fromkeys(rules.get('regex', []) + [pattern]))
+            # Validate the way the forwarder will compile the whole list
+            error = LineRules({'regex': patterns}).invalid.get(pattern)
+            if error is not None:
+                await update.message.reply_text(f"❌ Invalid regex: {html.escape(error)}")
+                return
+            rules['regex'] = patterns
+        await save_line_rules(task_id, rules)
+        
+        current = '\n'.join(f"<code>{html.escape(p)}</code>" for p in rules.get('regex', [])) or 'none'
+        await update.message.reply_text(
+            f"✅ Lines matching these patterns are removed for task <code>{task_id}</code>:\n{current}",
+            parse_mode=ParseMode.HTML
+        )
+    except ValueError:
+        await update.message.reply_text("❌ Invalid task ID. Please provide a number.")
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error setting regex removal: {str(e)}")
+
 # ========== ADMIN COMMANDS ==========
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show bot statistics"""
@@ -961,11 +1416,15 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Admin stats
     all_stats = await db.get_stats()
+    job_counts = scheduler.job_counts()
+    jobs_text = ", ".join(f"{kind} {count}" for kind, count in sorted(job_counts.items())) or "none"
     await update.message.reply_text(
         f"📊 <b>Bot Statistics:</b>\n\n"
         f"👥 Total Users: <b>{all_stats.get('total_users', 0)}</b>\n"
         f"🔄 Total Tasks: <b>{all_stats.get('total_tasks', 0)}</b>\n" # Added default 0 for safety
-        f"📤 Total Forwarded: <b>{all_stats.get('total_forwarded', 0)}</b>",
+        f"📤 Total Forwarded: <b>{all_stats.get('total_forwarded', 0)}</b>\n"
+        f"⏰ Scheduled Jobs: <b>{sum(job_counts.values())}</b> ({jobs_text})\n"
+        f"⏳ Delayed Messages: <b>{len(delayed_queue)}</b>",
         parse_mode=ParseMode.HTML
     )
 
@@ -1007,6 +1466,124 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.HTML
     )
 
+async def traces(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the slowest recent message traces, or one trace in full"""
+    user_id = update.effective_user.id
+    if user_id not in config.ADMIN_IDS:
+        await update.message.reply_text("❌ Admin only command.")
+        return
+    
+    if not tracer.enabled:
+        await update.message.reply_text("📭 Tracing is off (set TRACING_ENABLED=1).")
+        return
+    
+    try:
+        # /traces <trace_id> shows every span of one trace; ids can be all digits, so look them up first
+        trace = tracer.get(context.args[0]) if context.args else None
+        if context.args and trace is None and not context.args[0].isdigit():
+            await update.message.reply_text("❌ Trace not found; it may have left the buffer.")
+            return
+        if trace is not None:
+            head = f"🔍 <b>Trace {trace.trace_id}</b> ({html.escape(trace.name)}, {trace.duration * 1000:.1f} ms)\n"
+            head += html.escape(', '.join(f"{key}={value}" for key, value in trace.attrs.items())[:1000]) + "\n\n"
+            lines = [
+                f"{'  ' * depth}+{offset * 1000:.1f} ms <b>{html.escape(name)}</b> "
+                f"{duration * 1000:.1f} ms{' ❌' if failed else ''}\n"
+                for name, offset, duration, depth, failed in sorted(trace.spans, key=lambda span: span[1])
+            ]
+            await update.message.reply_text(fit_lines(head, lines, "… {} more spans\n"), parse_mode=ParseMode.HTML)
+            return
+        
+        count = int(context.args[0]) if context.args else 5
+        slowest = tracer.slowest(max(1, min(count, 20)))
+        if not slowest:
+            await update.message.reply_text("📭 No traces recorded yet.")
+            return
+        
+        head = (
+            f"🐢 <b>Slowest recent traces</b> ({len(tracer.recent)} kept, "
+            f"slow above {tracer.slow_seconds:g}s):\n\n"
+        )
+        entries = []
+        for trace in slowest:
+            # The pipeline stages that took longest say where the time went
+            stages = [span for span in trace.spans if span[3] <= 1 and not span[0].startswith('task_')]
+            top = sorted(stages, key=lambda span: span[2], reverse=True)[:3]
+            breakdown = ', '.join(f"{html.escape(name)} {duration * 1000:.0f} ms" for name, _, duration, _, _ in top)
+            entries.append(
+                f"<code>{trace.trace_id}</code> {html.escape(trace.name)} <b>{trace.duration * 1000:.0f} ms</b> "
+                f"{html.escape(', '.join(f'{key}={value}' for key, value in trace.attrs.items())[:200])}\n"
+                f"   {breakdown or 'no spans'}\n"
+            )
+        text = fit_lines(head, entries, "… {} more traces\n", "\nUse <code>/traces [trace_id]</code> for every span.")
+        await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error showing traces: {str(e)}")
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sample the running bot for a while and send back where the time went"""
+    user_id = update.effective_user.id
+    if user_id not in config.ADMIN_IDS:
+        await update.message.reply_text("❌ Admin only command.")
+        return
+    
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("Usage: /profile [seconds]")
+        return
+    if not 1 <= seconds <= config.PROFILE_MAX_SECONDS:
+        await update.message.reply_text(f"❌ Profile for 1 to {config.PROFILE_MAX_SECONDS} seconds.")
+        return
+    if profiler.running:
+        await update.message.reply_text("⏳ A profile is already running.")
+        return
+    
+    await update.message.reply_text(f"🔬 Profiling for {seconds}s...")
+    # Run in the background: updates are handled one at a time, and this one must not hold the rest up
+    context.application.create_task(send_profile(update, seconds))
+
+async def send_profile(update: Update, seconds: int):
+    try:
+        result = await profiler.run(seconds)
+        folded_path, _ = result.save()
+        # Cut the summary at whole lines before escaping, so no entity is split
+        lines = [html.escape(line) + "\n" for line in result.summary().splitlines()]
+        await update.message.reply_text(
+            fit_lines("<pre>", lines, "… {} more lines", "</pre>"), parse_mode=ParseMode.HTML
+        )
+        with open(folded_path, 'rb') as f:
+            await update.message.reply_document(
+                f, caption="Collapsed stacks: open in speedscope.app or pipe to flamegraph.pl"
+            )
+    except Exception as e:
+        await update.message.reply_text(f"❌ Profile error: {str(e)}")
+
+async def loopstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show event loop lag percentiles and what blocked the loop recently"""
+    user_id = update.effective_user.id
+    if user_id not in config.ADMIN_IDS:
+        await update.message.reply_text("❌ Admin only command.")
+        return
+    
+    text = (
+        f"⏱️ <b>Event loop lag</b> (last {len(loop_watch.lags)} probes):\n"
+        f"p50 {loop_watch.percentile(0.5) * 1000:.1f} ms · p95 {loop_watch.percentile(0.95) * 1000:.1f} ms · "
+        f"p99 {loop_watch.percentile(0.99) * 1000:.1f} ms · max {max(loop_watch.lags, default=0) * 1000:.1f} ms\n\n"
+    )
+    stalls = loop_watch.recent_stalls()
+    if not stalls:
+        text += f"✅ No stalls over {loop_watch.threshold * 1000:.0f} ms."
+    else:
+        text += f"🧱 <b>Recent stalls</b> (over {loop_watch.threshold * 1000:.0f} ms):\n"
+        entries = [
+            f"{datetime.fromtimestamp(stall['at']).strftime('%H:%M:%S')} <b>{stall['lag'] * 1000:.0f} ms</b> "
+            f"in {html.escape(stall['coroutine'])}\n   <code>{html.escape(stall['stack'])}</code>\n"
+            for stall in reversed(stalls)
+        ]
+        text = fit_lines(text, entries, "… {} more stalls\n")
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+
 async def users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all users"""
     user_id = update.effective_user.id
@@ -1093,6 +1670,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             
             await db.enable_task(task_id)
+            await routing.reload_task(task_id)
             await query.message.reply_text(f"✅ Task <code>{task_id}</code> enabled!", parse_mode=ParseMode.HTML)
         except (IndexError, ValueError):
             await query.message.reply_text("❌ Invalid callback data.")
@@ -1211,24 +1789,28 @@ async def handle_incoming_message(update: Update, context: ContextTypes.DEFAULT_
     if not message:
         return
 
+    # Channel posts have no sender, so PTB gives them no user_data
+    user_data = context.user_data or {}
+
     # Check for new task flow (structured via ConversationHandler states)
     # The ConversationHandler should normally catch these if the flow is active,
     # but some legacy code uses user_data flags.
-    if context.user_data.get('awaiting_source'):
+    if user_data.get('awaiting_source'):
         return await handle_source_selection(update, context)
-    elif context.user_data.get('awaiting_dest'):
+    elif user_data.get('awaiting_dest'):
         return await handle_dest_selection(update, context)
 
     # Check if this message is a setting input (e.g., delay, header, footer)
     # This is often handled by specific commands, but checking here for completeness
-    editing_task_id = context.user_data.get('editing_setting_for_task')
+    editing_task_id = user_data.get('editing_setting_for_task')
     if editing_task_id:
         # Example: handle delay setting via direct text input if prompted
-        setting_type = context.user_data.get('editing_setting_type')
+        setting_type = user_data.get('editing_setting_type')
         if setting_type == 'delay':
              try:
                  delay = int(message.text)
                  await db.update_task(editing_task_id, forward_delay=delay)
+                 await routing.reload_task(editing_task_id)
                  await message.reply_text(f"✅ Delay updated to {delay}s for task {editing_task_id}.")
                  context.user_data.pop('editing_setting_for_task', None)
                  context.user_data.pop('editing_setting_type', None)
@@ -1241,23 +1823,21 @@ async def handle_incoming_message(update: Update, context: ContextTypes.DEFAULT_
     # We use chat_id (source) to find any active tasks
     chat_id = message.chat.id
     
-    # Get all active tasks for this source chat
-    tasks = await db.get_tasks_by_source(chat_id)
-    if not tasks:
+    # Enabled tasks and their filters come from the in-memory routing table
+    with metrics.stage('route'):
+        route = routing.route(chat_id)
+    if not route:
         return
-
-    for task in tasks:
-        # The db query already filters for is_enabled = 1, but double check
-        if not task.get('is_enabled', 1):
-            continue
-        
-        # Get filters for this task
-        filters_list = await db.get_task_filters(task['task_id'])
-        
-        # Forward via engine
-        # forward_engine.forward_message(bot, message, task, filters_list)
-        # Note: forward_engine should be imported from forwarder
-        await forward_engine.forward_message(context.bot, message, task, filters_list)
+    
+    # Trace the message through every task; age is how long it took Telegram to deliver it
+    age = round(time.time() - message.date.timestamp(), 3) if message.date else None
+    with tracer.trace('message', chat_id=chat_id, message_id=message.message_id, tasks=len(route), age=age):
+        # Work every task needs (lowercasing, hashing, keyword hits) is done once for all of them
+        analysis = MessageAnalysis(message, route)
+        for task, filters_list in route:
+            # Forward via engine
+            with tracer.span(f"task_{task['task_id']}"):
+                await forward_engine.forward_message(context.bot, message, task, filters_list, analysis)
 
 
 # ========== MAIN FUNCTION ==========
@@ -1265,12 +1845,24 @@ async def main():
     """Start the bot"""
     # Initialize database
     await db.init()
+    await routing.reload()
+    await near_duplicates.load()
+    
+    # Create application; the instrumented transport times every Bot API call
+    application = (
+        Application.builder().token(config.BOT_TOKEN)
+        .base_url(f"{config.BOT_API_BASE_URL}/bot")
+        .base_file_url(f"{config.BOT_API_BASE_URL}/file/bot")
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .build()
+    )
     
-    # Start scheduler
-    scheduler.start()
-    
-    # Create application
-    application = Application.builder().token(config.BOT_TOKEN).build()
+    # Start scheduler and bring back jobs stored in the database. Paused,
+    # so the restore pass doesn't wake the scheduler for every job it adds
+    scheduler.bot = application.bot
+    scheduler.start(paused=True)
+    await scheduler.restore_jobs()
+    scheduler.resume()
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -1288,25 +1880,34 @@ async def main():
     application.add_handler(CommandHandler("addfilter", addfilter_start)) # Command to start adding a filter
     application.add_handler(CommandHandler("removefilter", removefilter_callback)) # Command to remove a filter by ID
     application.add_handler(CommandHandler("filters", filters_command_handler)) # Command to list filters for a task
+    application.add_handler(CommandHandler("filterstats", filterstats))
+    application.add_handler(CommandHandler("neardup", neardup))
     
     # Settings commands
     application.add_handler(CommandHandler("setdelay", setdelay))
     application.add_handler(CommandHandler("setheader", setheader))
     application.add_handler(CommandHandler("setfooter", setfooter))
     application.add_handler(CommandHandler("setwatermark", setwatermark))
+    application.add_handler(CommandHandler("setlogo", setlogo))
     application.add_handler(CommandHandler("settranslate", settranslate))
     application.add_handler(CommandHandler("setschedule", setschedule))
+    application.add_handler(CommandHandler("autopost", autopost))
+    application.add_handler(CommandHandler("delautopost", delautopost))
     
     # Content processing commands (placeholders for now, need implementation)
     application.add_handler(CommandHandler("clean", clean))
     application.add_handler(CommandHandler("replace", replace))
     application.add_handler(CommandHandler("removebykeyword", removebykeyword))
     application.add_handler(CommandHandler("removebyline", removebyline))
+    application.add_handler(CommandHandler("removebyregex", removebyregex))
     
     # Admin commands
     application.add_handler(CommandHandler("stats", stats))
     application.add_handler(CommandHandler("broadcast", broadcast))
     application.add_handler(CommandHandler("users", users))
+    application.add_handler(CommandHandler("traces", traces))
+    application.add_handler(CommandHandler("profile", profile))
+    application.add_handler(CommandHandler("loopstats", loopstats))
     
     # Callback Query Handlers
     # For callbacks that initiate conversation states
@@ -1333,9 +1934,20 @@ async def main():
     await application.initialize()
     await application.start()
     await application.updater.start_polling(drop_pending_updates=True)
+    await metrics.serve()
+    loop_watch.start()
     
     # Keep running
-    await asyncio.Event().wait()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        scheduler.shutdown()
+        await loop_watch.stop()
+        await send_queue.close()
+        await delayed_queue.close()
+        await download_manager.close()
+        await metrics.close()
+        await tracer.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,240 @@
+"""
+Telegram Forward Bot - Metrics Module
+
+Counters, gauges and latency histograms for the forwarding pipeline, in the
+Prometheus text format and optionally served over HTTP at /metrics. With
+METRICS_ENABLED off every instrument is a shared no-op, so instrumented
+code pays for one empty method call and nothing is recorded.
+
+Stage timers also add a span to the current message trace, if any, so one
+call site feeds both.
+"""
+import bisect
+import math
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from aiohttp import web
+from telegram.request import HTTPXRequest
+import config
+from tracing import Trace, current_trace
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+def _format_labels(names: Tuple[str, ...], values: tuple, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + '}'
+
+class Metric:
+    """One metric family; label values are passed positionally, in the order of `labels`"""
+    kind = 'untyped'
+    
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+    
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """(name suffix, formatted labels, value) for every series"""
+        return iter(())
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples()]
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[tuple, float] = {}
+    
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+    
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield '', _format_labels(self.labels, labels), value
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from `read()` when scraped"""
+    kind = 'gauge'
+    
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), read: Callable[[], float] = None):
+        super().__init__(name, help, labels)
+        self._read = read
+        self._values: Dict[tuple, float] = {}
+    
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+    
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+    
+    def samples(self):
+        if self._read is not None:
+            yield '', '', self._read()
+            return
+        for labels, value in sorted(self._values.items()):
+            yield '', _format_labels(self.labels, labels), value
+
+class Histogram(Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = config.METRICS_LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # labels -> [count per bucket..., count above, sum]
+    
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+    
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+    
+    def samples(self):
+        for labels, series in sorted(self._series.items()):
+            formatted = _format_labels(self.labels, labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), series):
+                cumulative += count
+                yield '_bucket', _format_labels(self.labels, labels, (('le', _format_value(bound)),)), cumulative
+            yield '_sum', formatted, series[-1]
+            yield '_count', formatted, cumulative
+
+class _NullMetric:
+    """Stands in for every instrument when metrics are off"""
+    
+    def inc(self, *args, **kwargs):
+        pass
+    
+    dec = set = observe = inc
+
+class _StageTimer:
+    __slots__ = ('histogram', 'errors', 'stage', 'trace', 'depth', 'started')
+    
+    def __init__(self, histogram: Histogram, errors: Counter, stage: str, trace: Optional[Trace]):
+        self.histogram = histogram
+        self.errors = errors
+        self.stage = stage
+        self.trace = trace
+    
+    def __enter__(self):
+        if self.trace is not None:
+            self.depth = self.trace.open()
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed, self.stage)
+        if exc_type is not None:
+            self.errors.inc(self.stage)
+        if self.trace is not None:
+            self.trace.close(self.stage, self.started, elapsed, self.depth, exc_type is not None)
+        return False
+
+NULL_METRIC = _NullMetric()
+NULL_STAGE = nullcontext()
+
+class Metrics:
+    """Registry of the bot's instruments, with the stage timer every module shares"""
+    
+    def __init__(self, enabled: bool = config.METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics: Dict[str, Metric] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self.stage_seconds = self.histogram(
+            'forward_stage_seconds', 'Time spent in each pipeline stage', ('stage',)
+        )
+        self.stage_errors = self.counter(
+            'forward_stage_errors_total', 'Pipeline stages that ended in an exception', ('stage',)
+        )
+    
+    def _register(self, metric: Metric):
+        if not self.enabled:
+            return NULL_METRIC
+        return self._metrics.setdefault(metric.name, metric)
+    
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+    
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = (), read: Callable[[], float] = None) -> Gauge:
+        return self._register(Gauge(name, help, labels, read))
+    
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = config.METRICS_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+    
+    def stage(self, name: str):
+        """Context manager timing one pipeline stage into forward_stage_seconds and the current trace"""
+        trace = current_trace.get()
+        if not self.enabled and trace is None:
+            return NULL_STAGE
+        return _StageTimer(self.stage_seconds, self.stage_errors, name, trace)
+    
+    def observe(self, stage: str, seconds: float, started: float):
+        """Record a stage that was already timed, from perf_counter() value `started`"""
+        self.stage_seconds.observe(seconds, stage)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(stage, started, seconds)
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+    
+    # ========== HTTP ENDPOINT ==========
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+    
+    async def serve(self, host: str = config.METRICS_HOST, port: int = config.METRICS_PORT):
+        """Serve /metrics over HTTP; does nothing when metrics are off or no port is set"""
+        if not self.enabled or not port:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"📈 Metrics at http://{host}:{port}/metrics")
+    
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+# Global metrics registry
+metrics = Metrics()
+
+class InstrumentedRequest(HTTPXRequest):
+    """Bot API transport that times every call as an api_<method> stage"""
+    
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        with metrics.stage(f"api_{url.rsplit('/', 1)[-1]}"):
+            return await super().do_request(url, method, *args, **kwargs)
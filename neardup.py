@@ -0,0 +1,226 @@
+"""
+Telegram Forward Bot - Near-Duplicate Detection
+
+64-bit fingerprints of recently forwarded messages per task, kept in a
+banded index so "seen anything within Hamming distance k lately" is a few
+dictionary lookups rather than a scan.
+"""
+import hashlib
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from PIL import Image
+import config
+from database import db
+from downloads import download_manager
+
+MASK64 = (1 << 64) - 1
+WORDS = re.compile(r'\w+')
+
+def feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+
+def simhash(features: Iterable[int]) -> Optional[int]:
+    """SimHash of 64-bit feature hashes: each bit is set where most features have it set.
+
+    The per-bit counts are kept bit-sliced (bit i of counters[j] is bit j
+    of the count for position i), so adding a feature is a few big-int
+    operations instead of a 64-step loop.
+    """
+    counters: List[int] = []
+    total = 0
+    for value in features:
+        total += 1
+        carry = value
+        for j in range(len(counters)):
+            counters[j], carry = counters[j] ^ carry, counters[j] & carry
+            if not carry:
+                break
+        if carry:
+            counters.append(carry)
+    if not total:
+        return None
+    
+    # Positions whose count is more than half the features, compared from the top bit down
+    threshold = total // 2
+    greater, equal = 0, MASK64
+    for j in range(max(len(counters), threshold.bit_length()) - 1, -1, -1):
+        count_bits = counters[j] if j < len(counters) else 0
+        threshold_bits = MASK64 if threshold >> j & 1 else 0
+        greater |= equal & count_bits & ~threshold_bits
+        equal &= ~(count_bits ^ threshold_bits) & MASK64
+    return greater
+
+def text_fingerprint(text: str) -> Optional[int]:
+    """SimHash over word pairs, or None when the text is too short to fingerprint reliably.
+
+    Case, punctuation and emoji are ignored, so a repost that only swaps
+    an emoji or touches a few words lands a few bits away.
+    """
+    words = WORDS.findall(text.lower())
+    if len(words) < config.NEAR_DUPLICATE_MIN_WORDS:
+        return None
+    return simhash(feature_hash(f"{a} {b}") for a, b in zip(words, words[1:]))
+
+def image_fingerprint(image_file) -> Optional[int]:
+    """dHash: shrink to 9x8 grey pixels and set a bit where each pixel is brighter than its right neighbour.
+
+    Rescaling, recompression and small colour shifts keep it within a few
+    bits. Flat images, which would all hash alike, give None.
+    """
+    with Image.open(image_file) as img:
+        img.draft('L', (36, 32))  # Let JPEG decode at reduced scale
+        pixels = list(img.convert('L').resize((9, 8), Image.BOX).getdata())
+    fingerprint = 0
+    for row in range(0, 72, 9):
+        for col in range(row, row + 8):
+            fingerprint = fingerprint << 1 | (pixels[col] > pixels[col + 1])
+    return fingerprint if fingerprint and fingerprint != MASK64 else None
+
+def media_thumbnail(message):
+    """The smallest preview of a photo or video, enough for a dHash"""
+    if message.photo:
+        return message.photo[0]
+    for attr in ('video', 'animation', 'video_note'):
+        media = getattr(message, attr, None)
+        if media is not None:
+            return media.thumbnail
+    return None
+
+class ThumbnailHasher:
+    """dHashes of media thumbnails, with the most recent kept by file_unique_id.
+
+    The same file forwarded from several sources is downloaded once while
+    it stays in the cache.
+    """
+    
+    def __init__(self, size: int = config.NEAR_DUPLICATE_THUMBNAIL_CACHE):
+        self.size = size
+        self._cache: 'OrderedDict[str, Optional[int]]' = OrderedDict()
+    
+    async def fingerprint(self, bot, message) -> Optional[int]:
+        thumbnail = media_thumbnail(message)
+        if thumbnail is None:
+            return None
+        
+        key = thumbnail.file_unique_id
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        
+        try:
+            async with download_manager.open(bot, thumbnail.file_id) as image_file:
+                fingerprint = image_fingerprint(image_file)
+        except Exception as e:
+            print(f"Thumbnail fingerprint error: {e}")
+            return None
+        
+        self._cache[key] = fingerprint
+        if len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+        return fingerprint
+
+class FingerprintIndex:
+    """Recent 64-bit fingerprints, split into bands for lookup.
+
+    With b bands, two fingerprints within distance b - 1 must agree exactly
+    on at least one band, so only fingerprints sharing a band are compared.
+    Entries older than the window, or the oldest beyond capacity, are
+    dropped as new ones come in.
+    """
+    
+    def __init__(self, bands: int = config.NEAR_DUPLICATE_MAX_DISTANCE + 1,
+                 window: float = config.NEAR_DUPLICATE_DAYS * 86400,
+                 capacity: int = config.NEAR_DUPLICATE_MAX_FINGERPRINTS):
+        self.window = window
+        self.capacity = capacity
+        width = 64 // bands
+        self._bands = [(i * width, (1 << (64 - i * width if i == bands - 1 else width)) - 1) for i in range(bands)]
+        self._buckets: List[Dict[int, Dict[int, float]]] = [{} for _ in range(bands)]
+        self._seen: Dict[int, float] = {}
+        self._order: Deque[Tuple[float, int]] = deque()
+    
+    def __len__(self) -> int:
+        return len(self._seen)
+    
+    def _keys(self, fingerprint: int):
+        for i, (shift, mask) in enumerate(self._bands):
+            yield i, fingerprint >> shift & mask
+    
+    def add(self, fingerprint: int, seen_at: float = None):
+        seen_at = time.time() if seen_at is None else seen_at
+        self._expire(seen_at)
+        self._seen[fingerprint] = seen_at
+        self._order.append((seen_at, fingerprint))
+        for i, key in self._keys(fingerprint):
+            self._buckets[i].setdefault(key, {})[fingerprint] = seen_at
+    
+    def find(self, fingerprint: int, distance: int, now: float = None) -> Optional[int]:
+        """A fingerprint within `distance` bits seen inside the window, if any"""
+        since = (time.time() if now is None else now) - self.window
+        for i, key in self._keys(fingerprint):
+            for candidate, seen_at in self._buckets[i].get(key, {}).items():
+                if seen_at >= since and (candidate ^ fingerprint).bit_count() <= distance:
+                    return candidate
+        return None
+    
+    def _expire(self, now: float):
+        since = now - self.window
+        while self._order and (self._order[0][0] < since or len(self._seen) >= self.capacity):
+            seen_at, fingerprint = self._order.popleft()
+            # Skip if the fingerprint was seen again later
+            if self._seen.get(fingerprint) != seen_at:
+                continue
+            del self._seen[fingerprint]
+            for i, key in self._keys(fingerprint):
+                bucket = self._buckets[i][key]
+                bucket.pop(fingerprint, None)
+                if not bucket:
+                    del self._buckets[i][key]
+
+class NearDuplicateStore:
+    """Per-task fingerprint indexes, persisted so they survive restarts"""
+    
+    def __init__(self):
+        self._indexes: Dict[Tuple[int, str], FingerprintIndex] = {}
+        self._added = 0
+    
+    def _index(self, task_id: int, kind: str) -> FingerprintIndex:
+        index = self._indexes.get((task_id, kind))
+        if index is None:
+            index = self._indexes[(task_id, kind)] = FingerprintIndex()
+        return index
+    
+    def seen(self, task_id: int, kind: str, fingerprint: int, distance: int) -> bool:
+        index = self._indexes.get((task_id, kind))
+        return index is not None and index.find(fingerprint, distance) is not None
+    
+    async def add(self, task_id: int, kind: str, fingerprint: int):
+        seen_at = time.time()
+        self._index(task_id, kind).add(fingerprint, seen_at)
+        await db.add_fingerprint(task_id, kind, fingerprint, seen_at)
+        
+        # Expired rows are only skipped in memory; clear them out of the table now and then
+        self._added += 1
+        if self._added % config.NEAR_DUPLICATE_PRUNE_EVERY == 0:
+            await db.delete_fingerprints_before(seen_at - config.NEAR_DUPLICATE_DAYS * 86400)
+    
+    async def load(self) -> int:
+        """Rebuild the indexes from the fingerprints still inside the window"""
+        since = time.time() - config.NEAR_DUPLICATE_DAYS * 86400
+        await db.delete_fingerprints_before(since)
+        self._indexes.clear()
+        count = 0
+        async for task_id, kind, fingerprint, seen_at in db.iter_fingerprints():
+            self._index(task_id, kind).add(fingerprint, seen_at)
+            count += 1
+        return count
+    
+    def forget(self, task_id: int):
+        for key in [key for key in self._indexes if key[0] == task_id]:
+            del self._indexes[key]
+
+# Global near-duplicate store and thumbnail hasher
+near_duplicates = NearDuplicateStore()
+thumbnail_hasher = ThumbnailHasher()
@@ -0,0 +1,188 @@
+"""
+Telegram Forward Bot - Sampling Profiler
+
+Profiles the live bot for a while on demand. A background thread samples
+the event loop thread's stack every PROFILE_INTERVAL seconds, which costs
+the loop a few microseconds per sample and needs no tracing hooks. Samples
+become collapsed stacks (flamegraph.pl / speedscope input) and a summary
+of where the loop spent its time, per coroutine.
+
+The sampler needs the GIL, so a coroutine hogging the loop delays the next
+sample. Each sample is therefore weighted by the time since the previous
+one rather than counted once, which keeps long blocking steps from being
+under-reported.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import config
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+IDLE_FUNCTIONS = frozenset({'select', 'poll', 'control'})  # selectors.py waiting for I/O
+
+def frame_label(code) -> str:
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+
+def coroutine_name(task: Optional[asyncio.Task]) -> str:
+    """The innermost coroutine of ours a task is in, or its top coroutine if none is ours"""
+    if task is None:
+        return '<callbacks>'
+    coro = task.get_coro()
+    name = getattr(coro, '__qualname__', type(coro).__name__)
+    while coro is not None:
+        code = getattr(coro, 'cr_code', None)
+        if code is not None and code.co_filename.startswith(ROOT):
+            name = coro.__qualname__
+        coro = getattr(coro, 'cr_await', None)
+    return name
+
+class Profile:
+    """Samples gathered over one profiling run"""
+    
+    def __init__(self, interval: float, task_every: int, exclude: Optional[asyncio.Task] = None):
+        self.interval = interval
+        self.task_every = task_every
+        self.exclude = exclude
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.samples = 0
+        self.sampled = 0.0
+        self.busy_seconds = 0.0
+        # All times below are seconds, from sample weights
+        self.stacks: Counter = Counter()  # collapsed stack -> time
+        self.functions: Counter = Counter()  # innermost frame -> busy time
+        self.busy: Counter = Counter()  # coroutine -> time the loop spent running its code
+        self.wall: Counter = Counter()  # coroutine -> time it was alive, summed over its tasks
+        self.longest_block: Dict[str, float] = {}  # coroutine -> longest run of back-to-back busy samples
+        self._stretch: Tuple[Optional[asyncio.Task], float] = (None, 0.0)
+    
+    def add(self, frame, weight: float, current: Optional[asyncio.Task], tasks: Optional[List[asyncio.Task]]):
+        """Record one sample standing for the `weight` seconds since the previous one"""
+        self.samples += 1
+        self.sampled += weight
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        self.stacks[';'.join(map(frame_label, codes))] += weight
+        
+        leaf = codes[-1] if codes else None
+        idle = leaf is not None and leaf.co_name in IDLE_FUNCTIONS and leaf.co_filename.endswith('selectors.py')
+        if idle:
+            self._stretch = (None, 0.0)
+        else:
+            self.busy_seconds += weight
+            name = coroutine_name(current)
+            self.busy[name] += weight
+            if leaf is not None:
+                self.functions[frame_label(leaf)] += weight
+            # The loop can't switch tasks mid-step, so one task busy in a row is one blocking step
+            task, length = self._stretch
+            self._stretch = (current, length + weight if task is current and length else weight)
+            self.longest_block[name] = max(self.longest_block.get(name, 0.0), self._stretch[1])
+        
+        if tasks is not None:
+            for task in tasks:
+                if task is not self.exclude:
+                    self.wall[coroutine_name(task)] += weight * self.task_every
+    
+    def collapsed(self) -> str:
+        """One "frame;frame;frame microseconds" line per distinct stack"""
+        return ''.join(f"{stack} {round(seconds * 1e6)}\n" for stack, seconds in self.stacks.most_common())
+    
+    def summary(self, top: int = config.PROFILE_TOP) -> str:
+        busy_share = self.busy_seconds / self.sampled if self.sampled else 0
+        lines = [
+            f"Profile of {self.duration:.1f} s, {self.samples} samples every {self.interval * 1000:g} ms",
+            f"Event loop busy {busy_share:.1%}, idle {1 - busy_share:.1%}",
+            "",
+            "Coroutines by event loop time (running, blocking everything else):",
+        ]
+        for name, seconds in self.busy.most_common(top):
+            lines.append(
+                f"  {seconds:8.3f} s {seconds / self.sampled:6.1%}  {name} "
+                f"(longest block {self.longest_block[name] * 1000:.0f} ms)"
+            )
+        lines += ["", "Coroutines by wall time (alive, summed over tasks):"]
+        for name, seconds in self.wall.most_common(top):
+            lines.append(f"  {seconds:8.3f} s  {name}")
+        lines += ["", "Functions by self time while the loop was busy:"]
+        for name, seconds in self.functions.most_common(top):
+            lines.append(f"  {seconds:8.3f} s  {name}")
+        return '\n'.join(lines) + '\n'
+    
+    def save(self, directory: str = config.PROFILE_DIR) -> Tuple[str, str]:
+        """Write the collapsed stacks and the summary; returns both paths"""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"profile-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}")
+        with open(f"{base}.folded", 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+        with open(f"{base}.txt", 'w', encoding='utf-8') as f:
+            f.write(self.summary())
+        return f"{base}.folded", f"{base}.txt"
+
+class SamplingProfiler:
+    """Runs one profile at a time from inside the event loop it profiles"""
+    
+    def __init__(self, interval: float = config.PROFILE_INTERVAL, task_every: int = config.PROFILE_TASK_EVERY):
+        self.interval = interval
+        self.task_every = task_every
+        self.profile: Optional[Profile] = None
+        self._stop = threading.Event()
+    
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+    
+    async def run(self, seconds: float) -> Profile:
+        """Sample the running loop for `seconds`, then return the profile"""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        loop = asyncio.get_running_loop()
+        profile = self.profile = Profile(self.interval, self.task_every, exclude=asyncio.current_task())
+        self._stop.clear()
+        thread = threading.Thread(
+            target=self._sample, args=(loop, threading.get_ident(), profile), name='profiler', daemon=True
+        )
+        started = time.perf_counter()
+        thread.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._stop.set()
+            thread.join()
+            profile.duration = time.perf_counter() - started
+            self.profile = None
+        return profile
+    
+    def _sample(self, loop: asyncio.AbstractEventLoop, thread_id: int, profile: Profile):
+        count = 0
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            now = time.perf_counter()
+            weight, last = now - last, now
+            if frame is None:
+                continue
+            tasks = None
+            if count % self.task_every == 0:
+                try:
+                    tasks = list(asyncio.all_tasks(loop))
+                except RuntimeError:
+                    # The task set changed under us too often; skip this round
+                    pass
+            count += 1
+            try:
+                profile.add(frame, weight, asyncio.current_task(loop), tasks)
+            except Exception as e:
+                print(f"Profiler sample error: {e}")
+            finally:
+                del frame
+
+# Global profiler
+profiler = SamplingProfiler()
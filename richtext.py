@@ -0,0 +1,241 @@
+"""
+Telegram Forward Bot - Rich Text Module
+
+Message text together with its Telegram entities. Edits work on Python
+string indices and carry the entities along, so formatting survives
+cleaning and header/footer changes without a round trip through HTML.
+"""
+import bisect
+import json
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional, Tuple
+from telegram import MessageEntity
+
+# Entities Telegram detects by itself in sent text, so they are never sent back
+AUTO_ENTITY_TYPES = frozenset({
+    MessageEntity.MENTION, MessageEntity.HASHTAG, MessageEntity.CASHTAG, MessageEntity.BOT_COMMAND,
+    MessageEntity.URL, MessageEntity.EMAIL, MessageEntity.PHONE_NUMBER,
+})
+
+ASTRAL = re.compile('[\U00010000-\U0010FFFF]')
+BLANK_LINES = re.compile(r'\n\s*\n')
+
+# (start, end, entity) in string indices; the entity only supplies type and extras
+Span = Tuple[int, int, MessageEntity]
+
+def utf16_offsets(text: str) -> Optional[List[int]]:
+    """UTF-16 offset of every string index, or None when the two are the same"""
+    if not ASTRAL.search(text):
+        return None
+    offsets = [0]
+    position = 0
+    for char in text:
+        position += 2 if ord(char) > 0xFFFF else 1
+        offsets.append(position)
+    return offsets
+
+class RichText:
+    """Immutable text plus entity spans; every edit returns a new instance"""
+    
+    __slots__ = ('text', 'spans')
+    
+    def __init__(self, text: str = '', spans: Iterable[Span] = ()):
+        self.text = text
+        self.spans: Tuple[Span, ...] = tuple(spans)
+    
+    # ========== CONVERSION ==========
+    @classmethod
+    def from_entities(cls, text: Optional[str], entities: Iterable[MessageEntity] = None) -> 'RichText':
+        """Wrap text and the entities Telegram sent with it (UTF-16 offsets)"""
+        if not text:
+            return cls()
+        offsets = utf16_offsets(text)
+        spans = []
+        for entity in entities or ():
+            start, end = entity.offset, entity.offset + entity.length
+            if offsets is not None:
+                start, end = bisect.bisect_left(offsets, start), bisect.bisect_left(offsets, end)
+            spans.append((start, end, entity))
+        return cls(text, spans)
+    
+    @classmethod
+    def from_message(cls, message) -> 'RichText':
+        if message.text is not None:
+            return cls.from_entities(message.text, message.entities)
+        return cls.from_entities(message.caption, message.caption_entities)
+    
+    @classmethod
+    def from_json(cls, text: str, entities_json: str) -> 'RichText':
+        entities = [MessageEntity.de_json(data, None) for data in json.loads(entities_json)]
+        return cls.from_entities(text, entities)
+    
+    @property
+    def entities(self) -> Tuple[MessageEntity, ...]:
+        """Entities to send with the text, with offsets in UTF-16 code units"""
+        offsets = utf16_offsets(self.text)
+        entities = []
+        for start, end, entity in self.spans:
+            if entity.type in AUTO_ENTITY_TYPES:
+                continue
+            if offsets is not None:
+                start, end = offsets[start], offsets[end]
+            entities.append(MessageEntity(
+                entity.type, start, end - start, url=entity.url, user=entity.user,
+                language=entity.language, custom_emoji_id=entity.custom_emoji_id
+            ))
+        return tuple(entities)
+    
+    def entities_json(self) -> str:
+        return json.dumps([entity.to_dict() for entity in self.entities])
+    
+    # ========== EDITING ==========
+    def splice(self, edits: Iterable[Tuple[int, int, str]]) -> 'RichText':
+        """Replace text[start:end] for each (start, end, replacement); edits must not overlap.
+
+        Entities move with the text around them. Replacement text is kept
+        inside an entity that starts or ends exactly at the edit, cut text
+        is taken out of the entities covering it, and entities left empty
+        are dropped.
+        """
+        edits = sorted(edits)
+        if not edits:
+            return self
+        
+        pieces = []
+        starts = []
+        moved = []  # (old end, new start, new end, shift after the edit)
+        position = shift = 0
+        for start, end, replacement in edits:
+            pieces.append(self.text[position:start])
+            pieces.append(replacement)
+            new_start = start + shift
+            shift += len(replacement) - (end - start)
+            starts.append(start)
+            moved.append((end, new_start, new_start + len(replacement), shift))
+            position = end
+        pieces.append(self.text[position:])
+        
+        def map_start(offset: int) -> int:
+            i = bisect.bisect_right(starts, offset) - 1
+            if i < 0:
+                return offset
+            end, new_start, new_end, shift = moved[i]
+            if offset == starts[i]:
+                return new_start
+            return new_end if offset < end else offset + shift
+        
+        def map_end(offset: int) -> int:
+            i = bisect.bisect_left(starts, offset) - 1
+            if i < 0:
+                return offset
+            end, new_start, new_end, shift = moved[i]
+            if offset == end:
+                return new_end
+            return new_start if offset < end else offset + shift
+        
+        spans = []
+        for start, end, entity in self.spans:
+            start, end = map_start(start), map_end(end)
+            if end > start:
+                spans.append((start, end, entity))
+        return RichText(''.join(pieces), spans)
+    
+    def remove(self, ranges: Iterable[Tuple[int, int]]) -> 'RichText':
+        """Cut out (start, end) ranges, which may overlap"""
+        merged: List[List[int]] = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return self.splice((start, end, '') for start, end in merged)
+    
+    def remove_entities(self, types: Iterable[str]) -> 'RichText':
+        """Cut out the text of every entity of the given types"""
+        types = set(types)
+        return self.remove((start, end) for start, end, entity in self.spans if entity.type in types)
+    
+    def normalize_whitespace(self) -> 'RichText':
+        """Strip the ends and collapse runs of blank lines to one"""
+        text = self.text
+        lead = len(text) - len(text.lstrip())
+        end = len(text.rstrip())
+        if end <= lead:
+            return RichText()
+        
+        edits = [(0, lead, '')] if lead else []
+        edits += [
+            (match.start(), match.end(), '\n\n')
+            for match in BLANK_LINES.finditer(text, lead, end) if match.group() != '\n\n'
+        ]
+        if end < len(text):
+            edits.append((end, len(text), ''))
+        return self.splice(edits)
+    
+    def prepend(self, other: 'RichText') -> 'RichText':
+        shift = len(other.text)
+        spans = [(start + shift, end + shift, entity) for start, end, entity in self.spans]
+        return RichText(other.text + self.text, (*other.spans, *spans))
+    
+    def append(self, other: 'RichText') -> 'RichText':
+        shift = len(self.text)
+        spans = [(start + shift, end + shift, entity) for start, end, entity in other.spans]
+        return RichText(self.text + other.text, (*self.spans, *spans))
+    
+    def __repr__(self):
+        return f"<{self.__class__.__name__} ({len(self.text)} chars, {len(self.spans)} entities)>"
+
+# ========== HTML ==========
+HTML_ENTITY_TYPES = {
+    'b': MessageEntity.BOLD, 'strong': MessageEntity.BOLD,
+    'i': MessageEntity.ITALIC, 'em': MessageEntity.ITALIC,
+    'u': MessageEntity.UNDERLINE, 'ins': MessageEntity.UNDERLINE,
+    's': MessageEntity.STRIKETHROUGH, 'strike': MessageEntity.STRIKETHROUGH, 'del': MessageEntity.STRIKETHROUGH,
+    'code': MessageEntity.CODE, 'pre': MessageEntity.PRE,
+    'a': MessageEntity.TEXT_LINK, 'tg-spoiler': MessageEntity.SPOILER,
+    'blockquote': MessageEntity.BLOCKQUOTE,
+}
+
+class _HTMLEntityParser(HTMLParser):
+    """Telegram-flavoured HTML to text and spans"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.pieces: List[str] = []
+        self.position = 0
+        self.open: List[tuple] = []
+        self.spans: List[Span] = []
+    
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        entity_type = HTML_ENTITY_TYPES.get(tag)
+        if tag == 'span' and attrs.get('class') == 'tg-spoiler':
+            entity_type = MessageEntity.SPOILER
+        if entity_type == MessageEntity.TEXT_LINK and not attrs.get('href'):
+            entity_type = None
+        self.open.append((tag, entity_type, self.position, attrs))
+    
+    def handle_endtag(self, tag):
+        for i in range(len(self.open) - 1, -1, -1):
+            if self.open[i][0] == tag:
+                _, entity_type, start, attrs = self.open.pop(i)
+                if entity_type and self.position > start:
+                    entity = MessageEntity(entity_type, 0, 0, url=attrs.get('href'))
+                    self.spans.append((start, self.position, entity))
+                return
+    
+    def handle_data(self, data):
+        self.pieces.append(data)
+        self.position += len(data)
+
+@lru_cache(maxsize=1024)
+def html_to_rich(html: str) -> RichText:
+    """Parse the HTML users type into headers, footers and older scheduled posts"""
+    if '<' not in html and '&' not in html:
+        return RichText(html)
+    parser = _HTMLEntityParser()
+    parser.feed(html)
+    parser.close()
+    return RichText(''.join(parser.pieces), sorted(parser.spans, key=lambda span: span[0]))
@@ -0,0 +1,103 @@
+"""
+Telegram Forward Bot - Routing Module
+
+In-memory map from source chat to its enabled tasks and their filters, so
+the forwarding hot path never has to query the database.
+"""
+from typing import Dict, Iterable, List, Set, Tuple
+from database import db
+
+# (task, filters) pairs for one source chat
+Route = Tuple[Tuple[Dict, List[Dict]], ...]
+
+class RoutingTable:
+    """Source chat -> enabled tasks, rebuilt copy-on-write.
+
+    Readers only ever see a complete route tuple: changes build new tuples
+    and a new route dict, then swap the dict in with a single assignment.
+    Task dicts are never mutated in place, so a forward that is already
+    running keeps the settings it started with.
+    """
+    
+    def __init__(self):
+        self._tasks: Dict[int, Dict] = {}
+        self._filters: Dict[int, List[Dict]] = {}
+        self._by_source: Dict[int, Set[int]] = {}
+        self._routes: Dict[int, Route] = {}
+    
+    def route(self, source_chat_id: int) -> Route:
+        """Enabled tasks for a source chat, with their filters"""
+        return self._routes.get(source_chat_id, ())
+    
+    def get_task(self, task_id: int) -> Dict:
+        return self._tasks.get(task_id)
+    
+    def __len__(self) -> int:
+        return len(self._tasks)
+    
+    async def reload(self):
+        """Rebuild the whole table from the database"""
+        tasks = {task['task_id']: task for task in await db.get_all_tasks()}
+        filters: Dict[int, List[Dict]] = {}
+        for task_filter in await db.get_all_filters():
+            filters.setdefault(task_filter['task_id'], []).append(task_filter)
+        by_source: Dict[int, Set[int]] = {}
+        for task in tasks.values():
+            by_source.setdefault(task['source_chat_id'], set()).add(task['task_id'])
+        
+        self._tasks, self._filters, self._by_source = tasks, filters, by_source
+        routes = {source: self._build_route(source) for source in by_source}
+        self._routes = {source: route for source, route in routes.items() if route}
+    
+    async def reload_task(self, task_id: int):
+        """Pick up a created, edited or deleted task and its filters"""
+        task = await db.get_task(task_id)
+        filters = await db.get_task_filters(task_id) if task else []
+        
+        sources = set()
+        old = self._tasks.pop(task_id, None)
+        self._filters.pop(task_id, None)
+        if old:
+            sources.add(old['source_chat_id'])
+            self._by_source.get(old['source_chat_id'], set()).discard(task_id)
+        if task:
+            self._tasks[task_id] = task
+            self._filters[task_id] = filters
+            self._by_source.setdefault(task['source_chat_id'], set()).add(task_id)
+            sources.add(task['source_chat_id'])
+        self._rebuild(sources)
+    
+    def set_enabled(self, task_ids: Iterable[int], enabled: bool):
+        """Flip tasks on or off without touching the database"""
+        sources = set()
+        for task_id in task_ids:
+            task = self._tasks.get(task_id)
+            if task is None or bool(task['is_enabled']) == enabled:
+                continue
+            self._tasks[task_id] = {**task, 'is_enabled': int(enabled)}
+            sources.add(task['source_chat_id'])
+        self._rebuild(sources)
+    
+    def _build_route(self, source_chat_id: int) -> Route:
+        tasks = sorted(
+            (self._tasks[task_id] for task_id in self._by_source.get(source_chat_id, ())),
+            key=lambda task: task['task_id']
+        )
+        return tuple((task, self._filters.get(task['task_id'], [])) for task in tasks if task['is_enabled'])
+    
+    def _rebuild(self, sources: Set[int]):
+        if not sources:
+            return
+        routes = dict(self._routes)
+        for source in sources:
+            route = self._build_route(source)
+            if route:
+                routes[source] = route
+            else:
+                routes.pop(source, None)
+            if not self._by_source.get(source):
+                self._by_source.pop(source, None)
+        self._routes = routes
+
+# Global routing table
+routing = RoutingTable()
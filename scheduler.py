@@ -1,162 +1,538 @@
 """
 Telegram Forward Bot - Scheduler Module
 """
+import asyncio
+import calendar
+import time
+from functools import lru_cache
+from apscheduler.events import EVENT_ALL_JOBS_REMOVED, EVENT_JOB_REMOVED
+from apscheduler.job import Job
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
-from typing import Dict, List
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
 import config
 from database import db
+from forwarder import forward_engine
+from jobstore import SQLiteJobStore
+from routing import routing
+
+# Job ID prefixes of jobs rebuilt from the database at startup
+RESTORED_JOB_PREFIXES = ('power_on_', 'power_off_', 'auto_post_')
+AUTO_POST_JOB_ID = 'auto_post_tick'
+
+@lru_cache(maxsize=None)
+def cron_trigger(timezone: str = None, **fields) -> CronTrigger:
+    """Shared trigger per schedule; thousands of jobs use the same few times"""
+    return CronTrigger(timezone=timezone or config.SCHEDULER_TIMEZONE, **fields)
+
+class JobRegistry:
+    """Job IDs indexed by task and by kind (power, auto_post, clone).
+
+    Power boundary jobs are shared, so a job can be linked to many tasks.
+    """
+    
+    def __init__(self):
+        self._jobs: Dict[str, Tuple[str, Set[int], str]] = {}  # job_id -> (kind, task_ids, jobstore)
+        self._by_task: Dict[int, Set[str]] = defaultdict(set)
+        self._by_kind: Dict[str, Set[str]] = defaultdict(set)
+    
+    def add(self, job_id: str, kind: str, task_id: Optional[int] = None, jobstore: str = 'default'):
+        self.discard(job_id)
+        self._jobs[job_id] = (kind, set(), jobstore)
+        self._by_kind[kind].add(job_id)
+        if task_id is not None:
+            self.link(job_id, task_id)
+    
+    def link(self, job_id: str, task_id: int):
+        self._jobs[job_id][1].add(task_id)
+        self._by_task[task_id].add(job_id)
+    
+    def unlink(self, job_id: str, task_id: int):
+        entry = self._jobs.get(job_id)
+        if entry is not None:
+            entry[1].discard(task_id)
+        job_ids = self._by_task.get(task_id)
+        if job_ids is not None:
+            job_ids.discard(job_id)
+            if not job_ids:
+                del self._by_task[task_id]
+    
+    def job_tasks(self, job_id: str) -> Set[int]:
+        entry = self._jobs.get(job_id)
+        return set(entry[1]) if entry else set()
+    
+    def discard(self, job_id: str):
+        entry = self._jobs.get(job_id)
+        if entry is None:
+            return
+        kind, task_ids, _ = entry
+        for task_id in list(task_ids):
+            self.unlink(job_id, task_id)
+        del self._jobs[job_id]
+        self._by_kind[kind].discard(job_id)
+        if not self._by_kind[kind]:
+            del self._by_kind[kind]
+    
+    def discard_jobstore(self, jobstore: str):
+        for job_id in [job_id for job_id, entry in self._jobs.items() if entry[2] == jobstore]:
+            self.discard(job_id)
+    
+    def task_jobs(self, task_id: int, kind: str = None) -> List[str]:
+        job_ids = self._by_task.get(task_id, ())
+        if kind is None:
+            return sorted(job_ids)
+        return sorted(job_id for job_id in job_ids if self._jobs[job_id][0] == kind)
+    
+    def kind_jobs(self, kind: str) -> List[str]:
+        return sorted(self._by_kind.get(kind, ()))
+    
+    def counts(self) -> Dict[str, int]:
+        return {kind: len(job_ids) for kind, job_ids in self._by_kind.items()}
+    
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._jobs
+    
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+# ========== JOB CALLBACKS ==========
+# Persisted jobs are stored by reference, so their callables must be
+# importable module-level functions.
+async def power_boundary_job(enable: bool, time_str: str, timezone: str):
+    """Switch every task on a power boundary in one batch"""
+    task_ids = await db.apply_power_boundary(enable, time_str, timezone)
+    routing.set_enabled(task_ids, enable)
+    if task_ids:
+        print(f"⏰ Power {'on' if enable else 'off'} at {time_str} {timezone}: {len(task_ids)} tasks")
+
+async def auto_post_tick_job():
+    """Send every scheduled post that is due"""
+    await scheduler.dispatch_auto_posts()
+
+# ========== AUTO POST TIMES ==========
+# schedule_time is wall-clock time in SCHEDULER_TIMEZONE; next_run_time is
+# stored in UTC so due posts can be found with a plain string comparison.
+def to_db_time(dt: datetime) -> str:
+    return dt.astimezone(pytz.UTC).strftime('%Y-%m-%dT%H:%M:%S')
+
+def from_db_time(value: str) -> datetime:
+    return pytz.UTC.localize(datetime.fromisoformat(value))
+
+def post_run_time(schedule_time: str) -> datetime:
+    """First run of a post, in UTC"""
+    dt = datetime.fromisoformat(schedule_time)
+    if dt.tzinfo is None:
+        dt = pytz.timezone(config.SCHEDULER_TIMEZONE).localize(dt)
+    return dt.astimezone(pytz.UTC)
+
+def next_post_run(post: Dict, after: datetime) -> Optional[datetime]:
+    """Next run of a recurring post strictly after `after`, in UTC"""
+    if not post['is_recurring']:
+        return None
+    
+    tz = pytz.timezone(config.SCHEDULER_TIMEZONE)
+    anchor = datetime.fromisoformat(post['schedule_time']).replace(tzinfo=None)
+    last = from_db_time(post['next_run_time']).astimezone(tz).replace(tzinfo=None)
+    pattern = post['recurrence_pattern']
+    
+    # Step in wall-clock time so posts stay at the same local hour across DST
+    candidate = last
+    while True:
+        if pattern == 'weekly':
+            candidate += timedelta(days=7)
+        elif pattern == 'monthly':
+            # candidate.month is 1-based, so this is already the next month's 0-based index
+            year, month = divmod(candidate.year * 12 + candidate.month, 12)
+            month += 1
+            day = min(anchor.day, calendar.monthrange(year, month)[1])
+            candidate = candidate.replace(year=year, month=month, day=day)
+        else:
+            candidate += timedelta(days=1)
+        candidate = candidate.replace(hour=anchor.hour, minute=anchor.minute, second=0, microsecond=0)
+        
+        run_time = tz.localize(candidate).astimezone(pytz.UTC)
+        if run_time > after:
+            return run_time
+
+def catch_up_runs(post: Dict, now: datetime) -> int:
+    """How many times to send a post whose run was missed, per CATCHUP_POLICY"""
+    if not post['is_recurring']:
+        return 0 if config.CATCHUP_POLICY.get('auto_post_once') == 'skip' else 1
+    
+    policy = config.CATCHUP_POLICY.get('auto_post', 'run_once')
+    if policy == 'skip':
+        return 0
+    if policy == 'run_once':
+        return 1
+    
+    runs = 1
+    run_time = from_db_time(post['next_run_time'])
+    while runs < config.CATCHUP_MAX_RUNS:
+        run_time = next_post_run({**post, 'next_run_time': to_db_time(run_time)}, run_time)
+        if run_time > now:
+            break
+        runs += 1
+    return runs
+
+def last_boundary_time(hhmm: str, timezone: str, now: datetime) -> datetime:
+    """Most recent time a daily HH:MM boundary fired, in UTC"""
+    tz = pytz.timezone(timezone)
+    local_now = now.astimezone(tz).replace(tzinfo=None)
+    fired = local_now.replace(hour=int(hhmm[:2]), minute=int(hhmm[2:]), second=0, microsecond=0)
+    if fired > local_now:
+        fired -= timedelta(days=1)
+    return tz.localize(fired).astimezone(pytz.UTC)
 
 class BotScheduler:
     def __init__(self):
-        self.scheduler = AsyncIOScheduler(timezone=config.SCHEDULER_TIMEZONE)
-        self.active_tasks = {}  # Store job IDs for each task
+        self.jobstore = SQLiteJobStore()
+        # Jobs with non-importable callbacks (closures, bound methods) stay in memory
+        self.scheduler = AsyncIOScheduler(
+            timezone=config.SCHEDULER_TIMEZONE,
+            jobstores={'default': self.jobstore, 'memory': MemoryJobStore()},
+            # Short stalls still run; longer outages are handled by the catch-up policy
+            job_defaults={'coalesce': True, 'misfire_grace_time': config.CATCHUP_GRACE_SECONDS}
+        )
+        self._catch_up_tasks = set()
+        self._pending_power: List[Tuple[bool, str, str]] = []  # Found missing by restore_jobs
+        self._pending_since: Optional[datetime] = None
+        self._import_task: Optional[asyncio.Task] = None
+        self.registry = JobRegistry()
+        # Finished one-shot jobs are removed by APScheduler itself
+        self.scheduler.add_listener(self._on_jobs_removed, EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED)
+        self.bot = None  # Set at startup, used by persisted job callbacks
     
-    def start(self):
+    def start(self, paused: bool = False):
         """Start the scheduler"""
-        self.scheduler.start()
+        self.scheduler.start(paused=paused)
+    
+    def resume(self):
+        """Start processing jobs after a paused start, then import missing power jobs in the background"""
+        self.scheduler.resume()
+        if self._pending_power:
+            pending, self._pending_power = self._pending_power, []
+            self._import_task = asyncio.get_running_loop().create_task(
+                self._import_missing_power(pending, self._pending_since)
+            )
     
     def shutdown(self):
         """Shutdown the scheduler"""
+        # Jobs not imported yet are found missing again on the next start
+        if self._import_task is not None:
+            self._import_task.cancel()
         self.scheduler.shutdown()
     
+    def _on_jobs_removed(self, event):
+        if event.code == EVENT_JOB_REMOVED:
+            self.registry.discard(event.job_id)
+        else:
+            self.registry.discard_jobstore(event.alias)
+    
+    def _remove_job(self, job_id: str):
+        try:
+            self.scheduler.remove_job(job_id)
+        except JobLookupError:
+            # Keep the registry honest even if the job vanished some other way
+            self.registry.discard(job_id)
+    
+    # ========== STARTUP RESTORATION ==========
+    async def restore_jobs(self):
+        """Register jobs for every power schedule and the auto post dispatcher.
+
+        Jobs already in the persistent store are left alone, so a restart
+        only reads job IDs and schedule rows. Missing power jobs are
+        registered here but written to the store by resume(), in batches in
+        the background, so a first start doesn't wait on thousands of
+        inserts. Jobs whose rows are gone are dropped.
+        """
+        started = time.perf_counter()
+        self._pending_since = datetime.now(pytz.utc)
+        existing = self.jobstore.get_job_ids()
+        expected = set()
+        missing_power = []
+        added = 0
+        
+        async for row in db.iter_power_schedules():
+            timezone = row['power_timezone'] or config.SCHEDULER_TIMEZONE
+            for enable, time_str in ((True, row['power_on_time']), (False, row['power_off_time'])):
+                if not time_str:
+                    continue
+                job_id = self.power_job_id(enable, time_str, timezone)
+                if job_id not in expected:
+                    expected.add(job_id)
+                    self.registry.add(job_id, 'power')
+                    if job_id not in existing:
+                        missing_power.append((enable, time_str, timezone))
+                self.registry.link(job_id, row['task_id'])
+        self._pending_power = missing_power
+        
+        # Posts are found by the dispatcher tick; only backfill run times
+        # for posts created before next_run_time existed
+        missing = [(to_db_time(post_run_time(row['schedule_time'])), row['schedule_id'])
+                   async for row in db.iter_unscheduled_posts()]
+        if missing:
+            await db.set_post_run_times(missing)
+        expected.add(AUTO_POST_JOB_ID)
+        if AUTO_POST_JOB_ID in existing:
+            self.registry.add(AUTO_POST_JOB_ID, 'auto_post')
+        elif self.ensure_auto_post_dispatcher():
+            added += 1
+        
+        stale = [job_id for job_id in existing
+                 if job_id.startswith(RESTORED_JOB_PREFIXES) and job_id not in expected]
+        with self.jobstore.batch():
+            for job_id in stale:
+                self._remove_job(job_id)
+        
+        print(f"⏰ Restored {len(expected)} scheduled jobs ({added} new, {len(missing_power)} to import, "
+              f"{len(stale)} stale removed) in {time.perf_counter() - started:.2f}s")
+        
+        await self.catch_up_power()
+        return len(expected)
+    
+    # ========== CATCH-UP ==========
+    async def catch_up_power(self, now: datetime = None) -> int:
+        """Apply power boundaries that passed while the bot was down.
+
+        Must run before the scheduler resumes, while missed boundary jobs
+        still carry their stale next run time. For every task on a missed
+        boundary, the latest one decides whether it ends up on or off.
+        """
+        if config.CATCHUP_POLICY.get('power', 'run_once') == 'skip':
+            return 0
+        
+        now = now or datetime.now(pytz.UTC)
+        cutoff = now - timedelta(seconds=config.CATCHUP_GRACE_SECONDS)
+        latest: Dict[int, Tuple[datetime, bool]] = {}
+        for job_id, next_run in self.jobstore.get_overdue_jobs(cutoff):
+            if not job_id.startswith(('power_on_', 'power_off_')):
+                continue
+            _, action, hhmm, timezone = job_id.split('_', 3)
+            fired = last_boundary_time(hhmm, timezone, now)
+            if fired < next_run:
+                continue
+            for task_id in self.registry.job_tasks(job_id):
+                if task_id not in latest or fired > latest[task_id][0]:
+                    latest[task_id] = (fired, action == 'on')
+        
+        for enable in (True, False):
+            task_ids = [task_id for task_id, (_, state) in latest.items() if state == enable]
+            if task_ids:
+                await db.set_tasks_enabled(task_ids, enable)
+                routing.set_enabled(task_ids, enable)
+        
+        if latest:
+            print(f"⏰ Caught up missed power boundaries for {len(latest)} tasks")
+        return len(latest)
+    
     # ========== POWER ON/OFF SCHEDULE ==========
-    def schedule_power_on(self, task_id: int, time_str: str, callback):
-        """Schedule task to turn on at specific time"""
+    # One job per (action, time, timezone) boundary, shared by every task on it
+    @staticmethod
+    def power_job_id(enable: bool, time_str: str, timezone: str) -> str:
+        return f"power_{'on' if enable else 'off'}_{time_str.replace(':', '')}_{timezone}"
+    
+    def _add_power_job(self, enable: bool, time_str: str, timezone: str) -> Optional[Job]:
         try:
-            # Parse time string (HH:MM format)
             hour, minute = map(int, time_str.split(':'))
-            
-            job_id = f"power_on_{task_id}"
-            
-            # Remove existing job if any
-            if self.scheduler.get_job(job_id):
-                self.scheduler.remove_job(job_id)
-            
-            # Add new job
-            self.scheduler.add_job(
-                callback,
-                trigger=CronTrigger(hour=hour, minute=minute),
-                id=job_id,
-                args=[task_id, True],
+            return self.scheduler.add_job(
+                power_boundary_job,
+                trigger=cron_trigger(timezone=timezone, hour=hour, minute=minute),
+                id=self.power_job_id(enable, time_str, timezone),
+                args=[enable, time_str, timezone],
                 replace_existing=True
             )
-            
-            return True
         except Exception as e:
-            print(f"Schedule power on error: {e}")
-            return False
+            print(f"Schedule power {'on' if enable else 'off'} error: {e}")
+            return None
     
-    def schedule_power_off(self, task_id: int, time_str: str, callback):
-        """Schedule task to turn off at specific time"""
+    async def _import_missing_power(self, specs: List[Tuple[bool, str, str]], since: datetime):
+        """Write the power jobs restore_jobs found missing, a batch at a time.
+
+        Boundaries dropped while waiting are skipped. Fire times count from
+        `since`, so a boundary that passed during the import still runs.
+        """
+        started = time.perf_counter()
+        added = 0
+        size = config.SCHEDULER_IMPORT_BATCH_SIZE
+        # On and off jobs at the same time share a trigger; keep them in one batch
+        specs = sorted(specs, key=lambda spec: (spec[2], spec[1]))
         try:
-            hour, minute = map(int, time_str.split(':'))
-            
-            job_id = f"power_off_{task_id}"
-            
-            if self.scheduler.get_job(job_id):
-                self.scheduler.remove_job(job_id)
-            
-            self.scheduler.add_job(
-                callback,
-                trigger=CronTrigger(hour=hour, minute=minute),
-                id=job_id,
-                args=[task_id, False],
-                replace_existing=True
-            )
-            
-            return True
+            for offset in range(0, len(specs), size):
+                batch = [spec for spec in specs[offset:offset + size] if self.power_job_id(*spec) in self.registry]
+                if batch:
+                    added += self._import_power_jobs(batch, since)
+                    self.scheduler.wakeup()
+                # Let updates through between batches
+                await asyncio.sleep(0)
         except Exception as e:
-            print(f"Schedule power off error: {e}")
-            return False
+            print(f"Power job import error: {e}")
+        print(f"⏰ Imported {added} power jobs in {time.perf_counter() - started:.2f}s")
+    
+    def _import_power_jobs(self, specs: List[Tuple[bool, str, str]], since: datetime = None) -> int:
+        """Write many power jobs to the store in one transaction; returns how many were added.
+
+        APScheduler's add_job validates the callable and builds each job from
+        scratch, which dominates a big import. The first job goes through
+        it; the rest copy its state with their own id, args and trigger. The
+        on and off jobs of a boundary share a trigger, so its next fire time
+        is computed once. Jobs written to the store directly don't wake a
+        running scheduler; call wakeup() afterwards.
+        """
+        template = None
+        jobs = []
+        next_fire = {}
+        now = since or datetime.now(pytz.utc)
+        for enable, time_str, timezone in specs:
+            if template is None:
+                template = self._add_power_job(enable, time_str, timezone)
+                if template is not None:
+                    state = template.__getstate__()
+                continue
+            try:
+                hour, minute = map(int, time_str.split(':'))
+                trigger = cron_trigger(timezone=timezone, hour=hour, minute=minute)
+                if trigger not in next_fire:
+                    next_fire[trigger] = trigger.get_next_fire_time(None, now)
+            except Exception as e:
+                print(f"Schedule power {'on' if enable else 'off'} error: {e}")
+                continue
+            job = Job.__new__(Job)
+            job.__setstate__(dict(
+                state, id=self.power_job_id(enable, time_str, timezone), args=(enable, time_str, timezone),
+                trigger=trigger, next_run_time=next_fire[trigger]
+            ))
+            jobs.append(job)
+        if jobs:
+            self.jobstore.add_jobs(jobs)
+        return len(jobs) + (template is not None)
+    
+    def _schedule_power(self, task_id: int, enable: bool, time_str: str, timezone: str = None) -> bool:
+        timezone = timezone or config.SCHEDULER_TIMEZONE
+        job_id = self.power_job_id(enable, time_str, timezone)
+        if job_id in self.registry.task_jobs(task_id, 'power'):
+            return True
+        
+        if job_id not in self.registry:
+            if not self._add_power_job(enable, time_str, timezone):
+                return False
+            self.registry.add(job_id, 'power')
+        
+        # Leave the task's previous boundary for this action
+        self._unlink_power(task_id, enable)
+        self.registry.link(job_id, task_id)
+        return True
+    
+    def _unlink_power(self, task_id: int, enable: bool):
+        prefix = 'power_on_' if enable else 'power_off_'
+        for job_id in self.registry.task_jobs(task_id, 'power'):
+            if job_id.startswith(prefix):
+                self.registry.unlink(job_id, task_id)
+                if not self.registry.job_tasks(job_id):
+                    self._remove_job(job_id)
+    
+    def schedule_power_on(self, task_id: int, time_str: str, timezone: str = None) -> bool:
+        """Schedule task to turn on at specific time"""
+        return self._schedule_power(task_id, True, time_str, timezone)
+    
+    def schedule_power_off(self, task_id: int, time_str: str, timezone: str = None) -> bool:
+        """Schedule task to turn off at specific time"""
+        return self._schedule_power(task_id, False, time_str, timezone)
+    
+    def sync_power_schedule(self, task: Dict) -> bool:
+        """Link a task to the boundaries its power columns point at"""
+        ok = True
+        for enable, time_str in ((True, task.get('power_on_time')), (False, task.get('power_off_time'))):
+            if time_str:
+                ok = self._schedule_power(task['task_id'], enable, time_str, task.get('power_timezone')) and ok
+            else:
+                self._unlink_power(task['task_id'], enable)
+        return ok
     
     def remove_power_schedule(self, task_id: int):
         """Remove power on/off schedule for a task"""
-        on_job_id = f"power_on_{task_id}"
-        off_job_id = f"power_off_{task_id}"
-        
-        for job_id in [on_job_id, off_job_id]:
-            if self.scheduler.get_job(job_id):
-                self.scheduler.remove_job(job_id)
-    
-    # ========== DELAYED FORWARD ==========
-    def schedule_delayed_forward(self, message_id: int, chat_id: int, 
-                                 delay_seconds: int, callback):
-        """Schedule a message to be forwarded after delay"""
-        try:
-            job_id = f"delayed_{message_id}_{chat_id}"
-            
-            # Schedule one-time job
-            self.scheduler.add_job(
-                callback,
-                'date',
-                run_date=datetime.now(pytz.UTC).replace(
-                    second=datetime.now(pytz.UTC).second + delay_seconds
-                ),
-                id=job_id,
-                args=[message_id, chat_id],
-                replace_existing=True
-            )
-            
-            return True
-        except Exception as e:
-            print(f"Schedule delayed forward error: {e}")
-            return False
+        for enable in (True, False):
+            self._unlink_power(task_id, enable)
     
     # ========== AUTO POST SCHEDULER ==========
-    def schedule_auto_post(self, schedule_id: int, schedule_time: str, 
-                          is_recurring: bool, recurrence_pattern: str, callback):
-        """Schedule an auto post"""
-        try:
-            job_id = f"auto_post_{schedule_id}"
-            
-            if self.scheduler.get_job(job_id):
-                self.scheduler.remove_job(job_id)
-            
-            # Parse schedule time
-            dt = datetime.fromisoformat(schedule_time)
+    # One tick job a minute sends every due post, instead of one job per post
+    def ensure_auto_post_dispatcher(self) -> bool:
+        """Make sure the auto post tick job is scheduled"""
+        if AUTO_POST_JOB_ID in self.registry:
+            return False
+        self.scheduler.add_job(
+            auto_post_tick_job,
+            trigger=cron_trigger(second=0),
+            id=AUTO_POST_JOB_ID,
+            max_instances=1,
+            replace_existing=True
+        )
+        self.registry.add(AUTO_POST_JOB_ID, 'auto_post')
+        return True
+    
+    async def dispatch_auto_posts(self) -> int:
+        """Send all due posts and move recurring ones to their next run.
+
+        Posts more than CATCHUP_GRACE_SECONDS late were missed during
+        downtime; CATCHUP_POLICY decides how often they are sent, and those
+        sends run in the background at the reduced catch-up rate.
+        """
+        now = datetime.now(pytz.UTC)
+        cutoff = now - timedelta(seconds=config.CATCHUP_GRACE_SECONDS)
+        sent = 0
+        while True:
+            posts = await db.get_due_posts(to_db_time(now), config.AUTO_POST_BATCH_SIZE)
+            if not posts:
+                break
             
-            if is_recurring and recurrence_pattern:
-                # Parse recurrence pattern (e.g., "daily", "weekly", "monthly")
-                if recurrence_pattern == 'daily':
-                    trigger = CronTrigger(hour=dt.hour, minute=dt.minute)
-                elif recurrence_pattern == 'weekly':
-                    trigger = CronTrigger(day_of_week=dt.weekday(), hour=dt.hour, minute=dt.minute)
-                elif recurrence_pattern == 'monthly':
-                    trigger = CronTrigger(day=dt.day, hour=dt.hour, minute=dt.minute)
+            on_time, catch_up = [], []
+            advanced, finished = [], []
+            for post in posts:
+                if from_db_time(post['next_run_time']) >= cutoff:
+                    on_time.append(post)
                 else:
-                    trigger = CronTrigger(hour=dt.hour, minute=dt.minute)
+                    catch_up.extend([post] * catch_up_runs(post, now))
                 
-                self.scheduler.add_job(
-                    callback,
-                    trigger=trigger,
-                    id=job_id,
-                    args=[schedule_id],
-                    replace_existing=True
-                )
-            else:
-                # One-time post
-                self.scheduler.add_job(
-                    callback,
-                    'date',
-                    run_date=dt,
-                    id=job_id,
-                    args=[schedule_id],
-                    replace_existing=True
-                )
+                next_run = next_post_run(post, now)
+                if next_run:
+                    advanced.append((to_db_time(next_run), post['schedule_id']))
+                else:
+                    finished.append(post['schedule_id'])
             
-            return True
-        except Exception as e:
-            print(f"Schedule auto post error: {e}")
-            return False
+            # Advance before sending: a failed or slow send is never retried every minute
+            await db.advance_scheduled_posts(advanced, finished)
+            
+            if catch_up:
+                self._start_catch_up(catch_up)
+            
+            # The outbound limiter paces these, so they can all be started at once
+            results = await asyncio.gather(*(
+                forward_engine.send_scheduled_post(self.bot, post) for post in on_time
+            ))
+            sent += sum(results)
+            
+            if len(posts) < config.AUTO_POST_BATCH_SIZE:
+                break
+        
+        if sent:
+            print(f"📬 Sent {sent} scheduled posts")
+        return sent
     
-    def remove_auto_post(self, schedule_id: int):
-        """Remove an auto post schedule"""
-        job_id = f"auto_post_{schedule_id}"
-        if self.scheduler.get_job(job_id):
-            self.scheduler.remove_job(job_id)
+    def _start_catch_up(self, posts: List[Dict]):
+        print(f"📬 Catching up {len(posts)} missed scheduled posts")
+        task = asyncio.get_running_loop().create_task(self._send_catch_up(posts))
+        self._catch_up_tasks.add(task)
+        task.add_done_callback(self._catch_up_tasks.discard)
+    
+    async def _send_catch_up(self, posts: List[Dict]):
+        results = await asyncio.gather(*(
+            forward_engine.send_scheduled_post(self.bot, post, catchup=True) for post in posts
+        ))
+        print(f"📬 Caught up {sum(results)} of {len(posts)} missed scheduled posts")
     
     # ========== CLONE SOURCE SCHEDULER ==========
     def schedule_clone_task(self, task_id: int, interval_minutes: int, callback):
@@ -164,17 +540,16 @@ class BotScheduler:
         try:
             job_id = f"clone_{task_id}"
             
-            if self.scheduler.get_job(job_id):
-                self.scheduler.remove_job(job_id)
-            
             self.scheduler.add_job(
                 callback,
                 'interval',
                 minutes=interval_minutes,
                 id=job_id,
                 args=[task_id],
+                jobstore='memory',
                 replace_existing=True
             )
+            self.registry.add(job_id, 'clone', task_id, 'memory')
             
             return True
         except Exception as e:
@@ -183,22 +558,30 @@ class BotScheduler:
     
     def remove_clone_schedule(self, task_id: int):
         """Remove clone schedule"""
-        job_id = f"clone_{task_id}"
-        if self.scheduler.get_job(job_id):
-            self.scheduler.remove_job(job_id)
+        self._remove_job(f"clone_{task_id}")
     
     # ========== GET SCHEDULED JOBS ==========
-    def get_task_jobs(self, task_id: int) -> List[str]:
-        """Get all job IDs for a task"""
-        jobs = []
-        for job in self.scheduler.get_jobs():
-            if str(task_id) in job.id:
-                jobs.append(job.id)
-        return jobs
+    def get_task_jobs(self, task_id: int, kind: str = None) -> List[str]:
+        """Get all job IDs for a task, optionally of one kind"""
+        return self.registry.task_jobs(task_id, kind)
     
     def is_task_scheduled(self, task_id: int) -> bool:
         """Check if task has any scheduled jobs"""
-        return len(self.get_task_jobs(task_id)) > 0
+        return bool(self.registry.task_jobs(task_id))
+    
+    def remove_task_jobs(self, task_id: int) -> int:
+        """Remove every job belonging to a task"""
+        job_ids = self.registry.task_jobs(task_id)
+        with self.jobstore.batch():
+            for job_id in job_ids:
+                self.registry.unlink(job_id, task_id)
+                if not self.registry.job_tasks(job_id):
+                    self._remove_job(job_id)
+        return len(job_ids)
+    
+    def job_counts(self) -> Dict[str, int]:
+        """Number of scheduled jobs per kind"""
+        return self.registry.counts()
 
 # Global scheduler instance
 scheduler = BotScheduler()
@@ -0,0 +1,60 @@
+"""
+Telegram Forward Bot - Per-Destination Send Queue
+"""
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+class SendQueue:
+    """Filtered messages waiting for their destination's send slot.
+    
+    Each destination chat gets a FIFO and, while that FIFO has items, one
+    worker task that hands them to the deliver callback in order. Rate
+    limit waits and RetryAfter back-off happen in that worker, so a busy
+    destination holds up only its own messages, never the update handler
+    or the other destinations.
+    """
+    
+    def __init__(self, deliver: Callable[[Any], Awaitable[Any]]):
+        self._deliver = deliver
+        self._queues: Dict[int, Deque[Any]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+    
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+    
+    def push(self, chat_id: int, item: Any):
+        """Deliver item after everything already queued for chat_id"""
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.append(item)
+        
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.get_running_loop().create_task(self._run(chat_id, queue))
+    
+    async def _run(self, chat_id: int, queue: Deque[Any]):
+        try:
+            while queue:
+                try:
+                    await self._deliver(queue.popleft())
+                except Exception as e:
+                    print(f"Send queue error for {chat_id}: {e}")
+        finally:
+            # No await between the empty check and here, so nothing can slip in
+            self._queues.pop(chat_id, None)
+            self._workers.pop(chat_id, None)
+    
+    async def join(self):
+        """Wait until every queued item has been delivered"""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+    
+    async def close(self):
+        """Stop the workers; items still waiting are dropped"""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._queues.clear()
+        self._workers.clear()
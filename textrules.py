@@ -0,0 +1,227 @@
+"""
+Telegram Forward Bot - Text Rules Module
+
+Per-task text rules compiled into single-pass matchers. Compiled rules are
+cached by their stored JSON, so editing a task's rules simply compiles a
+new matcher on the next message.
+"""
+import bisect
+import json
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from richtext import RichText
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """Regex source matching any of the words, built as a prefix trie.
+
+    Shared prefixes are matched once, so the regex engine does one pass
+    over the text however many words there are. Longer words win over
+    their own prefixes.
+    """
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def build(node: Dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if '' in node:
+            return f"(?:{body})?"
+        return body
+    
+    return build(trie)
+
+def lower_in_place(text: str) -> str:
+    """text.lower(), one character for one, so offsets match the original.
+
+    Only İ lowercases to two characters ('i' and a combining dot); it
+    becomes a plain 'i', as in case-insensitive regexes.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(char.lower()[0] for char in text)
+
+class Replacer:
+    """A task's replacement rules as trie regexes plus a lookup of replacements.
+
+    Case-sensitive rules are one regex over the text, and rules that ignore
+    case are one regex over the lowercased text, which keeps the regex
+    engine's fast literal scanning that (?i) would turn off. Rules are
+    applied simultaneously: replaced text is not matched again by later
+    rules. Where two rules match at the same spot the longer one wins,
+    then the case-sensitive one.
+    """
+    
+    def __init__(self, rules: List[Dict]):
+        self.exact: Dict[str, str] = {}
+        self.folded: Dict[str, str] = {}
+        for rule in rules:
+            old = rule.get('old')
+            if not old:
+                continue
+            if rule.get('case_sensitive', True):
+                self.exact.setdefault(old, rule.get('new', ''))
+            else:
+                self.folded.setdefault(lower_in_place(old), rule.get('new', ''))
+        
+        self.exact_pattern = re.compile(trie_pattern(self.exact)) if self.exact else None
+        self.folded_pattern = re.compile(trie_pattern(self.folded)) if self.folded else None
+    
+    def __len__(self) -> int:
+        return len(self.exact) + len(self.folded)
+    
+    def __bool__(self) -> bool:
+        return bool(self.exact or self.folded)
+    
+    def edits(self, text: str) -> List[Tuple[int, int, str]]:
+        """(start, end, replacement) for every match, in order and not overlapping"""
+        edits = []
+        if self.exact_pattern:
+            edits += [(m.start(), m.end(), self.exact[m.group()]) for m in self.exact_pattern.finditer(text)]
+        if self.folded_pattern:
+            # Matches are whole keys of self.folded, at the same offsets as in text
+            lowered = lower_in_place(text)
+            edits += [(m.start(), m.end(), self.folded[m.group()]) for m in self.folded_pattern.finditer(lowered)]
+        if not (self.exact_pattern and self.folded_pattern):
+            return edits
+        
+        # Merge the two scans: leftmost first, then longest, then case-sensitive (stable sort)
+        edits.sort(key=lambda edit: (edit[0], edit[0] - edit[1]))
+        merged = []
+        end = 0
+        for edit in edits:
+            if edit[0] >= end:
+                merged.append(edit)
+                end = edit[1]
+        return merged
+    
+    def sub(self, text: str) -> str:
+        if not text or not self:
+            return text
+        pieces = []
+        position = 0
+        for start, end, replacement in self.edits(text):
+            pieces.append(text[position:start])
+            pieces.append(replacement)
+            position = end
+        pieces.append(text[position:])
+        return ''.join(pieces)
+    
+    def apply(self, rich: RichText) -> RichText:
+        """Replace in text that carries entities, keeping them in place"""
+        if not rich.text or not self:
+            return rich
+        return rich.splice(self.edits(rich.text))
+
+@lru_cache(maxsize=256)
+def compile_replace_rules(rules_json: Optional[str]) -> Optional[Replacer]:
+    """Replacer for a task's stored replace_rules, or None when it has none"""
+    if not rules_json:
+        return None
+    replacer = Replacer(json.loads(rules_json))
+    return replacer if replacer else None
+
+# Flags a str pattern compiled with MULTILINE and no inline flags ends up with
+_DEFAULT_FLAGS = re.compile('', re.MULTILINE).flags
+
+class LineRules:
+    """A task's line removal rules, all applied in one pass over the lines.
+
+    Rules are stored as {"keywords": [...], "lines": [...], "regex": [...]}.
+    Keywords match anywhere in a line, ignoring case, through one trie
+    regex. Line numbers start at 1 and count back from the end when
+    negative, so -1 is the last line. Regexes run in MULTILINE mode, so
+    ^ and $ match at line ends. Each one is compiled on its own first;
+    plain ones are then joined into one alternation, while ones with
+    groups or inline flags keep their own pattern so backreferences and
+    global flags mean what they did alone. A regex that does not compile
+    is skipped and kept in `invalid` with its error.
+    """
+    
+    def __init__(self, rules: Dict):
+        keywords = {lower_in_place(keyword.strip()) for keyword in rules.get('keywords', ()) if keyword.strip()}
+        self.keyword_pattern = re.compile(trie_pattern(keywords)) if keywords else None
+        self.regexes, self.invalid = [], {}
+        plain = []
+        for pattern in dict.fromkeys(pattern for pattern in rules.get('regex', ()) if pattern):
+            try:
+                compiled = re.compile(pattern, re.MULTILINE)
+            except re.error as e:
+                print(f"Invalid line regex: {pattern} - Error: {e}")
+                self.invalid[pattern] = str(e)
+                continue
+            if compiled.groups or compiled.flags != _DEFAULT_FLAGS:
+                self.regexes.append(compiled)
+            else:
+                plain.append(pattern)
+        if len(plain) == 1:
+            self.regexes.append(re.compile(plain[0], re.MULTILINE))
+        elif plain:
+            self.regexes.append(re.compile('|'.join(f"(?:{pattern})" for pattern in plain), re.MULTILINE))
+        self.lines = frozenset(number for number in rules.get('lines', ()) if number)
+    
+    def __bool__(self) -> bool:
+        return bool(self.keyword_pattern or self.regexes or self.lines)
+    
+    def removed_lines(self, text: str, starts: List[int]) -> Set[int]:
+        """Indexes of the lines to drop, given each line's start offset"""
+        count = len(starts)
+        removed = {number - 1 if number > 0 else count + number for number in self.lines}
+        removed = {index for index in removed if 0 <= index < count}
+        
+        searches = []
+        if self.keyword_pattern:
+            searches.append((self.keyword_pattern, lower_in_place(text)))
+        searches.extend((regex, text) for regex in self.regexes)
+        
+        for pattern, haystack in searches:
+            position = 0
+            while True:
+                match = pattern.search(haystack, position)
+                if match is None:
+                    break
+                index = bisect.bisect_right(starts, match.start()) - 1
+                removed.add(index)
+                # One hit is enough for a line; carry on from the next one
+                if index + 1 >= count:
+                    break
+                position = max(starts[index + 1], match.end())
+        return removed
+    
+    def apply(self, rich: RichText) -> RichText:
+        if not rich.text or not self:
+            return rich
+        text = rich.text
+        starts = [0]
+        position = text.find('\n')
+        while position != -1:
+            starts.append(position + 1)
+            position = text.find('\n', position + 1)
+        
+        removed = self.removed_lines(text, starts)
+        if not removed:
+            return rich
+        
+        count = len(starts)
+        ranges = [(starts[index], starts[index + 1] if index + 1 < count else len(text)) for index in removed]
+        if count - 1 in removed:
+            # The last kept line loses its newline, like '\n'.join of the kept lines
+            kept = [index for index in range(count) if index not in removed]
+            if kept:
+                ranges.append((starts[kept[-1] + 1] - 1, len(text)))
+        return rich.remove(ranges)
+
+@lru_cache(maxsize=256)
+def compile_line_rules(rules_json: Optional[str]) -> Optional[LineRules]:
+    """LineRules for a task's stored line_rules, or None when it has none"""
+    if not rules_json:
+        return None
+    line_rules = LineRules(json.loads(rules_json))
+    return line_rules if line_rules else None
@@ -0,0 +1,210 @@
+"""
+Telegram Forward Bot - Tracing Module
+
+Per-message traces: each incoming message opens a trace, and every timed
+stage and Bot API call made while handling it adds a span. Finished traces
+are kept in a ring buffer (a sample of normal ones, all slow ones), and
+slow traces are appended to a JSON-lines file so they survive restarts.
+The file is written in batches from a worker thread and rotated once it
+reaches TRACE_SLOW_FILE_MAX_BYTES.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional
+import config
+
+# (name, offset from trace start, duration, depth, failed)
+Span = tuple
+
+class Trace:
+    """Timing of one message through the pipeline"""
+    
+    __slots__ = ('trace_id', 'name', 'attrs', 'started_at', 'start', 'duration', 'spans', 'depth')
+    
+    def __init__(self, name: str, attrs: Dict):
+        self.trace_id = os.urandom(4).hex()
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[Span] = []
+        self.depth = 0
+    
+    def open(self) -> int:
+        """Enter a span; returns its nesting depth"""
+        self.depth += 1
+        return self.depth - 1
+    
+    def close(self, name: str, started: float, duration: float, depth: int, failed: bool = False):
+        self.depth = depth
+        if len(self.spans) < config.TRACE_MAX_SPANS:
+            self.spans.append((name, started - self.start, duration, depth, failed))
+    
+    def add(self, name: str, started: float, duration: float):
+        """Record a span timed elsewhere, at the current depth"""
+        self.close(name, started, duration, self.depth)
+    
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'attrs': self.attrs,
+            'spans': [
+                {'name': name, 'offset': round(offset, 6), 'duration': round(duration, 6), 'depth': depth, 'failed': failed}
+                for name, offset, duration, depth, failed in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+
+class _SpanScope:
+    __slots__ = ('trace', 'name', 'started', 'depth')
+    
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+    
+    def __enter__(self):
+        self.depth = self.trace.open()
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.close(self.name, self.started, time.perf_counter() - self.started, self.depth, exc_type is not None)
+        return False
+
+class _NullScope:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return None
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SCOPE = _NullScope()
+
+class _TraceScope:
+    __slots__ = ('tracer', 'trace', 'token')
+    
+    def __init__(self, tracer: 'Tracer', trace: Trace):
+        self.tracer = tracer
+        self.trace = trace
+    
+    def __enter__(self) -> Trace:
+        self.token = current_trace.set(self.trace)
+        return self.trace
+    
+    def __exit__(self, exc_type, exc, tb):
+        current_trace.reset(self.token)
+        self.tracer.finish(self.trace)
+        return False
+
+class Tracer:
+    """Starts traces and keeps the finished ones worth looking at.
+
+    Every trace records its spans, since whether it is slow is only known
+    at the end. Then slow traces are always kept and queued for
+    TRACE_SLOW_FILE, and others are kept with probability TRACE_SAMPLE_RATE.
+    """
+    
+    def __init__(self, enabled: bool = config.TRACING_ENABLED, sample_rate: float = config.TRACE_SAMPLE_RATE,
+                 slow_seconds: float = config.TRACE_SLOW_SECONDS, slow_file: str = config.TRACE_SLOW_FILE,
+                 buffer_size: int = config.TRACE_BUFFER_SIZE, max_bytes: int = config.TRACE_SLOW_FILE_MAX_BYTES):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.slow_file = slow_file
+        self.max_bytes = max_bytes
+        self.recent: Deque[Trace] = deque(maxlen=buffer_size)
+        self._unwritten: Deque[str] = deque(maxlen=buffer_size)  # Slow trace lines waiting for the next flush
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    def trace(self, name: str, **attrs):
+        """Context manager running its body inside a new trace"""
+        if not self.enabled:
+            return NULL_SCOPE
+        return _TraceScope(self, Trace(name, attrs))
+    
+    def span(self, name: str):
+        """Context manager adding a span to the current trace, if there is one"""
+        trace = current_trace.get()
+        if trace is None:
+            return NULL_SCOPE
+        return _SpanScope(trace, name)
+    
+    def finish(self, trace: Trace):
+        trace.duration = time.perf_counter() - trace.start
+        if trace.duration >= self.slow_seconds:
+            self.recent.append(trace)
+            self._persist(trace)
+        elif random.random() < self.sample_rate:
+            self.recent.append(trace)
+    
+    def _persist(self, trace: Trace):
+        if not self.slow_file:
+            return
+        self._unwritten.append(json.dumps(trace.to_dict(), default=str) + '\n')
+        if self._flush_task is None:
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                # No event loop to hand the write to
+                self._write(self._take())
+    
+    def _take(self) -> List[str]:
+        lines = list(self._unwritten)
+        self._unwritten.clear()
+        return lines
+    
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(config.TRACE_FLUSH_SECONDS)
+        finally:
+            self._flush_task = None
+            lines = self._take()
+            if lines:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+    
+    def _write(self, lines: List[str]):
+        """Append to the slow trace file, rotating it first if it is full"""
+        try:
+            if os.path.exists(self.slow_file) and os.path.getsize(self.slow_file) >= self.max_bytes:
+                os.replace(self.slow_file, f"{self.slow_file}.1")
+            with open(self.slow_file, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+        except OSError as e:
+            print(f"Slow trace write error: {e}")
+    
+    async def close(self):
+        """Write out slow traces still waiting for a flush"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        lines = self._take()
+        if lines:
+            self._write(lines)
+    
+    def slowest(self, count: int = 5) -> List[Trace]:
+        return sorted(self.recent, key=lambda trace: trace.duration, reverse=True)[:count]
+    
+    def get(self, trace_id: str) -> Optional[Trace]:
+        for trace in self.recent:
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+# Global tracer
+tracer = Tracer()
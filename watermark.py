@@ -1,112 +1,324 @@
 """
 Telegram Forward Bot - Watermark Module
 """
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, JpegImagePlugin
 import io
-from typing import Optional
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 import config
+from downloads import download_manager
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
 
 class WatermarkProcessor:
     def __init__(self):
         self.default_font_size = 24
+        self.padding = 20  # Distance between the watermark and the image edge
+        self.bg_padding = 5  # Background box around the text
+        self._fonts = {}  # font size -> loaded font
+        self._stamps = OrderedDict()  # (text, font size) -> pre-rendered patch
+        self._file_ids = OrderedDict()  # cache key -> uploaded watermarked file_id
+        self._logos = OrderedDict()  # (path, mtime) -> decoded RGBA logo
+        self._logo_patches = OrderedDict()  # (path, mtime, width bucket) -> pre-scaled logo
+        self._missing_logos = set()  # Logo paths already reported missing
+    
+    # ========== STAMP CACHE ==========
+    def _get_font(self, size: int):
+        """Load the watermark font once per size"""
+        font = self._fonts.get(size)
+        if font is None:
+            try:
+                font = ImageFont.truetype(FONT_PATH, size)
+            except Exception:
+                font = ImageFont.load_default()
+            self._fonts[size] = font
+        return font
+    
+    def _get_text_stamp(self, text: str, font_size: int) -> Tuple[Image.Image, int, int, int]:
+        """Return the pre-rendered RGBA patch for a text watermark.
+
+        The patch holds the semi-transparent background box and the text, so
+        rendering a watermark is a single paste into the target region. Returns
+        (patch, offset of the text inside the patch, text width, text height).
+        The position only decides where the patch goes, so it is not part of
+        the cache key.
+        """
+        key = (text, font_size)
+        cached = self._stamps.get(key)
+        if cached is not None:
+            self._stamps.move_to_end(key)
+            return cached
+        
+        font = self._get_font(font_size)
+        bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+        
+        # The box is sized from the text extents, but glyphs are drawn from the
+        # font origin, so the patch must also fit anything below/right of the box
+        pad = self.bg_padding
+        box_width = text_width + 2 * pad
+        box_height = text_height + 2 * pad
+        stamp = Image.new('RGBA', (max(box_width, bbox[2] + pad) + 1,
+                                   max(box_height, bbox[3] + pad) + 1), (255, 255, 255, 0))
+        draw = ImageDraw.Draw(stamp)
+        draw.rectangle([0, 0, box_width, box_height], fill=(0, 0, 0, 128))
+        draw.text((pad, pad), text, font=font, fill=(255, 255, 255, 255))
+        
+        cached = (stamp, pad, text_width, text_height)
+        self._stamps[key] = cached
+        if len(self._stamps) > config.WATERMARK_STAMP_CACHE_SIZE:
+            self._stamps.popitem(last=False)
+        return cached
+    
+    def _stamp_origin(self, img_size: Tuple[int, int], text_width: int, text_height: int,
+                      position: str) -> Tuple[int, int]:
+        """Calculate where a watermark of the given size starts for a position"""
+        padding = self.padding
+        img_width, img_height = img_size
+        
+        if position == 'bottom-left':
+            return padding, img_height - text_height - padding
+        elif position == 'top-right':
+            return img_width - text_width - padding, padding
+        elif position == 'top-left':
+            return padding, padding
+        elif position == 'center':
+            return (img_width - text_width) // 2, (img_height - text_height) // 2
+        # bottom-right and unknown positions
+        return img_width - text_width - padding, img_height - text_height - padding
     
-    def add_text_watermark(self, image_data: bytes, text: str, 
+    # ========== DECODE / ENCODE ==========
+    def _open_image(self, image_data) -> Tuple[Image.Image, dict]:
+        """Decode an image for watermarking and pick its JPEG save options.
+        
+        ``image_data`` is either the raw bytes or a seekable file object.
+
+        In low-memory mode a JPEG that will be downscaled is decoded at a
+        reduced DCT scale (draft/reduce) instead of at full resolution, and
+        the source quantization tables and chroma subsampling are kept so the
+        re-encode matches the original quality.
+        """
+        if isinstance(image_data, (bytes, bytearray)):
+            image_data = io.BytesIO(image_data)
+        img = Image.open(image_data)
+        low_memory = config.WATERMARK_LOW_MEMORY
+        save_kwargs = {'quality': config.WATERMARK_JPEG_QUALITY}
+        
+        if low_memory and img.format == 'JPEG' and img.mode == 'RGB' and img.quantization:
+            subsampling = JpegImagePlugin.get_sampling(img)
+            save_kwargs = {'qtables': img.quantization}
+            if subsampling != -1:
+                save_kwargs['subsampling'] = subsampling
+        
+        max_dimension = config.WATERMARK_MAX_DIMENSION
+        if max_dimension and max(img.size) > max_dimension:
+            # With a reducing gap thumbnail() lets the JPEG decoder scale down
+            # (draft) and reduces by whole factors before resampling; without
+            # one the photo is decoded and resampled at full size
+            img.thumbnail((max_dimension, max_dimension),
+                          reducing_gap=1.0 if low_memory else None)
+        
+        # JPEG output has no alpha, so flatten transparent images onto white
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[3])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        return img, save_kwargs
+    
+    def _encode(self, img: Image.Image, save_kwargs: dict) -> bytes:
+        output = io.BytesIO()
+        img.save(output, format='JPEG', **save_kwargs)
+        return output.getvalue()
+    
+    # ========== TEXT WATERMARK ==========
+    def add_text_watermark(self, image_data: bytes, text: str,
                           position: str = 'bottom-right') -> bytes:
         """Add text watermark to image"""
         try:
-            # Open image
-            img = Image.open(io.BytesIO(image_data))
+            img, save_kwargs = self._open_image(image_data)
             
-            # Convert to RGBA if necessary
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
+            stamp, offset, text_width, text_height = self._get_text_stamp(text, self.default_font_size)
+            x, y = self._stamp_origin(img.size, text_width, text_height, position)
             
-            # Create transparent overlay
-            overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
-            draw = ImageDraw.Draw(overlay)
-            
-            # Try to use a font, fallback to default
-            try:
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 
-                                         self.default_font_size)
-            except:
-                font = ImageFont.load_default()
-            
-            # Calculate text size
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            
-            # Calculate position
-            padding = 20
-            img_width, img_height = img.size
-            
-            if position == 'bottom-right':
-                x = img_width - text_width - padding
-                y = img_height - text_height - padding
-            elif position == 'bottom-left':
-                x = padding
-                y = img_height - text_height - padding
-            elif position == 'top-right':
-                x = img_width - text_width - padding
-                y = padding
-            elif position == 'top-left':
-                x = padding
-                y = padding
-            elif position == 'center':
-                x = (img_width - text_width) // 2
-                y = (img_height - text_height) // 2
-            else:
-                x = img_width - text_width - padding
-                y = img_height - text_height - padding
-            
-            # Draw semi-transparent background
-            bg_padding = 5
-            draw.rectangle(
-                [x - bg_padding, y - bg_padding, 
-                 x + text_width + bg_padding, y + text_height + bg_padding],
-                fill=(0, 0, 0, 128)
-            )
-            
-            # Draw text
-            draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
-            
-            # Composite images
-            result = Image.alpha_composite(img, overlay)
-            
-            # Convert back to RGB for JPEG compatibility
-            if result.mode == 'RGBA':
-                # Create white background
-                background = Image.new('RGB', result.size, (255, 255, 255))
-                background.paste(result, mask=result.split()[3])  # Use alpha channel as mask
-                result = background
-            
-            # Save to bytes
-            output = io.BytesIO()
-            result.save(output, format='JPEG', quality=95)
-            output.seek(0)
-            
-            return output.getvalue()
+            # Blend the cached patch into the watermark region only
+            img.paste(stamp, (x - offset, y - offset), stamp)
             
+            return self._encode(img, save_kwargs)
+        
         except Exception as e:
             print(f"Watermark error: {e}")
-            return image_data  # Return original if error
+            # Return original if error (file objects are only valid while downloading)
+            return image_data if isinstance(image_data, (bytes, bytearray)) else None
+    
+    async def process_photo_with_watermark(self, bot, photo_file_id: str,
+                                           watermark_text: str,
+                                           position: str = 'bottom-right',
+                                           logo_path: str = None,
+                                           logo_scale: float = None) -> bytes:
+        """Download photo and add watermark (the logo wins when both are set)"""
+        try:
+            # Stream the photo into a pooled buffer and decode it in place
+            async with download_manager.open(bot, photo_file_id) as image_file:
+                if logo_path:
+                    return self.add_logo_watermark(image_file, logo_path, position, logo_scale)
+                return self.add_text_watermark(image_file, watermark_text, position)
+        
+        except Exception as e:
+            print(f"Photo watermark error: {e}")
+            return None
+    
+    # ========== LOGO WATERMARK ==========
+    def logo_path(self, task_id: int) -> str:
+        return os.path.join(config.WATERMARK_ASSETS_DIR, f"task_{task_id}.png")
+    
+    def save_logo(self, task_id: int, image_data: bytes) -> str:
+        """Validate an uploaded logo and store it as the task's PNG asset"""
+        logo = Image.open(io.BytesIO(image_data))
+        logo = logo.convert('RGBA')
+        
+        # Nothing is ever rendered larger than the biggest bucket
+        largest = max(config.WATERMARK_LOGO_BUCKETS)
+        if logo.width > largest:
+            logo.thumbnail((largest, largest * logo.height // logo.width + 1), Image.LANCZOS)
+        
+        os.makedirs(config.WATERMARK_ASSETS_DIR, exist_ok=True)
+        path = self.logo_path(task_id)
+        logo.save(path, format='PNG')
+        return path
+    
+    def delete_logo(self, task_id: int):
+        try:
+            os.remove(self.logo_path(task_id))
+        except FileNotFoundError:
+            pass
+    
+    def _get_logo_patch(self, path: str, target_width: int) -> Image.Image:
+        """Return the logo pre-scaled to the size bucket closest below target_width"""
+        mtime = os.path.getmtime(path)  # A replaced logo gets fresh cache entries
+        buckets = config.WATERMARK_LOGO_BUCKETS
+        bucket = max([b for b in buckets if b <= target_width], default=min(buckets))
+        
+        key = (path, mtime, bucket)
+        patch = self._logo_patches.get(key)
+        if patch is not None:
+            self._logo_patches.move_to_end(key)
+            return patch
+        
+        logo_key = (path, mtime)
+        logo = self._logos.get(logo_key)
+        if logo is None:
+            with Image.open(path) as source:
+                logo = source.convert('RGBA')
+            self._logos[logo_key] = logo
+            if len(self._logos) > config.WATERMARK_STAMP_CACHE_SIZE:
+                self._logos.popitem(last=False)
+        
+        # Never upscale past the logo's own resolution
+        width = min(bucket, logo.width)
+        patch = logo if width == logo.width else logo.resize(
+            (width, max(1, round(logo.height * width / logo.width))), Image.LANCZOS
+        )
+        self._logo_patches[key] = patch
+        if len(self._logo_patches) > config.WATERMARK_STAMP_CACHE_SIZE:
+            self._logo_patches.popitem(last=False)
+        return patch
     
-    async def process_photo_with_watermark(self, bot, photo_file_id: str, 
-                                           watermark_text: str, 
-                                           position: str = 'bottom-right') -> bytes:
-        """Download photo and add watermark"""
+    def add_logo_watermark(self, image_data, logo_path: str,
+                           position: str = 'bottom-right', scale: float = None) -> bytes:
+        """Add a logo watermark sized relative to the image width"""
         try:
-            # Download the photo
-            file = await bot.get_file(photo_file_id)
-            image_data = await file.download_as_bytearray()
+            img, save_kwargs = self._open_image(image_data)
             
-            # Add watermark
-            return self.add_text_watermark(bytes(image_data), watermark_text, position)
+            scale = scale or config.WATERMARK_LOGO_DEFAULT_SCALE
+            patch = self._get_logo_patch(logo_path, int(img.width * scale))
+            x, y = self._stamp_origin(img.size, patch.width, patch.height, position)
+            img.paste(patch, (x, y), patch)
             
+            return self._encode(img, save_kwargs)
+        
         except Exception as e:
-            print(f"Photo watermark error: {e}")
+            print(f"Logo watermark error: {e}")
+            return image_data if isinstance(image_data, (bytes, bytearray)) else None
+    
+    def task_logo(self, task: Dict) -> Optional[Tuple[str, float]]:
+        """(path, mtime) of the task's logo, or None if it has none or the file is gone"""
+        logo_path = task.get('watermark_logo')
+        if not logo_path:
+            return None
+        try:
+            mtime = os.path.getmtime(logo_path)
+        except OSError:
+            if logo_path not in self._missing_logos:
+                self._missing_logos.add(logo_path)
+                fallback = 'using the text watermark' if task.get('watermark_text') else 'sending without a watermark'
+                print(f"Watermark logo missing for task {task.get('task_id')}: {logo_path}; {fallback}")
             return None
+        self._missing_logos.discard(logo_path)
+        return logo_path, mtime
+    
+    def watermark_key(self, task: Dict, logo: Optional[Tuple[str, float]]) -> Optional[str]:
+        """Describe a task's watermark for the uploaded file cache (None if it has none).
+
+        `logo` is what task_logo returned for the task, so the file is looked
+        up once per send. A logo whose file is missing falls back to the
+        task's text watermark.
+        """
+        if logo:
+            return f"logo:{logo[0]}:{logo[1]}:{task.get('watermark_logo_scale')}"
+        return task.get('watermark_text') or None
+    
+    # ========== UPLOADED FILE CACHE ==========
+    def _file_cache_key(self, file_unique_id: str, watermark: str, position: str) -> str:
+        return f"{file_unique_id}|{position}|{watermark}"
+    
+    async def get_cached_file_id(self, db, file_unique_id: str, watermark: str,
+                                 position: str = 'bottom-right') -> Optional[str]:
+        """Return the file_id of an already uploaded watermarked copy, if any"""
+        key = self._file_cache_key(file_unique_id, watermark, position)
+        file_id = self._file_ids.get(key)
+        if file_id is not None:
+            self._file_ids.move_to_end(key)
+            return file_id
+        
+        try:
+            file_id = await db.get_watermark_file_id(key)
+        except Exception as e:
+            print(f"Watermark cache lookup error: {e}")
+            return None
+        if file_id:
+            self._remember_in_memory(key, file_id)
+        return file_id
+    
+    async def remember_file_id(self, db, file_unique_id: str, watermark: str,
+                               position: str, file_id: str):
+        """Remember the file_id Telegram returned for a watermarked upload"""
+        key = self._file_cache_key(file_unique_id, watermark, position)
+        self._remember_in_memory(key, file_id)
+        try:
+            await db.save_watermark_file_id(key, file_id, config.WATERMARK_FILE_ID_CACHE_SIZE)
+        except Exception as e:
+            print(f"Watermark cache save error: {e}")
+    
+    async def forget_file_id(self, db, file_unique_id: str, watermark: str, position: str):
+        """Drop a cached file_id that Telegram no longer accepts"""
+        key = self._file_cache_key(file_unique_id, watermark, position)
+        self._file_ids.pop(key, None)
+        try:
+            await db.delete_watermark_file_id(key)
+        except Exception as e:
+            print(f"Watermark cache delete error: {e}")
+    
+    def _remember_in_memory(self, key: str, file_id: str):
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        if len(self._file_ids) > config.WATERMARK_FILE_ID_MEMORY_SIZE:
+            self._file_ids.popitem(last=False)
 
 # Global watermark processor
 watermark_processor = WatermarkProcessor()